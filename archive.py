@@ -0,0 +1,221 @@
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import db
+from chat_codec import decode_table
+
+# Offline export and retention for users.db. Safe to run next to the app:
+# reads go through chunked cursors and every write is a short transaction.
+#   python archive.py export --out chats.jsonl.gz
+#   python archive.py export --out alice.parquet --user alice
+#   python archive.py compact --retention-days 365
+RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", "0"))
+RETENTION_MAX_CONVERSATIONS = int(os.environ.get("RETENTION_MAX_CONVERSATIONS", "0"))
+CHUNK_SIZE = int(os.environ.get("ARCHIVE_CHUNK_SIZE", "1000"))
+VACUUM_STEP_PAGES = 2048
+
+EXPORT_COLUMNS = ("conversation_id", "username", "title", "created_at", "updated_at",
+                  "seq", "role", "content", "table", "timestamp")
+# Walks the messages primary key, so rows stream out without a sort.
+EXPORT_ALL = """
+    SELECT m.conversation_id, c.username, c.title, c.created_at, c.updated_at,
+           m.seq, m.role, m.content, m.table_data, m.timestamp
+    FROM messages m JOIN conversations c ON c.id = m.conversation_id
+    ORDER BY m.conversation_id, m.seq
+"""
+# Walks idx_conversations_user_updated; only one conversation's messages are
+# ever sorted at a time.
+EXPORT_USER = """
+    SELECT m.conversation_id, c.username, c.title, c.created_at, c.updated_at,
+           m.seq, m.role, m.content, m.table_data, m.timestamp
+    FROM conversations c JOIN messages m ON m.conversation_id = c.id
+    WHERE c.username = ?
+    ORDER BY c.updated_at, c.id, m.seq
+"""
+# Past the age cutoff, or beyond the newest `max` of their owner.
+SELECT_EXPIRED = """
+    SELECT id FROM (
+        SELECT id, updated_at, ROW_NUMBER() OVER (PARTITION BY username ORDER BY updated_at DESC) AS n
+        FROM conversations
+    ) WHERE updated_at < ? OR (? > 0 AND n > ?)
+    LIMIT ?
+"""
+# Search rows go by rowid (looked up on the messages key) before their
+# messages; the FTS table's conversation_id column is not indexed.
+DELETE_CONVERSATIONS = (
+    "DELETE FROM message_search WHERE rowid IN (SELECT search_rowid FROM messages WHERE conversation_id IN ({}))",
+    "DELETE FROM recommendations WHERE conversation_id IN ({})",
+    "DELETE FROM messages WHERE conversation_id IN ({})",
+    "DELETE FROM conversations WHERE id IN ({})",
+)
+
+def connect(path):
+    # Creates or migrates the schema first, then a dedicated connection.
+    db.configure(path, write_behind=False, pool_size=1)
+    conn = sqlite3.connect(path, timeout=30)
+    for pragma in db.PRAGMAS:
+        conn.execute(pragma)
+    # A one-pass scan gains nothing from mmap, and mapped pages would count
+    # against the process for the whole file.
+    conn.execute("PRAGMA mmap_size=0")
+    return conn
+
+def file_bytes(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+# ===== EXPORT =====
+def iter_chunks(conn, username=None, chunk_size=CHUNK_SIZE):
+    cursor = conn.execute(EXPORT_USER, (username,)) if username else conn.execute(EXPORT_ALL)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+def export_record(row):
+    record = dict(zip(EXPORT_COLUMNS, row))
+    table = decode_table(record["table"])
+    record["table"] = table.records() if table else None
+    return record
+
+def write_jsonl(path, chunks):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.writelines(json.dumps(export_record(row), ensure_ascii=False) + "\n" for row in chunk)
+            yield len(chunk)
+
+def write_parquet(path, chunks):
+    # One row group per chunk; tables are kept as JSON text.
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet export needs pyarrow (pip install pyarrow)")
+    schema = pa.schema([(name, pa.int64() if name == "seq" else pa.string()) for name in EXPORT_COLUMNS])
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            records = [export_record(row) for row in chunk]
+            for record in records:
+                if record["table"] is not None:
+                    record["table"] = json.dumps(record["table"], ensure_ascii=False)
+            writer.write_table(pa.Table.from_pylist(records, schema))
+            yield len(chunk)
+
+def export(conn, out, username=None, fmt=None, chunk_size=CHUNK_SIZE):
+    fmt = fmt or ("parquet" if out.endswith(".parquet") else "jsonl")
+    writer = write_parquet if fmt == "parquet" else write_jsonl
+    started = time.perf_counter()
+    rows = sum(writer(out, iter_chunks(conn, username, chunk_size)))
+    elapsed = time.perf_counter() - started
+    return {"format": fmt, "rows": rows, "elapsed_s": elapsed, "rows_per_s": rows / elapsed if elapsed else 0.0,
+            "bytes": os.path.getsize(out)}
+
+# ===== COMPACTION =====
+def apply_retention(conn, retention_days=RETENTION_DAYS, max_conversations=RETENTION_MAX_CONVERSATIONS,
+                    chunk_size=CHUNK_SIZE):
+    # Batches of whole conversations (with their messages, recommendation
+    # and search rows), one short transaction each.
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat() if retention_days > 0 else ""
+    conversations = messages = legacy = 0
+    while True:
+        ids = [row[0] for row in conn.execute(SELECT_EXPIRED, (cutoff, max_conversations, max_conversations, chunk_size))]
+        if not ids:
+            break
+        marks = ",".join("?" * len(ids))
+        with conn:
+            counts = [conn.execute(sql.format(marks), ids).rowcount for sql in DELETE_CONVERSATIONS]
+        messages += counts[2]
+        conversations += counts[3]
+    while cutoff:
+        with conn:
+            deleted = conn.execute("DELETE FROM chat_history WHERE id IN "
+                                   "(SELECT id FROM chat_history WHERE timestamp < ? LIMIT ?)",
+                                   (cutoff, chunk_size)).rowcount
+        legacy += deleted
+        if not deleted:
+            break
+    return conversations, messages, legacy
+
+def vacuum(conn, convert=False, step_pages=VACUUM_STEP_PAGES):
+    # Returns free pages to the OS a step at a time, so writers only wait
+    # for one step. Needs auto_vacuum=INCREMENTAL, which new databases get;
+    # an older one is switched over by a single full VACUUM on request.
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode != 2:
+        if not convert:
+            return False
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free:
+        conn.execute(f"PRAGMA incremental_vacuum({step_pages})").fetchall()
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free:
+            break
+        free = remaining
+    return True
+
+def compact(conn, path, retention_days=RETENTION_DAYS, max_conversations=RETENTION_MAX_CONVERSATIONS,
+            run_vacuum=True, convert=False, chunk_size=CHUNK_SIZE):
+    before = file_bytes(path)
+    started = time.perf_counter()
+    report = {}
+    # init_db has already moved every snapshot that parses; this retries the
+    # rest and reports how many are left.
+    report["legacy_scanned"], report["legacy_superseded"] = db.dedupe_legacy(conn, chunk_size)
+    report["legacy_migrated"], report["legacy_unreadable"] = db.migrate_legacy(conn, chunk_size)
+    (report["expired_conversations"], report["expired_messages"],
+     report["expired_legacy"]) = apply_retention(conn, retention_days, max_conversations, chunk_size)
+    report["vacuumed"] = vacuum(conn, convert) if run_vacuum else False
+    # Fold the deletes back into the main file so its size is the real one.
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    report["elapsed_s"] = time.perf_counter() - started
+    processed = report["legacy_scanned"] + report["legacy_migrated"] + report["expired_messages"] + report["expired_conversations"]
+    report["rows_per_s"] = processed / report["elapsed_s"] if report["elapsed_s"] else 0.0
+    report["bytes_before"] = before
+    report["bytes_reclaimed"] = before - file_bytes(path)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, compact and prune users.db")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows per cursor fetch and per write transaction")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    exporter = subparsers.add_parser("export", help="Stream conversations to compressed JSONL or Parquet")
+    exporter.add_argument("--out", required=True, help="Output file (.jsonl, .jsonl.gz or .parquet)")
+    exporter.add_argument("--user", help="Only this user's conversations")
+    exporter.add_argument("--format", choices=["jsonl", "parquet"], help="Defaults to the output file's extension")
+    compactor = subparsers.add_parser("compact", help="Drop redundant snapshots, apply retention and vacuum")
+    compactor.add_argument("--retention-days", type=int, default=RETENTION_DAYS,
+                           help="Delete conversations not updated for this many days (0 keeps all)")
+    compactor.add_argument("--max-conversations", type=int, default=RETENTION_MAX_CONVERSATIONS,
+                           help="Keep only each user's newest N conversations (0 keeps all)")
+    compactor.add_argument("--no-vacuum", action="store_true")
+    compactor.add_argument("--convert-vacuum", action="store_true",
+                           help="One full VACUUM to enable incremental vacuum on an older database")
+    args = parser.parse_args()
+    conn = connect(args.db)
+    if args.command == "export":
+        result = export(conn, args.out, args.user, args.format, args.chunk_size)
+        print(f"exported {result['rows']} messages to {args.out} ({result['format']}, {result['bytes'] / 1024:.1f} KiB) "
+              f"in {result['elapsed_s']:.2f}s, {result['rows_per_s']:.0f} rows/s")
+        return
+    result = compact(conn, args.db, args.retention_days, args.max_conversations, not args.no_vacuum,
+                     args.convert_vacuum, args.chunk_size)
+    print(f"legacy snapshots: {result['legacy_scanned']} scanned, {result['legacy_superseded']} superseded, "
+          f"{result['legacy_migrated']} migrated, {result['legacy_unreadable']} unreadable, "
+          f"{result['expired_legacy']} expired")
+    print(f"retention: {result['expired_conversations']} conversations, {result['expired_messages']} messages expired")
+    if not args.no_vacuum and not result["vacuumed"]:
+        print("incremental vacuum is off for this database; rerun with --convert-vacuum (one full VACUUM)")
+    print(f"{result['elapsed_s']:.2f}s, {result['rows_per_s']:.0f} rows/s; "
+          f"reclaimed {result['bytes_reclaimed'] / 1024:.1f} KiB of {result['bytes_before'] / 1024:.1f} KiB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import base64
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from metrics import span
+
+# ===== PASSWORD HASHING =====
+# bcrypt runs in a small, bounded process pool so a burst of logins can use at
+# most HASH_WORKERS cores and never stalls the Streamlit script threads. A
+# hash that is not done within HASH_TIMEOUT, or a pool whose worker died,
+# raises HashingUnavailableError so callers can ask the user to retry; a
+# broken pool is replaced on the next call.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_TIMEOUT = float(os.environ.get("HASH_TIMEOUT", "10"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+class HashingUnavailableError(Exception):
+    pass
+
+# bcrypt is only imported inside the hashing workers.
+def _hashpw(password, rounds):
+    import bcrypt
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _checkpw(password, hashed):
+    import bcrypt
+    return bcrypt.checkpw(password, hashed)
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn, not fork: the server process is heavily threaded.
+                _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def _as_bytes(value):
+    return value.encode("utf-8") if isinstance(value, str) else value
+
+def _reset_executor(executor):
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _run_hash(fn, *args):
+    executor = get_executor()
+    try:
+        future = executor.submit(fn, *args)
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeoutError:
+        # concurrent.futures' own TimeoutError (the builtin one only from
+        # 3.11). Still queued behind the burst: drop it rather than hash for
+        # nobody.
+        future.cancel()
+        raise HashingUnavailableError("Password hashing timed out")
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        raise HashingUnavailableError("Password hashing pool failed")
+
+def hash_password(password, rounds=None):
+    with span("bcrypt_hash"):
+        return _run_hash(_hashpw, password.encode("utf-8"), rounds or BCRYPT_ROUNDS)
+
+def check_password(password, hashed):
+    with span("bcrypt_check"):
+        return _run_hash(_checkpw, password.encode("utf-8"), _as_bytes(hashed))
+
+def hash_rounds(hashed):
+    # "$2b$12$<salt+hash>" -> 12
+    try:
+        return int(_as_bytes(hashed).split(b"$")[2])
+    except (IndexError, ValueError):
+        return None
+
+def needs_rehash(hashed, rounds=None):
+    return hash_rounds(hashed) != (rounds or BCRYPT_ROUNDS)
+
+# ===== RATE LIMITING =====
+# Token buckets checked before any bcrypt work: each attempt costs one token,
+# and tokens refill continuously up to the burst size.
+LOGIN_USER_BURST = float(os.environ.get("LOGIN_USER_BURST", "5"))
+LOGIN_USER_REFILL_SECONDS = float(os.environ.get("LOGIN_USER_REFILL_SECONDS", "30"))
+LOGIN_IP_BURST = float(os.environ.get("LOGIN_IP_BURST", "20"))
+LOGIN_IP_REFILL_SECONDS = float(os.environ.get("LOGIN_IP_REFILL_SECONDS", "3"))
+# Proxies in front of the app that append to X-Forwarded-For. The client is
+# the entry the outermost of them added, counted from the right; entries to
+# its left came from the client and can be anything.
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", "1"))
+
+class TokenBucketLimiter:
+    def __init__(self, burst, refill_seconds, max_keys=10000):
+        self.burst = burst
+        self.rate = 1.0 / refill_seconds
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self._prune(now)
+            return allowed
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping.
+        for key, (tokens, updated) in list(self.buckets.items()):
+            if tokens + (now - updated) * self.rate >= self.burst:
+                del self.buckets[key]
+
+user_limiter = TokenBucketLimiter(LOGIN_USER_BURST, LOGIN_USER_REFILL_SECONDS)
+ip_limiter = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_REFILL_SECONDS)
+
+def client_ip(forwarded_for, real_ip=None, trusted_proxies=TRUSTED_PROXIES):
+    if trusted_proxies <= 0:
+        return None
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    if hops:
+        return hops[-min(trusted_proxies, len(hops))]
+    return real_ip
+
+def allow_attempt(username, ip=None):
+    if ip is not None and not ip_limiter.allow(ip):
+        return False
+    return user_limiter.allow(username.lower())
+
+# ===== SESSION TOKENS =====
+# A logged-in browser carries "<payload>.<signature>" (HMAC-SHA256 over
+# the session id, username and expiry), so any replica sharing
+# SESSION_SECRET can check it without a lookup before restoring the session
+# from the storage backend. Without SESSION_SECRET a random per-process key
+# is used and tokens only work on the replica that issued them.
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "")
+SESSION_TTL = float(os.environ.get("SESSION_TTL", str(7 * 24 * 3600)))
+
+_session_key = SESSION_SECRET.encode("utf-8") or secrets.token_bytes(32)
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload, key):
+    return _b64(hmac.new(key, payload.encode("ascii"), hashlib.sha256).digest())
+
+def issue_session_token(session_id, username, ttl=SESSION_TTL, key=None):
+    claims = {"sid": session_id, "sub": username, "exp": int(time.time() + ttl)}
+    payload = _b64(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload, key or _session_key)}"
+
+def verify_session_token(token, key=None):
+    # -> (session_id, username) for a genuine, unexpired token, else None.
+    payload, _, signature = (token or "").partition(".")
+    try:
+        if not hmac.compare_digest(signature.encode("utf-8"), _sign(payload, key or _session_key).encode("ascii")):
+            return None
+        claims = json.loads(_unb64(payload))
+    except (ValueError, UnicodeError):
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims.get("sid"), claims.get("sub")
@@ -0,0 +1,688 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+# Offline micro-benchmarks. Run e.g. `python bench.py codec --turns 200`.
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(rows, headers):
+    widths = [max(len(str(r[i])) for r in rows + [headers]) for i in range(len(headers))]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for r in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(r, widths)))
+
+def make_rows(turn, rows_per_table):
+    categories = ["Clothing 🌿", "Shopping 🛍️", "Care 🧼", "Resources 📚"]
+    return [{
+        "Category": categories[(turn + i) % len(categories)],
+        "Recommendation": f"Choose recycled fibers for item {i}; avoid fast fashion",
+        "Impact": f"Saves ~{(turn + 1) * (i + 1)}L water per garment"
+    } for i in range(rows_per_table)]
+
+def chat_timestamps(turns):
+    # One per message, so a chat and its legacy twin can share them.
+    now = datetime.now()
+    return [(now + timedelta(seconds=i)).isoformat() for i in range(2 * turns + 1)]
+
+def make_chat(turns, rows_per_table, timestamps=None):
+    from chat_records import ChatMessage
+    from table_parser import recommendation_table
+    timestamps = timestamps or chat_timestamps(turns)
+    messages = [ChatMessage("assistant", "Welcome! 🌱", timestamp=timestamps[0])]
+    for turn in range(turns):
+        messages.append(ChatMessage("user", f"Question {turn} about organic cotton and Tencel?",
+                                    timestamp=timestamps[2 * turn + 1]))
+        messages.append(ChatMessage("assistant", "Here are some ideas 🌿\n" * 8,
+                                    recommendation_table(make_rows(turn, rows_per_table)), timestamps[2 * turn + 2]))
+    return messages
+
+def make_legacy_chat(turns, rows_per_table, timestamps=None):
+    # The pre-chat_records session shape: dicts holding a DataFrame per table.
+    from pandas import DataFrame
+    timestamps = timestamps or chat_timestamps(turns)
+    messages = [{"role": "assistant", "content": "Welcome! 🌱", "table_data": None,
+                 "timestamp": timestamps[0]}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Question {turn} about organic cotton and Tencel?",
+                         "table_data": None, "timestamp": timestamps[2 * turn + 1]})
+        messages.append({"role": "assistant", "content": "Here are some ideas 🌿\n" * 8,
+                         "table_data": DataFrame(make_rows(turn, rows_per_table)), "timestamp": timestamps[2 * turn + 2]})
+    return messages
+
+def bench_codec(args):
+    from pandas import DataFrame
+    from chat_codec import encode_messages, decode_messages
+    messages = make_chat(args.turns, args.rows)
+    legacy_messages = make_legacy_chat(args.turns, args.rows)
+    # str()/eval() only round-trips when tables are plain records, so the
+    # baseline converts tables to records before str() and back to DataFrames
+    # after eval(); the raw DataFrame repr is not parseable at all.
+    def legacy_encode():
+        return str([dict(m, table_data=m["table_data"].to_dict("records") if m["table_data"] is not None else None)
+                    for m in legacy_messages])
+
+    def legacy_decode(text):
+        return [dict(m, table_data=DataFrame(m["table_data"]) if m["table_data"] else None) for m in eval(text)]
+
+    legacy_blob = legacy_encode()
+    blob = encode_messages(messages)
+    decoded = decode_messages(blob)
+    assert [m.content for m in decoded] == [m.content for m in messages]
+    assert all((a.table is None and b.table is None) or (a.table.columns, a.table.rows) == (b.table.columns, b.table.rows)
+               for a, b in zip(decoded, messages))
+    rows = [
+        ("str/eval", len(legacy_blob.encode("utf-8")),
+         f"{timed(legacy_encode, args.repeat) * 1000:.2f}",
+         f"{timed(lambda: legacy_decode(legacy_blob), args.repeat) * 1000:.2f}"),
+        ("chat_codec", len(blob.encode("utf-8")),
+         f"{timed(lambda: encode_messages(messages), args.repeat) * 1000:.2f}",
+         f"{timed(lambda: decode_messages(blob), args.repeat) * 1000:.2f}"),
+    ]
+    print(f"{len(messages)} messages, {args.rows} table rows per reply")
+    report(rows, ("format", "bytes", "encode_ms", "decode_ms"))
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+def run_threads(threads, worker):
+    import threading
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def target(n):
+        local_latencies, local_errors = worker(n)
+        with lock:
+            latencies.extend(local_latencies)
+            errors.extend(local_errors)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=target, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - started, latencies, errors
+
+def chat_workload(turns, create_conversation, save_chat_history, load_chat_history):
+    # One simulated session: a conversation saved after every turn, with the
+    # history sidebar re-read every few turns.
+    def worker(n):
+        import sqlite3
+        from chat_records import ChatMessage
+        latencies, errors = [], []
+        username = f"bench_{n}"
+        messages = []
+        saved = 0
+        try:
+            conversation_id = create_conversation(username)
+        except sqlite3.OperationalError as e:
+            return latencies, [str(e)]
+        for turn in range(turns):
+            messages += [
+                ChatMessage("user", f"Question {turn}", timestamp=datetime.now().isoformat()),
+                ChatMessage("assistant", "Answer 🌿 " * 40, timestamp=datetime.now().isoformat()),
+            ]
+            start = time.perf_counter()
+            try:
+                saved = save_chat_history(conversation_id, messages, saved)
+                if turn % 5 == 0:
+                    load_chat_history(username)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors
+    return worker
+
+def legacy_store(path):
+    # The pre-pool access pattern: a fresh rollback-journal connection per call.
+    import sqlite3
+    import uuid
+
+    def create_conversation(username):
+        with sqlite3.connect(path) as conn:
+            conversation_id = str(uuid.uuid4())
+            conn.execute("INSERT INTO conversations (id, username, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, 0)",
+                         (conversation_id, username, datetime.now().isoformat(), datetime.now().isoformat()))
+            return conversation_id
+
+    def save_chat_history(conversation_id, messages, saved_count=0):
+        with sqlite3.connect(path) as conn:
+            conn.executemany("INSERT INTO messages (conversation_id, seq, role, content, table_data, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(conversation_id, saved_count + i, m.role, m.content, None, m.timestamp)
+                              for i, m in enumerate(messages[saved_count:])])
+            conn.execute("UPDATE conversations SET message_count = ?, updated_at = ? WHERE id = ?",
+                         (len(messages), datetime.now().isoformat(), conversation_id))
+        return len(messages)
+
+    def load_chat_history(username):
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT id, title, updated_at, message_count FROM conversations WHERE username = ? "
+                                "ORDER BY updated_at DESC LIMIT 21", (username,)).fetchall()
+
+    return create_conversation, save_chat_history, load_chat_history
+
+def bench_db(args):
+    import os
+    import sqlite3
+    import tempfile
+    import db
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        variants = [("connect-per-call", False), ("pooled WAL", False), ("pooled WAL + write-behind", True)]
+        for name, write_behind in variants:
+            path = os.path.join(tmp, f"{len(rows)}.db")
+            db.configure(path, write_behind=write_behind)
+            if name == "connect-per-call":
+                db.get_pool().close()
+                with sqlite3.connect(path) as conn:
+                    conn.execute("PRAGMA journal_mode=DELETE")
+                functions = legacy_store(path)
+            else:
+                functions = (db.create_conversation, db.save_chat_history, db.load_chat_history)
+            elapsed, latencies, errors = run_threads(args.threads, chat_workload(args.turns, *functions))
+            db.flush_writes()
+            ops = args.threads * args.turns
+            rows.append((name, f"{ops / elapsed:.0f}", f"{percentile(latencies, 50) * 1000:.2f}",
+                         f"{percentile(latencies, 99) * 1000:.2f}", len(errors)))
+    print(f"{args.threads} threads x {args.turns} turns")
+    report(rows, ("variant", "turns/s", "p50_ms", "p99_ms", "errors"))
+
+def bench_auth(args):
+    import bcrypt
+    import auth
+    password = "Passw0rd1"
+    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(args.rounds))
+    auth.check_password(password, hashed)  # start the worker processes outside the timing
+
+    def login_worker(check):
+        def worker(n):
+            latencies = []
+            for _ in range(args.logins):
+                start = time.perf_counter()
+                assert check(password, hashed)
+                latencies.append(time.perf_counter() - start)
+            return latencies, []
+        return worker
+
+    def inline_check(password, hashed):
+        return bcrypt.checkpw(password.encode("utf-8"), hashed)
+
+    def brute_force_worker(n):
+        # Every thread hammers the same account from the same address; the
+        # limiter should reject almost all attempts without touching bcrypt.
+        latencies, rejected = [], []
+        for _ in range(args.logins):
+            start = time.perf_counter()
+            if auth.allow_attempt("victim", "203.0.113.7"):
+                auth.check_password("wrong", hashed)
+            else:
+                rejected.append(1)
+            latencies.append(time.perf_counter() - start)
+        return latencies, rejected
+
+    rows = []
+    for name, worker in [("inline bcrypt", login_worker(inline_check)),
+                         (f"process pool ({auth.HASH_WORKERS} workers)", login_worker(auth.check_password)),
+                         ("brute force, rate limited", brute_force_worker)]:
+        elapsed, latencies, rejected = run_threads(args.threads, worker)
+        rows.append((name, f"{len(latencies) / elapsed:.0f}", f"{percentile(latencies, 50) * 1000:.2f}",
+                     f"{percentile(latencies, 99) * 1000:.2f}", len(rejected)))
+    print(f"{args.threads} threads x {args.logins} logins, bcrypt cost {args.rounds}")
+    report(rows, ("variant", "logins/s", "p50_ms", "p99_ms", "rejected"))
+
+def legacy_extract_table(reply):
+    # The three-column regex extraction this parser replaced, kept for comparison.
+    import re
+    table_pattern = r'\|([^|\n]*)\|([^|\n]*)\|([^|\n]*)\|'
+    table_data = []
+    for match in re.finditer(table_pattern, reply, re.MULTILINE):
+        if "Category" not in match.group(0) and "---" not in match.group(0):
+            category, recommendation, impact = [g.strip() for g in match.groups()]
+            if all([category, recommendation, impact]):
+                table_data.append({"Category": category, "Recommendation": recommendation, "Impact": impact})
+    if table_data:
+        reply = re.sub(table_pattern, '', reply, flags=re.MULTILINE).strip()
+        reply = re.sub(r'\n\s*\n', '\n', reply)
+    return table_data, reply
+
+def load_corpus(path):
+    import json
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["reply"] for line in f if line.strip()]
+
+def mutate(reply, rng):
+    lines = reply.split("\n")
+    op = rng.randrange(7)
+    i = rng.randrange(len(lines))
+    if op == 0:
+        pos = rng.randrange(len(lines[i]) + 1)
+        lines[i] = lines[i][:pos] + rng.choice(["|", "\\|", "||", " | "]) + lines[i][pos:]
+    elif op == 1:
+        del lines[i]
+    elif op == 2:
+        lines.insert(i, lines[i])
+    elif op == 3:
+        lines[i] = rng.choice(["---", "|---|", "| :-: | --- |", "```", ""])
+    elif op == 4:
+        lines[i] = " " * rng.randrange(4) + lines[i] + " " * rng.randrange(4)
+    elif op == 5:
+        return reply[:rng.randrange(len(reply) + 1)]
+    else:
+        lines[i] = lines[i].replace("|", "", 1)
+    return "\n".join(lines)
+
+def check_parse(reply):
+    from table_parser import COLUMNS, extract_table
+    rows, prose = extract_table(reply)
+    assert all(tuple(row) == COLUMNS + ("Group",) and row["Recommendation"] for row in rows), rows
+    assert extract_table(prose)[0] == [], "prose still contains a recommendation table"
+    assert rows or prose == reply, "prose changed although no rows were extracted"
+    return rows
+
+def bench_tables(args):
+    import random
+    from table_parser import extract_table
+    corpus = load_corpus(args.corpus)
+    legacy_rows = sum(len(legacy_extract_table(r)[0]) for r in corpus)
+    new_rows = sum(len(check_parse(r)) for r in corpus)
+    rows = []
+    for name, parse, found in [("regex (legacy)", legacy_extract_table, legacy_rows),
+                               ("table_parser", extract_table, new_rows)]:
+        elapsed = timed(lambda: [parse(r) for r in corpus], args.repeat)
+        rows.append((name, found, f"{elapsed / len(corpus) * 1e6:.1f}"))
+    print(f"{len(corpus)} corpus replies")
+    report(rows, ("parser", "rows_found", "us_per_reply"))
+
+    rng = random.Random(args.seed)
+    failures = 0
+    for n in range(args.fuzz):
+        sample = rng.choice(corpus)
+        for _ in range(rng.randrange(1, 4)):
+            sample = mutate(sample, rng) or sample
+        try:
+            check_parse(sample)
+        except Exception as e:
+            failures += 1
+            if failures <= 3:
+                print(f"fuzz case {n} failed: {e!r}\n{sample!r}")
+    print(f"fuzz: {args.fuzz} mutated replies, {failures} invariant failures")
+
+def bench_render(args):
+    from transcript import Transcript, CATEGORY_FILTERS
+    # The export-equality check below needs both chats stamped alike.
+    timestamps = chat_timestamps(args.turns)
+    messages = make_chat(args.turns, args.rows, timestamps)
+    legacy_messages = make_legacy_chat(args.turns, args.rows, timestamps)
+    category = CATEGORY_FILTERS[2]
+
+    # Per-rerun work outside of Streamlit itself: filtering every table and
+    # building the export string, before and after the render cache.
+    def legacy_rerun():
+        shown = 0
+        for m in legacy_messages:
+            df = m.get("table_data")
+            if df is not None and not df.empty:
+                df = df[df["Category"].str.contains(category, case=False, na=False)]
+                shown += not df.empty
+        return shown, "\n\n".join(f"**{m['role'].capitalize()}** ({m['timestamp'][:19]}):\n{m['content']}"
+                                   for m in legacy_messages if m.get("content"))
+
+    transcript = Transcript(args.window)
+    def cached_rerun():
+        transcript.sync(messages)
+        return sum(m.table_view(category) is not None for m in transcript.visible()), transcript.export
+
+    first = timed(lambda: Transcript(args.window).sync(messages), 1)
+    assert legacy_rerun()[1] == cached_rerun()[1]
+    rows = [
+        ("per-rerun filter", len(messages), f"{timed(legacy_rerun, args.repeat) * 1000:.3f}"),
+        ("render cache (first build)", len(messages), f"{first * 1000:.3f}"),
+        (f"render cache (rerun, last {args.window})", min(args.window, len(messages)),
+         f"{timed(cached_rerun, args.repeat) * 1000:.3f}"),
+    ]
+    print(f"{len(messages)} messages, {args.rows} table rows per reply, filter={category}")
+    report(rows, ("strategy", "messages_rendered", "ms_per_rerun"))
+
+def bench_memory(args):
+    import gc
+    import tracemalloc
+    # Imported up front so the module itself is not counted as session state.
+    import pandas
+
+    # One session's chat state: the transcript, the previous_messages copy
+    # kept for "Resume Chat" and the last reply's table.
+    def legacy_session():
+        messages = make_legacy_chat(args.turns, args.rows)
+        return messages, messages.copy(), messages[-1]["table_data"]
+
+    def compact_session():
+        messages = make_chat(args.turns, args.rows)
+        return messages, messages.copy(), messages[-1].table
+
+    make_chat(1, args.rows)  # warm the shared-string table
+    rows = []
+    for name, build in [("dict + DataFrame", legacy_session), ("ChatMessage + Table", compact_session)]:
+        gc.collect()
+        tracemalloc.start()
+        sessions = [build() for _ in range(args.sessions)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        rows.append((name, f"{size / args.sessions / 1024:.1f}", f"{size / args.sessions / (2 * args.turns + 1):.0f}"))
+        del sessions
+    print(f"{args.turns}-turn chat, {args.rows} table rows per reply, {args.sessions} sessions")
+    report(rows, ("message store", "kib_per_session", "bytes_per_message"))
+
+def bench_context(args):
+    from context_window import ContextWindow, message_tokens
+    from prompts import build_api_messages
+    messages = make_chat(args.turns, args.rows)
+    window = ContextWindow()
+    full_total = managed_total = 0
+    rows = []
+    started = time.perf_counter()
+    for turn in range(1, args.turns + 1):
+        sent = messages[:2 * turn]
+        full = sum(message_tokens(m) for m in build_api_messages(sent, args.detail_level))
+        window.build(sent, args.detail_level)
+        managed = window.last_stats["prompt_tokens"]
+        full_total += full
+        managed_total += managed
+        if turn in (1, 10, 25, 50, 100, args.turns):
+            rows.append((turn, full, managed, window.last_stats["verbatim_messages"], window.last_stats["summarized_messages"]))
+    elapsed = time.perf_counter() - started
+    print(f"{args.turns} turns at detail_level={args.detail_level}, budget {window.last_stats['budget']} tokens")
+    report(sorted(set(rows)), ("turn", "full_history_tokens", "managed_tokens", "verbatim", "summarized"))
+    print(f"whole conversation: {full_total} tokens sent with full history, {managed_total} managed "
+          f"({elapsed / args.turns * 1000:.2f} ms per turn incl. the full-history baseline)")
+
+STARTUP_CHILD = """
+import json, statistics, sys, time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("main.py", default_timeout=120)
+at.run()
+result = {"cold_start": time.perf_counter() - started, "pandas_after_login": "pandas" in sys.modules}
+
+def reruns(n):
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        at.run()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+result["login_rerun"] = reruns(REPEAT)
+at.session_state["authenticated"] = True
+at.session_state["username"] = "bench"
+started = time.perf_counter()
+at.run()
+result["first_chat_page"] = time.perf_counter() - started
+result["chat_rerun"] = reruns(REPEAT)
+result["pandas_after_chat"] = "pandas" in sys.modules
+print(json.dumps(result))
+"""
+
+def bench_startup(args):
+    # Each trial is a fresh interpreter driving main.py through Streamlit's
+    # AppTest: cold start (imports + bootstrap + first login page), then warm
+    # reruns of the login page and of an empty chat page.
+    import json
+    import os
+    import statistics
+    import subprocess
+    import sys
+    import tempfile
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, USERS_DB=os.path.join(tmp, "users.db"),
+                   RESPONSE_CACHE_DB=os.path.join(tmp, "response_cache.db"))
+        for _ in range(args.trials):
+            out = subprocess.run([sys.executable, "-c", STARTUP_CHILD.replace("REPEAT", str(args.reruns))],
+                                 env=env, capture_output=True, text=True, check=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    rows = [(name, f"{statistics.median(r[name] for r in results) * 1000:.1f}")
+            for name in ("cold_start", "login_rerun", "first_chat_page", "chat_rerun")]
+    print(f"{args.trials} fresh processes, median of {args.reruns} reruns each")
+    report(rows, ("phase", "ms"))
+    print(f"pandas imported after login page: {results[0]['pandas_after_login']}, "
+          f"after empty chat page: {results[0]['pandas_after_chat']}")
+
+def bench_search(args):
+    # Many users with many saved chats, then ranked FTS search vs. a LIKE
+    # scan over the same user's messages.
+    import os
+    import random
+    import tempfile
+    import db
+    rng = random.Random(args.seed)
+    words = ["organic", "cotton", "tencel", "wool", "linen", "hemp", "recycled", "polyester", "vintage",
+             "thrift", "repair", "wash", "capsule", "wardrobe", "denim", "bamboo", "dye", "brand"]
+    words += [f"{w}{i}" for w in ("fabric", "label", "shop") for i in range(300)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db.configure(os.path.join(tmp, "search.db"))
+        started = time.perf_counter()
+        for u in range(args.users):
+            for _ in range(args.chats):
+                conversation_id = db.create_conversation(f"user_{u}")
+                messages = make_chat(args.turns, 3)
+                for m in messages:
+                    m.content += " " + " ".join(rng.choice(words) for _ in range(12))
+                db.save_chat_history(conversation_id, messages)
+        indexed = time.perf_counter() - started
+        messages = args.users * args.chats * (2 * args.turns + 1)
+        queries = [" ".join(rng.sample(words, 2)) for _ in range(args.queries)]
+
+        def like_search(username, text):
+            clauses = " AND ".join("m.content LIKE ?" for _ in text.split())
+            with db.get_pool().connection() as conn:
+                return conn.execute(
+                    f"SELECT m.conversation_id, m.seq FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+                    f"WHERE c.username = ? AND {clauses} LIMIT ?",
+                    [username] + [f"%{w}%" for w in text.split()] + [db.SEARCH_LIMIT]).fetchall()
+
+        rows = []
+        for name, search in (("LIKE scan", like_search), ("FTS5 bm25 + snippets", db.search_messages)):
+            latencies = []
+            for i, query in enumerate(queries):
+                start = time.perf_counter()
+                search(f"user_{i % args.users}", query)
+                latencies.append(time.perf_counter() - start)
+            rows.append((name, f"{percentile(latencies, 50) * 1000:.2f}", f"{percentile(latencies, 99) * 1000:.2f}"))
+        with db.get_pool().connection() as conn:
+            fts_pages = conn.execute("SELECT count(*) FROM message_search_data").fetchone()[0]
+    print(f"{args.users} users x {args.chats} chats ({messages} messages), "
+          f"saved incl. indexing in {indexed:.1f}s, {fts_pages} FTS pages")
+    report(rows, ("variant", "p50_ms", "p99_ms"))
+
+def bench_semantic(args):
+    # Paraphrase reuse on a labelled pair set at several thresholds, then
+    # lookup and cold-load cost with a full index.
+    import json
+    import os
+    import random
+    import tempfile
+    from semantic_cache import SemanticCache
+    with open(args.pairs, encoding="utf-8") as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+    answered = list(dict.fromkeys(p["answered"] for p in pairs))
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SemanticCache(os.path.join(tmp, "semantic.db"))
+        for text in answered:
+            cache.remember(text, [{"role": "user", "content": text}], "standard")
+        for threshold in args.thresholds:
+            cache.threshold = threshold
+            reused = wrong = 0
+            for pair in pairs:
+                match = cache.lookup([{"role": "user", "content": pair["prompt"]}], "standard")
+                if match is not None:
+                    if pair["same"] and match[0] == pair["answered"]:
+                        reused += 1
+                    else:
+                        wrong += 1
+            same = sum(p["same"] for p in pairs)
+            rows.append((f"{threshold:.2f}", f"{reused}/{same}", f"{wrong}/{len(pairs)}"))
+        print(f"{len(pairs)} labelled pairs, {len(answered)} answered prompts")
+        report(rows, ("threshold", "paraphrases reused", "wrong answers served"))
+
+        rng = random.Random(args.seed)
+        words = ["organic", "cotton", "tencel", "wool", "linen", "hemp", "recycled", "polyester", "vintage", "thrift",
+                 "repair", "wash", "capsule", "wardrobe", "denim", "bamboo", "dye", "brand", "shoes", "jacket"]
+        path = os.path.join(tmp, "big.db")
+        cache = SemanticCache(path, max_entries=args.entries)
+        for i in range(args.entries):
+            text = " ".join(rng.sample(words, 4)) + f" item{i}"
+            cache.remember(f"k{i}", [{"role": "user", "content": text}], "standard")
+        cold = SemanticCache(path)
+        start = time.perf_counter()
+        cold.lookup([{"role": "user", "content": "wash wool"}], "standard")
+        load = time.perf_counter() - start
+        latencies = []
+        for _ in range(args.queries):
+            prompt = [{"role": "user", "content": " ".join(rng.sample(words, 3))}]
+            start = time.perf_counter()
+            cold.lookup(prompt, "standard")
+            latencies.append(time.perf_counter() - start)
+    print(f"{args.entries} indexed prompts: cold load {load * 1000:.0f} ms, lookup p50 "
+          f"{percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms")
+
+def bench_hedge(args):
+    # Model routing against the mock backend: a primary model with a stall
+    # tail (and optionally errors), with and without hedging and a backup.
+    import threading
+    import llm_client
+    from mock_llm import MockLLMConfig, MockLLMServer
+    from model_router import ModelRouter
+    primary, backup = "mock/primary", "mock/backup"
+    variants = [("primary only, no hedging", [primary], False, False),
+                ("primary, hedged duplicate", [primary], True, True),
+                ("primary + backup, hedged", [primary, backup], True, False)]
+    messages = [{"role": "user", "content": "What are eco-friendly fabrics?"}]
+    rows = []
+    for name, models, hedging, duplicate in variants:
+        config = MockLLMConfig(args.latency, args.jitter, 0.0, args.error_rate, 0.0, 1, args.seed,
+                               {backup: args.backup_latency}, args.stall_rate, args.stall_latency)
+        server = MockLLMServer(config).start()
+        llm_client.API_URL = server.url
+        router = ModelRouter({"standard": models}, hedging, duplicate=duplicate)
+        for _ in range(args.warmup):
+            try:
+                next(router.complete("bench", messages, "standard"))
+            except Exception:
+                pass
+        warm_requests = config.counts["requests"]
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def worker(n):
+            for _ in range(args.requests // args.threads):
+                start = time.perf_counter()
+                try:
+                    for _ in router.complete("bench", messages, "standard"):
+                        pass
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        server.stop()
+        sent = config.counts["requests"] - warm_requests
+        done = len(latencies) + len(errors)
+        stats = router.snapshot()
+        rows.append((name, f"{percentile(latencies, 50) * 1000:.0f}", f"{percentile(latencies, 95) * 1000:.0f}",
+                     f"{percentile(latencies, 99) * 1000:.0f}", len(errors), f"{sent / done - 1:+.0%}" if done else "-",
+                     sum(m["hedge_wins"] for m in stats.values())))
+    print(f"{args.requests} replies over {args.threads} threads; primary {args.latency * 1000:.0f}±{args.jitter * 1000:.0f} ms, "
+          f"{args.stall_rate:.0%} stall {args.stall_latency:.1f}s, {args.error_rate:.0%} errors; "
+          f"backup {args.backup_latency * 1000:.0f} ms")
+    report(rows, ("variant", "p50_ms", "p95_ms", "p99_ms", "errors", "extra requests", "hedge wins"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Sustainable Fashion Advisor benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    codec = subparsers.add_parser("codec", help="Stored-chat encode/decode cost and size")
+    codec.add_argument("--turns", type=int, default=100)
+    codec.add_argument("--rows", type=int, default=4)
+    codec.add_argument("--repeat", type=int, default=5)
+    codec.set_defaults(func=bench_codec)
+    database = subparsers.add_parser("db", help="users.db access under many concurrent sessions")
+    database.add_argument("--threads", type=int, default=32)
+    database.add_argument("--turns", type=int, default=50)
+    database.set_defaults(func=bench_db)
+    login = subparsers.add_parser("auth", help="Login throughput under concurrency")
+    login.add_argument("--threads", type=int, default=16)
+    login.add_argument("--logins", type=int, default=10)
+    login.add_argument("--rounds", type=int, default=10)
+    login.set_defaults(func=bench_auth)
+    tables = subparsers.add_parser("tables", help="Markdown table extraction speed and fuzzing")
+    tables.add_argument("--corpus", default="bench_data/model_replies.jsonl")
+    tables.add_argument("--repeat", type=int, default=20)
+    tables.add_argument("--fuzz", type=int, default=2000)
+    tables.add_argument("--seed", type=int, default=1)
+    tables.set_defaults(func=bench_tables)
+    render = subparsers.add_parser("render", help="Transcript work per rerun with and without the render cache")
+    render.add_argument("--turns", type=int, default=100)
+    render.add_argument("--rows", type=int, default=4)
+    render.add_argument("--window", type=int, default=20)
+    render.add_argument("--repeat", type=int, default=5)
+    render.set_defaults(func=bench_render)
+    memory = subparsers.add_parser("memory", help="Session-state bytes per chat")
+    memory.add_argument("--turns", type=int, default=100)
+    memory.add_argument("--rows", type=int, default=4)
+    memory.add_argument("--sessions", type=int, default=10)
+    memory.set_defaults(func=bench_memory)
+    context = subparsers.add_parser("context", help="Prompt tokens per turn with and without context management")
+    context.add_argument("--turns", type=int, default=100)
+    context.add_argument("--rows", type=int, default=4)
+    context.add_argument("--detail-level", default="standard", choices=["brief", "standard", "detailed"])
+    context.set_defaults(func=bench_context)
+    startup = subparsers.add_parser("startup", help="Cold start and warm rerun time of the Streamlit script")
+    startup.add_argument("--trials", type=int, default=3)
+    startup.add_argument("--reruns", type=int, default=10)
+    startup.set_defaults(func=bench_startup)
+    search = subparsers.add_parser("search", help="Full-text search latency over many saved chats")
+    search.add_argument("--users", type=int, default=20)
+    search.add_argument("--chats", type=int, default=200)
+    search.add_argument("--turns", type=int, default=3)
+    search.add_argument("--queries", type=int, default=200)
+    search.add_argument("--seed", type=int, default=1)
+    search.set_defaults(func=bench_search)
+    semantic = subparsers.add_parser("semantic", help="Similar-prompt reuse accuracy and lookup cost")
+    semantic.add_argument("--pairs", default="bench_data/paraphrases.jsonl")
+    semantic.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9])
+    semantic.add_argument("--entries", type=int, default=5000)
+    semantic.add_argument("--queries", type=int, default=500)
+    semantic.add_argument("--seed", type=int, default=1)
+    semantic.set_defaults(func=bench_semantic)
+    hedge = subparsers.add_parser("hedge", help="Reply latency with hedged requests and model fallback (mock backend)")
+    hedge.add_argument("--requests", type=int, default=200)
+    hedge.add_argument("--threads", type=int, default=8)
+    hedge.add_argument("--warmup", type=int, default=40)
+    hedge.add_argument("--latency", type=float, default=0.1)
+    hedge.add_argument("--jitter", type=float, default=0.05)
+    hedge.add_argument("--backup-latency", type=float, default=0.2)
+    hedge.add_argument("--stall-rate", type=float, default=0.03)
+    hedge.add_argument("--stall-latency", type=float, default=2.0)
+    hedge.add_argument("--error-rate", type=float, default=0.0)
+    hedge.add_argument("--seed", type=int, default=1)
+    hedge.set_defaults(func=bench_hedge)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
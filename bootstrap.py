@@ -0,0 +1,34 @@
+import multiprocessing
+import threading
+import time
+from metrics import start_exporter
+from prompts import SYSTEM_MESSAGES
+from storage import get_storage
+from styles import PAGE_CSS
+
+# ===== PROCESS BOOTSTRAP =====
+# Streamlit re-executes main.py on every interaction, but modules it imports
+# run once per process. Setup that only has to happen once (schema creation
+# for the local storage backend, the metrics exporter, the startup banner)
+# lives here; the CSS and system-prompt variants are precomputed when their
+# modules are imported.
+_started_at = None
+_lock = threading.Lock()
+
+def bootstrap():
+    global _started_at
+    # Spawned helper processes (the bcrypt pool) re-run the Streamlit script
+    # as __mp_main__; they must not open the database or bind the exporter.
+    if multiprocessing.current_process().name != "MainProcess":
+        return None
+    if _started_at is None:
+        with _lock:
+            if _started_at is None:
+                started = time.perf_counter()
+                get_storage().init()
+                start_exporter()
+                print(f"Starting Sustainable Fashion Advisor app... "
+                      f"({len(PAGE_CSS)} CSS and {len(SYSTEM_MESSAGES)} prompt variants, "
+                      f"setup {(time.perf_counter() - started) * 1000:.1f} ms)")
+                _started_at = time.time()
+    return _started_at
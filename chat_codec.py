@@ -0,0 +1,117 @@
+import ast
+import json
+import re
+from chat_records import ChatMessage, Table
+
+# Versioned JSON codec for stored chats. Tables are stored column-wise
+# ({"columns": [...], "data": [[...], ...]}) so repeated keys are written once
+# per table instead of once per row.
+CODEC_VERSION = 1
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def _table_columns(table):
+    if table is None:
+        return None
+    if isinstance(table, list):
+        table = Table.from_records(table)
+    if not table:
+        return None
+    return {"columns": list(table.columns), "data": [list(column) for column in zip(*table.rows)]}
+
+def _columns_table(encoded):
+    if not encoded:
+        return None
+    # Pre-versioned rows stored the table as a list of records.
+    if isinstance(encoded, list):
+        return Table.from_records(encoded) if encoded else None
+    return Table.from_columns(encoded["columns"], encoded["data"])
+
+def encode_table(table):
+    encoded = _table_columns(table)
+    if encoded is None:
+        return None
+    return _dumps({"v": CODEC_VERSION, **encoded})
+
+def decode_table(blob):
+    if not blob:
+        return None
+    encoded = json.loads(blob)
+    if isinstance(encoded, dict) and encoded.get("v", CODEC_VERSION) > CODEC_VERSION:
+        raise ValueError(f"Unsupported table codec version: {encoded['v']}")
+    return _columns_table(encoded)
+
+def encode_messages(messages):
+    return _dumps({
+        "v": CODEC_VERSION,
+        "messages": [{
+            "role": m.role,
+            "content": m.content,
+            "timestamp": m.timestamp,
+            "table": _table_columns(m.table)
+        } for m in messages]
+    })
+
+def decode_messages(blob):
+    payload = json.loads(blob)
+    if payload.get("v") != CODEC_VERSION:
+        raise ValueError(f"Unsupported message codec version: {payload.get('v')}")
+    return [ChatMessage(m["role"], m["content"], _columns_table(m.get("table")), m.get("timestamp"))
+            for m in payload["messages"]]
+
+# The old app's messages were dicts in role, content, table_data, timestamp
+# order, and a DataFrame in table_data was written as its bare repr, which
+# no literal parser accepts. Such snapshots are walked message by message
+# instead: the strings are read as literals and the repr runs up to the
+# message's timestamp.
+_PY_STRING = r"'(?:[^'\\\n]|\\.)*'" + r'|"(?:[^"\\\n]|\\.)*"'
+_LEGACY_MESSAGE = re.compile(
+    rf"\{{'role': ({_PY_STRING}), 'content': ({_PY_STRING}), 'table_data': (.*?), "
+    rf"'timestamp': ('[\d:.T-]*'|None)\}}(, |\]$)", re.S)
+
+def _literal(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+def _legacy_messages(text):
+    if not text.startswith("["):
+        return None
+    messages, pos = [], 1
+    while pos < len(text):
+        match = _LEGACY_MESSAGE.match(text, pos)
+        if match is None:
+            return None
+        role, content, table_data, timestamp = match.group(1, 2, 3, 4)
+        if table_data == "None" or table_data.startswith("["):
+            table_data = _literal(table_data)
+        messages.append({"role": _literal(role), "content": _literal(content),
+                         "table_data": table_data, "timestamp": _literal(timestamp)})
+        pos = match.end()
+    return messages
+
+def decode_legacy_snapshot(text):
+    # chat_history rows were written with str(messages). Only literal-safe
+    # parsing is used. A DataFrame repr cannot be parsed back into a table,
+    # so its text is kept below the message as a preformatted block.
+    messages = _literal(text)
+    if messages is None:
+        messages = _legacy_messages(text)
+    if not isinstance(messages, list):
+        return None
+    decoded = []
+    for m in messages:
+        if not isinstance(m, dict):
+            continue
+        table_data, content = m.get("table_data"), m.get("content", "")
+        if isinstance(table_data, str):
+            content = f"{content}\n\n```\n{table_data}\n```"
+        decoded.append(ChatMessage(
+            m.get("role", "assistant"),
+            content,
+            _columns_table(table_data) if isinstance(table_data, list) else None,
+            m.get("timestamp")
+        ))
+    return decoded
@@ -0,0 +1,76 @@
+import csv
+import io
+
+# ===== COMPACT CHAT RECORDS =====
+# Messages held in session state are slotted records, and recommendation
+# tables are a tuple of column names plus a tuple of row tuples. A 1-4 row
+# table costs a few hundred bytes this way instead of a DataFrame's index,
+# block manager and object columns; st.table gets plain columns (select).
+_SHARED_LIMIT = 50000
+_shared = {}
+
+def share(value):
+    # Roles, column names and category labels repeat across every session, so
+    # one process-wide copy of each short string is kept. Bounded, unlike
+    # sys.intern, because the labels are model-generated.
+    if not isinstance(value, str) or len(value) > 40:
+        return value
+    shared = _shared.get(value)
+    if shared is None:
+        if len(_shared) >= _SHARED_LIMIT:
+            return value
+        _shared[value] = shared = value
+    return shared
+
+class Table:
+    __slots__ = ("columns", "rows")
+
+    def __init__(self, columns, rows):
+        self.columns = tuple(share(str(column)) for column in columns)
+        self.rows = tuple(tuple(share(cell) for cell in row) for row in rows)
+
+    @classmethod
+    def from_records(cls, records):
+        columns = list(dict.fromkeys(column for record in records for column in record))
+        return cls(columns, [[record.get(column) for column in columns] for record in records])
+
+    @classmethod
+    def from_columns(cls, columns, data):
+        return cls(columns, zip(*data))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, name):
+        i = self.columns.index(name)
+        return [row[i] for row in self.rows]
+
+    def records(self):
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+    def select(self, rows=None, columns=None):
+        # Column-oriented dict for st.table/st.dataframe; no DataFrame kept.
+        columns = [c for c in (columns or self.columns) if c in self.columns]
+        picked = self.rows if rows is None else [self.rows[i] for i in rows]
+        return {column: [row[self.columns.index(column)] for row in picked] for column in columns}
+
+    def to_csv(self, columns=None):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator="\n")
+        if columns is None:
+            writer.writerow(self.columns)
+            writer.writerows(self.rows)
+        else:
+            picked = self.select(columns=columns)
+            writer.writerow(picked)
+            writer.writerows(zip(*picked.values()))
+        return out.getvalue()
+
+class ChatMessage:
+    __slots__ = ("role", "content", "table", "timestamp")
+
+    def __init__(self, role, content, table=None, timestamp=None):
+        self.role = share(role)
+        self.content = content
+        self.table = table if table else None
+        self.timestamp = timestamp
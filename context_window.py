@@ -0,0 +1,121 @@
+import json
+import os
+import re
+from functools import lru_cache
+from prompts import DETAIL_LEVELS, build_api_messages, get_system_message
+
+# ===== CONTEXT WINDOW =====
+# Keeps each request inside a token budget per detail level: the newest turns
+# are sent verbatim and everything older is folded into a rolling summary
+# sent as a second system message. Token counts come from a local estimate,
+# so no tokenizer or extra request is needed.
+DEFAULT_BUDGETS = {"brief": 1500, "standard": 3000, "detailed": 6000}
+CONTEXT_BUDGETS = {level: int(os.environ.get(f"CONTEXT_BUDGET_{level.upper()}", DEFAULT_BUDGETS[level]))
+                   for level in DETAIL_LEVELS}
+KEEP_RECENT_MESSAGES = int(os.environ.get("CONTEXT_KEEP_RECENT", "4"))
+SUMMARY_SHARE = float(os.environ.get("CONTEXT_SUMMARY_SHARE", "0.25"))
+MESSAGE_OVERHEAD = 4
+SUMMARY_HEADER = "Summary of the earlier conversation (oldest first):"
+
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+def estimate_tokens(text):
+    # Roughly what BPE tokenizers produce for English prose: one token per
+    # short word or symbol, plus one per extra ~6 characters of long words.
+    if not text:
+        return 0
+    pieces = _TOKEN_PIECES.findall(text)
+    return sum(1 + (len(piece) - 1) // 6 for piece in pieces)
+
+def message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+@lru_cache(maxsize=None)
+def system_tokens(detail_level):
+    return message_tokens(get_system_message(detail_level))
+
+def summary_line(message):
+    # One compact line per older message: the question as asked, or the
+    # first sentence of a reply plus its recommendations.
+    content = " ".join((message.content or "").split())
+    if message.role == "user":
+        return f"- User asked: {content[:200]}"
+    first = _SENTENCE_END.split(content, 1)[0][:200]
+    line = f"- Advisor: {first}"
+    if message.table:
+        tips = [f"{r.get('Category', '')}: {r.get('Recommendation', '')}" for r in message.table.records()]
+        line += f" Recommended: {'; '.join(tips)[:300]}"
+    return line
+
+class ContextWindow:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.cached = []
+        self.tokens = []
+        self.lines = []
+        self.last_stats = None
+
+    def _sync(self, messages):
+        # Per-message token counts and summary lines are computed once; a
+        # transcript that no longer starts with the cached messages resets.
+        n = len(self.cached)
+        if n and (len(messages) < n or messages[0] is not self.cached[0] or messages[n - 1] is not self.cached[-1]):
+            self.reset()
+            n = 0
+        for message in messages[n:]:
+            self.cached.append(message)
+            self.tokens.append(estimate_tokens(message.content) + MESSAGE_OVERHEAD)
+            self.lines.append(None)
+
+    def _line(self, i):
+        if self.lines[i] is None:
+            self.lines[i] = summary_line(self.cached[i])
+        return self.lines[i]
+
+    def build(self, messages, detail_level, deep_search=False):
+        self._sync(messages)
+        budget = CONTEXT_BUDGETS[detail_level]
+        available = budget - system_tokens(detail_level)
+
+        # Newest first: always keep the last KEEP_RECENT_MESSAGES, then keep
+        # going while the verbatim turns fit beside the summary allowance.
+        first_user = next((i for i, m in enumerate(messages) if m.role == "user"), len(messages))
+        summary_budget = int(available * SUMMARY_SHARE)
+        cut = len(messages)
+        used = 0
+        while cut > first_user:
+            cost = self.tokens[cut - 1]
+            if len(messages) - cut >= KEEP_RECENT_MESSAGES and used + cost > available - summary_budget:
+                break
+            used += cost
+            cut -= 1
+
+        # Rolling summary of first_user..cut; when it outgrows its share the
+        # oldest lines are dropped first.
+        lines = [self._line(i) for i in range(first_user, cut)]
+        line_tokens = [estimate_tokens(line) + 1 for line in lines]
+        summary_room = max(summary_budget, available - used) - MESSAGE_OVERHEAD - estimate_tokens(SUMMARY_HEADER)
+        summary_tokens = sum(line_tokens)
+        while lines and summary_tokens > summary_room:
+            summary_tokens -= line_tokens.pop(0)
+            lines.pop(0)
+
+        # The greeting before the first question is not sent once the user
+        # has asked something.
+        recent = messages[cut:] or messages
+        api_messages = build_api_messages(recent, detail_level, deep_search)
+        if lines:
+            api_messages.insert(1, {"role": "system", "content": "\n".join([SUMMARY_HEADER] + lines)})
+        prompt_tokens = sum(message_tokens(m) for m in api_messages)
+        self.last_stats = {
+            "prompt_tokens": prompt_tokens,
+            "budget": budget,
+            "verbatim_messages": len(recent),
+            "summarized_messages": len(lines),
+            "dropped_messages": (cut - first_user) - len(lines),
+            "bytes": len(json.dumps(api_messages, ensure_ascii=False).encode("utf-8")),
+        }
+        return api_messages
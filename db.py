@@ -0,0 +1,637 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from chat_codec import encode_table, decode_table, decode_legacy_snapshot
+from chat_records import ChatMessage
+from table_parser import category_groups
+from metrics import span
+
+# ===== DATA ACCESS =====
+# All users.db access goes through a small pool of long-lived WAL-mode
+# connections shared by the Streamlit script threads. Each connection keeps
+# sqlite3's prepared-statement cache warm, so the fixed SQL below is parsed
+# once per connection rather than once per call.
+DB_PATH = os.environ.get("USERS_DB", "users.db")
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+# Off by default: reads flush the queue first, so on a save-then-read
+# workload (bench.py db) write-behind is slower than writing directly.
+WRITE_BEHIND = os.environ.get("DB_WRITE_BEHIND", "0") == "1"
+WRITE_BATCH_SIZE = int(os.environ.get("DB_WRITE_BATCH_SIZE", "64"))
+WRITE_FLUSH_INTERVAL = float(os.environ.get("DB_WRITE_FLUSH_INTERVAL", "0.05"))
+HISTORY_PAGE_SIZE = 20
+SEARCH_LIMIT = int(os.environ.get("SEARCH_LIMIT", "20"))
+
+log = logging.getLogger(__name__)
+
+PRAGMAS = (
+    # Must precede the first write to a new file; a no-op on an existing
+    # database, which `archive.py compact --convert-vacuum` switches over.
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=30000",
+)
+
+INSERT_USER = "INSERT INTO users (username, password) VALUES (?, ?)"
+SELECT_PASSWORD = "SELECT password FROM users WHERE username = ?"
+UPDATE_PASSWORD = "UPDATE users SET password = ? WHERE username = ?"
+INSERT_CONVERSATION = "INSERT INTO conversations (id, username, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, 0)"
+INSERT_MESSAGE = ("INSERT INTO messages (conversation_id, seq, role, content, table_data, timestamp, search_rowid) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?)")
+UPDATE_CONVERSATION = "UPDATE conversations SET message_count = ?, updated_at = ?, title = COALESCE(title, ?) WHERE id = ?"
+SELECT_HISTORY_PAGE = """
+    SELECT id, title, updated_at, message_count FROM conversations
+    WHERE username = ? ORDER BY updated_at DESC LIMIT ? OFFSET ?
+"""
+SELECT_MESSAGES = "SELECT role, content, table_data, timestamp FROM messages WHERE conversation_id = ? ORDER BY seq"
+INSERT_RECOMMENDATION = """
+    INSERT OR IGNORE INTO recommendations
+        (conversation_id, seq, row, category_group, category, recommendation, impact, timestamp, username)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# Walks idx_recommendations_owner in order and stops at the limit; only the
+# returned rows look up their conversation's title.
+SELECT_RECOMMENDATIONS = """
+    SELECT r.category_group, r.category, r.recommendation, r.impact, c.title, r.timestamp
+    FROM recommendations r
+    JOIN conversations c ON c.id = r.conversation_id
+    WHERE r.username = ? AND r.category_group = ?
+    ORDER BY r.timestamp DESC, r.row LIMIT ?
+"""
+# Each indexed row carries its owner's key (owner_key) so the MATCH itself
+# narrows to one user's messages instead of filtering every user's hits.
+INSERT_SEARCH = """
+    INSERT INTO message_search (owner, content, recommendations, conversation_id, seq)
+    VALUES (?, ?, ?, ?, ?)
+"""
+# Ranked and cut to `limit` inside FTS5 (ORDER BY rank LIMIT) after the owner
+# match, so only the user's top hits are joined and snippeted; the username
+# check only guards against an owner_key collision.
+SEARCH_MESSAGES = """
+    SELECT s.conversation_id, s.seq, c.title, m.role, m.timestamp, s.content_snippet, s.tips_snippet
+    FROM (
+        SELECT conversation_id, seq, rank,
+               snippet(message_search, 1, '**', '**', '…', 12) AS content_snippet,
+               snippet(message_search, 2, '**', '**', '…', 12) AS tips_snippet
+        FROM message_search WHERE message_search MATCH ? ORDER BY rank LIMIT ?
+    ) s
+    JOIN conversations c ON c.id = s.conversation_id
+    JOIN messages m ON m.conversation_id = s.conversation_id AND m.seq = s.seq
+    WHERE c.username = ?
+    ORDER BY s.rank
+"""
+_SEARCH_TERMS = re.compile(r"\w+", re.UNICODE)
+UPSERT_SESSION = """
+    INSERT INTO sessions (id, username, state, expires_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at
+    WHERE sessions.username = excluded.username
+"""
+SELECT_SESSION = "SELECT username, state FROM sessions WHERE id = ? AND expires_at > ?"
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=128)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # Borrow a connection for one transaction; commits on success and
+        # rolls back on error. Callers block once `size` connections are out.
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.created < self.size
+                if can_open:
+                    self.created += 1
+            conn = self._open() if can_open else self.idle.get()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+class ChatWriter:
+    # Optional write-behind queue: message appends are batched by a single
+    # background thread into one transaction per batch. A failed batch is
+    # retried one write per transaction, so a bad write cannot take other
+    # conversations' messages with it. A write that still fails marks its
+    # conversation with the first seq it lost: later writes for it are held
+    # back rather than leave a gap, and the next append reports that seq as
+    # the saved count so the caller sends the lost messages again.
+    def __init__(self, pool, batch_size=WRITE_BATCH_SIZE, interval=WRITE_FLUSH_INTERVAL):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.lost = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, write):
+        self.queue.put(write)
+
+    def flush(self):
+        # Nothing queued or being written: readers go straight through.
+        # Otherwise a None marker ends the current batch early so they don't
+        # wait out the batching interval.
+        if not self.queue.unfinished_tasks:
+            return
+        self.queue.put(None)
+        self.queue.join()
+
+    def lost_from(self, conversation_id):
+        with self.lock:
+            return self.lost.get(conversation_id)
+
+    def _in_order(self, write):
+        conversation_id, first = write[0], write[1][0][1]
+        with self.lock:
+            lost = self.lost.get(conversation_id)
+        if lost is None or first == lost:
+            return True
+        log.warning("chat-writer: held back seq %d+ of %s until seq %d+ is sent again", first, conversation_id, lost)
+        return False
+
+    def _written(self, writes):
+        with self.lock:
+            for conversation_id, rows, *_ in writes:
+                if self.lost.get(conversation_id) == rows[0][1]:
+                    del self.lost[conversation_id]
+
+    def _write(self, writes):
+        writes = [write for write in writes if self._in_order(write)]
+        if not writes:
+            return
+        try:
+            with self.pool.connection() as conn:
+                for write in writes:
+                    _write_messages(conn, *write)
+            self._written(writes)
+            return
+        except sqlite3.Error as e:
+            if len(writes) > 1:
+                log.warning("chat-writer: batch of %d writes failed (%s); retrying one at a time", len(writes), e)
+        for write in writes:
+            if not self._in_order(write):
+                continue
+            try:
+                with self.pool.connection() as conn:
+                    _write_messages(conn, *write)
+                self._written([write])
+            except sqlite3.Error:
+                log.exception("chat-writer: lost seq %d+ of %s", write[1][0][1], write[0])
+                with self.lock:
+                    self.lost.setdefault(write[0], write[1][0][1])
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write([write for write in batch if write is not None])
+            except Exception:
+                log.exception("chat-writer: unexpected error")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+_pool = None
+_writer = None
+_setup_lock = threading.Lock()
+
+def _open_pool(path, write_behind, pool_size):
+    global _pool, _writer
+    if _writer is not None:
+        _writer.flush()
+    if _pool is not None:
+        _pool.close()
+    _pool = ConnectionPool(path, pool_size)
+    _writer = ChatWriter(_pool) if write_behind else None
+
+def configure(path=DB_PATH, write_behind=WRITE_BEHIND, pool_size=POOL_SIZE):
+    with _setup_lock:
+        _open_pool(path, write_behind, pool_size)
+    init_db()
+
+def get_pool():
+    if _pool is None:
+        with _setup_lock:
+            if _pool is None:
+                _open_pool(DB_PATH, WRITE_BEHIND, POOL_SIZE)
+    return _pool
+
+def flush_writes():
+    if _writer is not None:
+        _writer.flush()
+
+# ===== SCHEMA =====
+def init_db():
+    with get_pool().connection() as conn:
+        c = conn.cursor()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password TEXT NOT NULL
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id TEXT PRIMARY KEY,
+                username TEXT,
+                timestamp TEXT,
+                messages TEXT,
+                FOREIGN KEY (username) REFERENCES users (username)
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                title TEXT,
+                created_at TEXT,
+                updated_at TEXT,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (username) REFERENCES users (username)
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT,
+                table_data TEXT,
+                timestamp TEXT,
+                search_rowid INTEGER,
+                PRIMARY KEY (conversation_id, seq),
+                FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+            )
+        """)
+        # The message's message_search rowid. conversation_id is UNINDEXED in
+        # the FTS table, so deleting by it would scan the whole index.
+        relink_search = "search_rowid" not in [row[1] for row in c.execute("PRAGMA table_info(messages)")]
+        if relink_search:
+            c.execute("ALTER TABLE messages ADD COLUMN search_rowid INTEGER")
+        # Inverted index of every stored recommendation row by category
+        # group, for "all Care tips I've been given" across conversations.
+        backfill = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'recommendations'"
+        ).fetchone() is None
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS recommendations (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                row INTEGER NOT NULL,
+                category_group TEXT NOT NULL,
+                category TEXT,
+                recommendation TEXT,
+                impact TEXT,
+                timestamp TEXT,
+                username TEXT,
+                PRIMARY KEY (conversation_id, seq, row),
+                FOREIGN KEY (conversation_id, seq) REFERENCES messages (conversation_id, seq)
+            )
+        """)
+        if backfill:
+            for conversation_id, seq, table_data, timestamp, username in c.execute("""
+                SELECT m.conversation_id, m.seq, m.table_data, m.timestamp, c.username
+                FROM messages m JOIN conversations c ON c.id = m.conversation_id
+                WHERE m.table_data IS NOT NULL
+            """).fetchall():
+                c.executemany(INSERT_RECOMMENDATION, [(*r, username) for r in _recommendation_rows(
+                    conversation_id, seq, decode_table(table_data), timestamp)])
+        elif "username" not in [row[1] for row in c.execute("PRAGMA table_info(recommendations)")]:
+            # Rows from before the owner index: copy in owner and message time.
+            c.execute("ALTER TABLE recommendations ADD COLUMN timestamp TEXT")
+            c.execute("ALTER TABLE recommendations ADD COLUMN username TEXT")
+            c.execute("""
+                UPDATE recommendations SET
+                    timestamp = (SELECT m.timestamp FROM messages m
+                                 WHERE m.conversation_id = recommendations.conversation_id AND m.seq = recommendations.seq),
+                    username = (SELECT c.username FROM conversations c WHERE c.id = recommendations.conversation_id)
+            """)
+        # One user's rows of one group, newest first, straight off the index.
+        c.execute("DROP INDEX IF EXISTS idx_recommendations_group")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_recommendations_owner "
+                  "ON recommendations (username, category_group, timestamp DESC, row)")
+        # Full-text index over message text and recommendation rows, one FTS
+        # row per message, written in the same transaction as the message.
+        # Indexes from before owner_key held the stemmed, case-folded
+        # username, which could match other users; rebuilt once.
+        search_columns = [row[1] for row in c.execute("PRAGMA table_info(message_search)")]
+        if "username" in search_columns:
+            c.execute("DROP TABLE message_search")
+        backfill_search = "owner" not in search_columns
+        c.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+                owner, content, recommendations,
+                conversation_id UNINDEXED, seq UNINDEXED,
+                tokenize = "porter unicode61 remove_diacritics 2 tokenchars '_'"
+            )
+        """)
+        if backfill_search:
+            # bm25 ranking that ignores the owner column and weights
+            # recommendation rows above prose; stored with the index.
+            c.execute("INSERT INTO message_search (message_search, rank) VALUES ('rank', 'bm25(0.0, 1.0, 2.0)')")
+            rows = conn.execute("""
+                SELECT c.username, m.content,
+                       (SELECT group_concat(trim(coalesce(r.category, '') || ' ' || coalesce(r.recommendation, '') || ' ' || coalesce(r.impact, '')), char(10))
+                        FROM recommendations r WHERE r.conversation_id = m.conversation_id AND r.seq = m.seq),
+                       m.conversation_id, m.seq
+                FROM messages m JOIN conversations c ON c.id = m.conversation_id
+            """)
+            c.executemany(INSERT_SEARCH, ((owner_key(username), *row) for username, *row in rows))
+        if backfill_search or relink_search:
+            c.executemany("UPDATE messages SET search_rowid = ? WHERE conversation_id = ? AND seq = ?",
+                          conn.execute("SELECT rowid, conversation_id, seq FROM message_search").fetchall())
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                state TEXT,
+                expires_at REAL NOT NULL
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+        columns = [row[1] for row in c.execute("PRAGMA table_info(conversations)")]
+        if "title" not in columns:
+            c.execute("ALTER TABLE conversations ADD COLUMN title TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_username ON users (username)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_updated ON conversations (username, updated_at)")
+    migrate_legacy_history()
+
+# ===== LEGACY HISTORY =====
+# chat_history holds the old app's str(messages) snapshots. They are moved
+# into conversations on init_db so upgrading keeps every user's past chats;
+# the table is left empty afterwards apart from rows that do not parse.
+LEGACY_CHUNK_SIZE = 1000
+
+def _extends(later, earlier):
+    # chat_history rows are str(messages) snapshots: a longer transcript's
+    # text starts with the shorter one's minus its closing bracket.
+    if later == earlier:
+        return True
+    head = earlier[:-1]
+    return earlier.endswith("]") and later.startswith(head) and later[len(head):len(head) + 1] in (",", "]")
+
+def dedupe_legacy(conn, chunk_size=LEGACY_CHUNK_SIZE):
+    # The old app inserted a full snapshot on every save. A snapshot that a
+    # later one from the same user extends holds nothing the later one does
+    # not, so only the newest of each chain survives. Only the current
+    # user's chain heads are held in memory.
+    superseded = []
+    heads, owner = [], None
+    lookup = conn.cursor()
+    cursor = conn.execute("SELECT id, username FROM chat_history ORDER BY username, timestamp, id")
+    scanned = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for snapshot_id, username in rows:
+            scanned += 1
+            if username != owner:
+                heads, owner = [], username
+            text = lookup.execute("SELECT messages FROM chat_history WHERE id = ?", (snapshot_id,)).fetchone()[0] or ""
+            kept = []
+            for head_id, head_text in heads:
+                if _extends(text, head_text):
+                    superseded.append(head_id)
+                else:
+                    kept.append((head_id, head_text))
+            heads = kept + [(snapshot_id, text)]
+    for i in range(0, len(superseded), chunk_size):
+        batch = superseded[i:i + chunk_size]
+        with conn:
+            conn.execute(f"DELETE FROM chat_history WHERE id IN ({','.join('?' * len(batch))})", batch)
+    return scanned, len(superseded)
+
+def migrate_legacy(conn, chunk_size=LEGACY_CHUNK_SIZE):
+    # Surviving snapshots become conversation/message rows, keeping their
+    # id. Rows that do not parse at all stay where they are.
+    migrated = skipped = 0
+    last_id = ""
+    while True:
+        rows = conn.execute("SELECT id, username, timestamp, messages FROM chat_history WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, chunk_size)).fetchall()
+        if not rows:
+            return migrated, skipped
+        last_id = rows[-1][0]
+        with conn:
+            for snapshot_id, username, timestamp, text in rows:
+                messages = decode_legacy_snapshot(text or "")
+                if not messages:
+                    skipped += 1
+                    continue
+                created_at = next((m.timestamp for m in messages if m.timestamp), timestamp)
+                conn.execute(INSERT_CONVERSATION, (snapshot_id, username, created_at, timestamp))
+                message_rows, recommendations, title = _message_rows(snapshot_id, messages, 0)
+                _write_messages(conn, snapshot_id, message_rows, len(messages), title, timestamp, recommendations)
+                conn.execute("DELETE FROM chat_history WHERE id = ?", (snapshot_id,))
+                migrated += 1
+
+def migrate_legacy_history(chunk_size=LEGACY_CHUNK_SIZE):
+    # -> (scanned, superseded, migrated, unreadable)
+    with get_pool().connection() as conn:
+        if conn.execute("SELECT 1 FROM chat_history LIMIT 1").fetchone() is None:
+            return 0, 0, 0, 0
+        scanned, superseded = dedupe_legacy(conn, chunk_size)
+        migrated, unreadable = migrate_legacy(conn, chunk_size)
+    return scanned, superseded, migrated, unreadable
+
+# ===== USERS =====
+def create_user(username, password_hash):
+    try:
+        with get_pool().connection() as conn:
+            conn.execute(INSERT_USER, (username, password_hash))
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def get_password_hash(username):
+    with get_pool().connection() as conn:
+        result = conn.execute(SELECT_PASSWORD, (username,)).fetchone()
+    return result[0] if result else None
+
+def update_password_hash(username, password_hash):
+    with get_pool().connection() as conn:
+        conn.execute(UPDATE_PASSWORD, (password_hash, username))
+
+# ===== CHAT HISTORY PERSISTENCE =====
+# Conversations are append-only: each message is written once as its own row,
+# so a save costs O(new messages) instead of rewriting the whole transcript.
+def create_conversation(username):
+    conversation_id = str(uuid.uuid4())
+    timestamp = datetime.now().isoformat()
+    with get_pool().connection() as conn:
+        conn.execute(INSERT_CONVERSATION, (conversation_id, username, timestamp, timestamp))
+    return conversation_id
+
+def _recommendation_rows(conversation_id, seq, table, timestamp):
+    if not table:
+        return []
+    records = table.records()
+    return [(conversation_id, seq, i, group, record.get("Category"), record.get("Recommendation"), record.get("Impact"),
+             timestamp) for i, (record, group) in enumerate(zip(records, category_groups(table)))]
+
+def _search_rows(owner, conversation_id, rows, recommendations):
+    tips = {}
+    for _, seq, _, _, category, recommendation, impact, _ in recommendations:
+        tips.setdefault(seq, []).append(" ".join(filter(None, (category, recommendation, impact))))
+    return [(owner, content, "\n".join(tips.get(seq, ())) or None, conversation_id, seq)
+            for _, seq, _, content, _, _ in rows]
+
+def _write_messages(conn, conversation_id, rows, message_count, title, updated_at, recommendations=()):
+    owner = conn.execute("SELECT username FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+    owner = owner[0] if owner else None
+    search_rowids = {}
+    if owner is not None:
+        for row in _search_rows(owner_key(owner), conversation_id, rows, recommendations):
+            search_rowids[row[-1]] = conn.execute(INSERT_SEARCH, row).lastrowid
+    conn.executemany(INSERT_MESSAGE, [(*row, search_rowids.get(row[1])) for row in rows])
+    conn.executemany(INSERT_RECOMMENDATION, [(*r, owner) for r in recommendations])
+    conn.execute(UPDATE_CONVERSATION, (message_count, updated_at, title, conversation_id))
+
+def save_chat_history(conversation_id, messages, saved_count=0):
+    return append_messages(conversation_id, messages[saved_count:], saved_count)
+
+def append_messages(conversation_id, new_messages, saved_count):
+    # The unsaved tail only, for callers that never hold the whole transcript.
+    lost = _writer.lost_from(conversation_id) if _writer is not None else None
+    if lost is not None and lost < saved_count:
+        # The write-behind queue lost messages from `lost` on and holds back
+        # everything after; the caller resends from there.
+        return lost
+    if not new_messages:
+        return saved_count
+    with span("db_save"):
+        return _save_new_messages(conversation_id, new_messages, saved_count)
+
+def _message_rows(conversation_id, new_messages, saved_count):
+    rows = [(conversation_id, saved_count + i, m.role, m.content, encode_table(m.table), m.timestamp)
+            for i, m in enumerate(new_messages)]
+    recommendations = [r for i, m in enumerate(new_messages)
+                       for r in _recommendation_rows(conversation_id, saved_count + i, m.table, m.timestamp)]
+    title = next((m.content[:60] for m in new_messages if m.role == "user"), None)
+    return rows, recommendations, title
+
+def _save_new_messages(conversation_id, new_messages, saved_count):
+    rows, recommendations, title = _message_rows(conversation_id, new_messages, saved_count)
+    message_count = saved_count + len(new_messages)
+    write = (conversation_id, rows, message_count, title, datetime.now().isoformat(), recommendations)
+    pool = get_pool()
+    if _writer is not None:
+        _writer.submit(write)
+    else:
+        with pool.connection() as conn:
+            _write_messages(conn, *write)
+    return message_count
+
+# Metadata only: the sidebar lists conversations without touching their messages.
+# Served from idx_conversations_user_updated; returns one extra row so callers
+# can tell whether an older page exists.
+def load_chat_history(username, page=0, page_size=HISTORY_PAGE_SIZE):
+    flush_writes()
+    with span("db_history"), get_pool().connection() as conn:
+        return conn.execute(SELECT_HISTORY_PAGE, (username, page_size + 1, page * page_size)).fetchall()
+
+def load_conversation(conversation_id):
+    flush_writes()
+    with span("db_load"), get_pool().connection() as conn:
+        rows = conn.execute(SELECT_MESSAGES, (conversation_id,)).fetchall()
+    return [ChatMessage(role, content, decode_table(table_data), timestamp)
+            for role, content, table_data, timestamp in rows]
+
+def load_recommendations(username, category_group, limit=200):
+    # Newest first, straight from idx_recommendations_owner.
+    flush_writes()
+    with get_pool().connection() as conn:
+        return conn.execute(SELECT_RECOMMENDATIONS, (username, category_group, limit)).fetchall()
+
+# ===== SEARCH =====
+def owner_key(username):
+    # One digits-only token per exact username: the porter/unicode61
+    # tokenizer leaves it alone, so "Bob" and "bob" or "test" and "tests"
+    # never share a key the way their usernames share a stem.
+    return str(int.from_bytes(hashlib.sha256(username.encode("utf-8")).digest()[:12], "big"))
+
+def fts_query(username, text):
+    # Free text becomes an AND of quoted terms, so punctuation and FTS
+    # operators typed by the user are never parsed as query syntax; the
+    # last term also matches as a prefix for search-as-you-type.
+    terms = _SEARCH_TERMS.findall(text)
+    if not terms:
+        return None
+    terms = [f'"{t}"' for t in terms]
+    terms[-1] += "*"
+    return f'owner : "{owner_key(username)}" AND {{content recommendations}} : ({" ".join(terms)})'
+
+def search_messages(username, text, limit=SEARCH_LIMIT):
+    # Best matches first (bm25, recommendation rows weighted above prose),
+    # as (conversation_id, seq, title, role, timestamp, snippet).
+    query = fts_query(username, text)
+    if query is None:
+        return []
+    flush_writes()
+    with span("db_search"), get_pool().connection() as conn:
+        rows = conn.execute(SEARCH_MESSAGES, (query, limit, username)).fetchall()
+    return [(conversation_id, seq, title, role, timestamp, content if "**" in (content or "") or not tips else tips)
+            for conversation_id, seq, title, role, timestamp, content, tips in rows]
+
+# ===== SESSIONS =====
+# The server-side half of a signed session token (auth.issue_session_token):
+# what to restore when the user's browser lands on another replica or
+# reconnects after a restart. Deleting the row revokes the token.
+def put_session(session_id, username, state, ttl):
+    now = time.time()
+    with get_pool().connection() as conn:
+        conn.execute(UPSERT_SESSION, (session_id, username, json.dumps(state), now + ttl))
+        conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+def get_session(session_id):
+    # -> (username, state) while the session is live, else None.
+    with get_pool().connection() as conn:
+        row = conn.execute(SELECT_SESSION, (session_id, time.time())).fetchone()
+    return (row[0], json.loads(row[1] or "{}")) if row else None
+
+def delete_session(session_id):
+    with get_pool().connection() as conn:
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
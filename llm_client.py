@@ -0,0 +1,294 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from metrics import inc, span
+
+# ===== OPENROUTER CLIENT =====
+API_URL = os.environ.get("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+DEFAULT_MODEL = "deepseek/deepseek-r1:free"
+
+# Retry / circuit-breaker tuning, overridable from the environment.
+POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "32"))
+CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", "8"))
+BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "30"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    pass
+
+class CircuitBreaker:
+    # Closed -> open after `threshold` consecutive failures; once `cooldown`
+    # has passed a single trial request is let through (half-open) and its
+    # outcome closes or re-opens the circuit.
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_flight:
+                raise CircuitOpenError("Completion backend unavailable; failing fast")
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    def abandon(self):
+        # A cancelled request says nothing about backend health; it only
+        # hands back the half-open trial slot if it held it.
+        with self.lock:
+            self.trial_in_flight = False
+
+breaker = CircuitBreaker()
+
+# ===== CANCELLATION =====
+# set() on a CancelEvent passed to a request shuts down the socket that
+# request is using, so a read blocked on headers or on the stream fails at
+# once instead of running to its own timeout. The socket is only attached
+# while the caller owns the response; the pool never hands out one that is.
+class CancelEvent(threading.Event):
+    def __init__(self):
+        super().__init__()
+        self.conn = None
+        self.conn_lock = threading.Lock()
+
+    def set(self):
+        super().set()
+        with self.conn_lock:
+            _shutdown(self.conn)
+
+    def attach(self, conn):
+        with self.conn_lock:
+            self.conn = conn
+            if self.is_set():
+                _shutdown(conn)
+
+    def detach(self):
+        with self.conn_lock:
+            self.conn = None
+
+def _shutdown(conn):
+    sock = getattr(conn, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+_request_local = threading.local()
+
+class _CancellableMixin:
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        cancel = getattr(_request_local, "cancel", None)
+        if cancel is not None:
+            cancel.attach(self)
+
+class _HTTPConnection(_CancellableMixin, HTTPConnection):
+    pass
+
+class _HTTPSConnection(_CancellableMixin, HTTPSConnection):
+    pass
+
+class _HTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+class _HTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    # One keep-alive connection pool shared by every Streamlit session thread.
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE)
+                adapter.poolmanager.pool_classes_by_scheme = {"http": _HTTPConnectionPool,
+                                                              "https": _HTTPSConnectionPool}
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    pass
+    # Full jitter: uniform over [0, capped exponential].
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def post_with_retries(headers, payload, timeout=20, stream=False, max_retries=MAX_RETRIES, circuit=None, cancel=None):
+    # `circuit` is the breaker to report to (the model router keeps one per
+    # model); defaults to the shared one. `cancel` (a CancelEvent) aborts the
+    # request and any backoff wait; the caller detaches it once it is done
+    # with the returned response.
+    circuit = circuit or breaker
+    try:
+        circuit.before_request()
+    except CircuitOpenError:
+        inc("api_errors_total", kind="circuit_open")
+        raise
+    for attempt in range(max_retries + 1):
+        if cancel is not None and cancel.is_set():
+            circuit.abandon()
+            raise requests.exceptions.RequestException("Request cancelled")
+        _request_local.cancel = cancel
+        try:
+            with span("api_response_headers"):
+                response = get_session().post(API_URL, headers=headers, json=payload,
+                                              stream=stream, timeout=(CONNECT_TIMEOUT, timeout))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if cancel is not None:
+                cancel.detach()
+                if cancel.is_set():
+                    circuit.abandon()
+                    raise
+            kind = "timeout" if isinstance(e, requests.exceptions.Timeout) else "connection"
+            if attempt == max_retries:
+                circuit.record_failure()
+                inc("api_errors_total", kind=kind)
+                raise
+            inc("api_retries_total", reason=kind)
+            _wait(retry_delay(attempt), cancel, circuit)
+            continue
+        except requests.exceptions.RequestException:
+            if cancel is not None:
+                cancel.detach()
+            circuit.record_failure()
+            inc("api_errors_total", kind="request")
+            raise
+        finally:
+            _request_local.cancel = None
+        inc("api_requests_total", status=response.status_code)
+        if response.status_code not in RETRY_STATUSES:
+            # Success, or a non-retryable client error that says nothing
+            # about backend health.
+            circuit.record_success()
+            if response.status_code >= 400:
+                _release(response, cancel)
+                inc("api_errors_total", kind="http")
+                response.raise_for_status()
+            return response
+        delay = retry_delay(attempt, response)
+        _release(response, cancel)
+        if attempt == max_retries or delay > BACKOFF_MAX:
+            circuit.record_failure()
+            inc("api_errors_total", kind="http")
+            response.raise_for_status()
+        inc("api_retries_total", reason=response.status_code)
+        _wait(delay, cancel, circuit)
+
+def _release(response, cancel):
+    # Detached first, so a late cancel cannot reach a connection that is
+    # back in the pool.
+    if cancel is not None:
+        cancel.detach()
+    response.close()
+
+def _wait(delay, cancel, circuit):
+    if cancel is None:
+        time.sleep(delay)
+    elif cancel.wait(delay):
+        circuit.abandon()
+        raise requests.exceptions.RequestException("Request cancelled")
+
+def build_request(api_key, api_messages, stream=False, model=DEFAULT_MODEL):
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "HTTP-Referer": "http://localhost:8501",
+        "X-Title": "Sustainable Fashion Advisor"
+    }
+    payload = {
+        "model": model,
+        "messages": list(api_messages),
+    }
+    if stream:
+        payload["stream"] = True
+    return headers, payload
+
+def iter_sse_data(lines):
+    # Minimal server-sent events reader: joins the data fields of each event
+    # and stops at the OpenAI-style "[DONE]" sentinel. Comment lines
+    # (": OPENROUTER PROCESSING" keep-alives) are skipped.
+    data = []
+    for line in lines:
+        if line is None:
+            continue
+        if not line:
+            if data:
+                event = "\n".join(data)
+                data = []
+                if event == "[DONE]":
+                    return
+                yield event
+            continue
+        if line.startswith(":"):
+            continue
+        field, _, value = line.partition(":")
+        if field == "data":
+            data.append(value[1:] if value.startswith(" ") else value)
+    if data and "\n".join(data) != "[DONE]":
+        yield "\n".join(data)
+
+def get_completion(api_key, api_messages, timeout=20, model=DEFAULT_MODEL, cancel=None, **retry_options):
+    headers, payload = build_request(api_key, api_messages, model=model)
+    response = post_with_retries(headers, payload, timeout=timeout, cancel=cancel, **retry_options)
+    # The body was read with the headers (stream=False), so nothing is left
+    # to cancel.
+    _release(response, cancel)
+    return response.json()
+
+def stream_completion(api_key, api_messages, timeout=20, model=DEFAULT_MODEL, cancel=None, **retry_options):
+    headers, payload = build_request(api_key, api_messages, stream=True, model=model)
+    response = post_with_retries(headers, payload, timeout=timeout, stream=True, cancel=cancel, **retry_options)
+    try:
+        response.encoding = "utf-8"
+        for data in iter_sse_data(response.iter_lines(decode_unicode=True)):
+            event = json.loads(data)
+            if "error" in event:
+                raise requests.exceptions.RequestException(event["error"].get("message", "Stream error"))
+            choices = event.get("choices") or [{}]
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
+    finally:
+        _release(response, cancel)
@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Offline load test: a mock completion backend plus many simulated users,
+# each going register -> login -> multi-turn chat -> history -> export
+# through the same modules the Streamlit app calls, e.g.
+#   python loadtest.py --users 50 --concurrency 16 --turns 5
+#   python loadtest.py --error-rate 0.05 --rate-limit-rate 0.1 --json report.json
+# Databases go to a temporary directory unless --data-dir is given.
+
+STAGES = ("register", "login", "ttft", "chat_turn", "history", "export")
+PROMPTS = [
+    "What are eco-friendly fabrics?",
+    "Suggest sustainable brands for casual wear",
+    "How to care for organic cotton clothes?",
+    "How do I build a capsule wardrobe?",
+    "Is recycled polyester actually better?",
+    "Where can I buy second-hand designer clothes?",
+    "How should I wash wool sweaters?",
+    "Which certifications should I look for?",
+]
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def db_bytes(path):
+    # Checkpointed first: an un-checkpointed -wal holds every page version
+    # written since the last checkpoint, many times the data's own size.
+    if not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    finally:
+        conn.close()
+    return os.path.getsize(path)
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {stage: [] for stage in STAGES}
+        self.errors = {stage: 0 for stage in STAGES}
+        self.cache_hits = 0
+
+    def time(self, stage, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception:
+            with self.lock:
+                self.errors[stage] += 1
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.latencies[stage].append(seconds)
+
+def run_session(n, args, recorder, sessions, storage):
+    # Imported here so OPENROUTER_API_URL and the DB paths are already set.
+    from auth import allow_attempt, check_password, hash_password
+    from chat_records import ChatMessage
+    from context_window import ContextWindow
+    from model_router import router
+    from request_pipeline import UserLimitError, pipeline
+    from response_cache import fingerprint
+    from semantic_cache import get_similar_response, semantic_cache
+    from table_parser import COLUMNS, extract_table, recommendation_table
+    from transcript import Transcript
+
+    rng = random.Random(args.seed * 100003 + n)
+    username = f"load_{args.seed}_{n}"
+    password = "Passw0rd!"
+
+    def fetch(job, api_messages, stream):
+        # Same shape as main.fetch_reply, minus the Streamlit session.
+        replies = router.complete("load-test", api_messages, args.detail_level, stream)
+        if stream:
+            for chunk in replies:
+                job.chunks.append(chunk)
+            raw_reply = job.text()
+        else:
+            raw_reply = "".join(replies)
+        table_data, reply = extract_table(raw_reply)
+        storage.put_cached_response(job.key, raw_reply, {"rows": table_data, "prose": reply})
+        semantic_cache.remember(job.key, api_messages, args.detail_level)
+        return table_data, reply
+
+    recorder.time("register", lambda: storage.create_user(username, hash_password(password)))
+
+    def login():
+        if not allow_attempt(username):
+            raise RuntimeError("login rate limited")
+        if not check_password(password, storage.get_password_hash(username)):
+            raise RuntimeError("login rejected")
+    recorder.time("login", login)
+
+    messages = [ChatMessage("assistant", f"Welcome, {username}! 🌱", timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))]
+    context = ContextWindow()
+    transcript = Transcript()
+    conversation_id = None
+    saved = 0
+    for turn in range(args.turns):
+        time.sleep(rng.uniform(0, args.think_time))
+        prompt = rng.choice(PROMPTS) if rng.random() < args.repeat_share else f"{rng.choice(PROMPTS)} (variant {n}-{turn})"
+        started = time.perf_counter()
+        try:
+            user_message = ChatMessage("user", prompt, timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            api_messages = context.build(messages + [user_message], args.detail_level)
+            key = fingerprint(api_messages, args.detail_level)
+            cached = storage.get_cached_response(key)
+            if cached is None:
+                similar = get_similar_response(api_messages, args.detail_level, get_response=storage.get_cached_response)
+                cached = similar and similar[0]
+            if cached is not None:
+                with recorder.lock:
+                    recorder.cache_hits += 1
+                recorder.record("ttft", time.perf_counter() - started)
+                raw_reply, parsed = cached
+                table_data, reply = (parsed["rows"], parsed["prose"]) if parsed else extract_table(raw_reply)
+            else:
+                while True:
+                    try:
+                        job = pipeline.submit(username, key, fetch, api_messages, not args.no_stream)
+                        break
+                    except UserLimitError:
+                        time.sleep(args.poll)
+                first_token = None
+                while not job.done():
+                    if first_token is None and job.chunks:
+                        first_token = time.perf_counter()
+                        recorder.record("ttft", first_token - started)
+                    time.sleep(args.poll)
+                table_data, reply = job.result()
+                if first_token is None:
+                    recorder.record("ttft", time.perf_counter() - started)
+            messages.append(user_message)
+            messages.append(ChatMessage("assistant", reply, recommendation_table(table_data) if table_data else None,
+                                        time.strftime("%Y-%m-%dT%H:%M:%S")))
+            if conversation_id is None:
+                conversation_id = storage.create_conversation(username)
+            saved = storage.save_chat_history(conversation_id, messages, saved)
+            transcript.sync(messages)
+            recorder.record("chat_turn", time.perf_counter() - started)
+        except Exception as e:
+            with recorder.lock:
+                recorder.errors["chat_turn"] += 1
+            if args.verbose:
+                print(f"user {n} turn {turn}: {e!r}", file=sys.stderr)
+
+    def history():
+        rows = storage.load_chat_history(username)
+        if rows:
+            storage.load_conversation(rows[0][0])
+    recorder.time("history", history)
+
+    def export():
+        transcript.sync(messages)
+        for message in transcript.rendered:
+            if message.table is not None:
+                message.table.to_csv(COLUMNS)
+        return transcript.export
+    recorder.time("export", export)
+    # Kept alive until the end so memory per session can be measured.
+    sessions.append((messages, context, transcript))
+
+def run(args):
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="loadtest-")
+    users_db = os.path.join(data_dir, "users.db")
+    os.environ["USERS_DB"] = users_db
+    os.environ["RESPONSE_CACHE_DB"] = os.path.join(data_dir, "response_cache.db")
+    os.environ.setdefault("BCRYPT_ROUNDS", str(args.bcrypt_rounds))
+    os.environ.setdefault("LLM_MAX_CONCURRENCY", str(args.concurrency))
+    os.environ.setdefault("LLM_BACKOFF_BASE", "0.05")
+    # Burst of logins from one process must not trip the production limits.
+    os.environ.setdefault("LOGIN_USER_BURST", "1000")
+
+    from mock_llm import MockLLMConfig, MockLLMServer
+    server = MockLLMServer(MockLLMConfig(args.latency, args.jitter, args.token_delay, args.error_rate,
+                                         args.rate_limit_rate, args.retry_after, args.seed)).start()
+    os.environ["OPENROUTER_API_URL"] = server.url
+    storage_server = None
+    if args.storage_service:
+        # Same databases, but every call crosses HTTP as it would from a
+        # replica talking to a shared storage service.
+        from storage import SQLiteBackend, StorageServer
+        storage_server = StorageServer(SQLiteBackend()).start()
+
+    from db import flush_writes
+    from model_router import router
+    from request_pipeline import pipeline
+    from semantic_cache import semantic_cache
+    from storage import HTTPBackend, get_storage
+    storage = HTTPBackend(storage_server.url) if storage_server is not None else get_storage()
+    storage.init()
+    recorder = Recorder()
+    sessions = []
+    db_before = db_bytes(users_db)
+    rss_before = rss_bytes()
+
+    next_user = iter(range(args.users))
+    next_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with next_lock:
+                n = next(next_user, None)
+            if n is None:
+                return
+            try:
+                run_session(n, args, recorder, sessions, storage)
+            except Exception as e:
+                if args.verbose:
+                    print(f"user {n}: {e!r}", file=sys.stderr)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"user-{i}") for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    flush_writes()
+    rss_after = rss_bytes()
+    db_after = db_bytes(users_db)
+    server.stop()
+    if storage_server is not None:
+        storage_server.stop()
+
+    turns = len(recorder.latencies["chat_turn"])
+    report = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "storage": "http" if storage_server is not None else "sqlite",
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(turns / elapsed, 2) if elapsed else 0.0,
+        "sessions_per_s": round(len(sessions) / elapsed, 2) if elapsed else 0.0,
+        "cache_hits": recorder.cache_hits,
+        "backend": dict(server.config.counts),
+        "pipeline": pipeline.stats(),
+        "semantic": semantic_cache.snapshot(),
+        "models": router.snapshot(),
+        "stages": {stage: {
+            "count": len(samples),
+            "errors": recorder.errors[stage],
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        } for stage, samples in recorder.latencies.items()},
+        "db_growth_bytes": db_after - db_before,
+        "db_bytes_per_turn": round((db_after - db_before) / turns) if turns else 0,
+        "rss_growth_bytes": rss_after - rss_before,
+        "rss_bytes_per_session": round((rss_after - rss_before) / len(sessions)) if sessions else 0,
+        "data_dir": data_dir,
+    }
+    return report
+
+def print_report(report):
+    print(f"{report['users']} users, {report['concurrency']} concurrent, {report['storage']} storage, {report['elapsed_s']}s: "
+          f"{report['turns_per_s']} turns/s, {report['sessions_per_s']} sessions/s, "
+          f"{report['cache_hits']} cache hits")
+    backend = report["backend"]
+    print(f"backend: {backend['requests']} requests, {backend['ok']} ok, {backend['errors']} errors, "
+          f"{backend['rate_limited']} rate limited; pipeline coalesced {report['pipeline']['coalesced']}, "
+          f"failed {report['pipeline']['failed']}")
+    semantic = report["semantic"]
+    print(f"similar-prompt reuse: {semantic['hits']}/{semantic['lookups']} lookups ({semantic['hit_rate']:.0%}) "
+          f"at similarity >= {semantic['threshold']:.2f}")
+    for model, m in report["models"].items():
+        print(f"model {model}: {m['requests']} requests, {m['errors']} errors, {m['hedges']} hedges "
+              f"({m['hedge_wins']} won), {m['cancelled']} cancelled")
+    print(f"{'stage':<10} {'count':>6} {'errors':>6} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    for stage, s in report["stages"].items():
+        print(f"{stage:<10} {s['count']:>6} {s['errors']:>6} {s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9}")
+    print(f"users.db grew {report['db_growth_bytes'] / 1024:.1f} KiB ({report['db_bytes_per_turn']} bytes/turn); "
+          f"RSS grew {report['rss_growth_bytes'] / 1024:.1f} KiB ({report['rss_bytes_per_session'] / 1024:.1f} KiB/session)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the chat flow against a mock completion backend")
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8, help="Users active at the same time")
+    parser.add_argument("--turns", type=int, default=5, help="Chat turns per user")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Max random pause before each turn (s)")
+    parser.add_argument("--repeat-share", type=float, default=0.3,
+                        help="Share of prompts drawn verbatim from the shared pool (cacheable)")
+    parser.add_argument("--detail-level", default="standard", choices=["brief", "standard", "detailed"])
+    parser.add_argument("--no-stream", action="store_true", help="Use non-streaming completions")
+    parser.add_argument("--poll", type=float, default=0.01, help="Reply polling interval (s)")
+    parser.add_argument("--bcrypt-rounds", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock backend time to first byte (s)")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--storage-service", action="store_true",
+                        help="Go through a local storage service over HTTP instead of SQLite directly")
+    parser.add_argument("--data-dir", help="Keep the databases here instead of a temp dir")
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    errors = sum(s["errors"] for s in report["stages"].values())
+    raise SystemExit(1 if errors and not (args.error_rate or args.rate_limit_rate) else 0)
+
+if __name__ == "__main__":
+    main()
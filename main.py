@@ -1,148 +1,40 @@
 import streamlit as st
 import requests
-from pandas import DataFrame
-import sqlite3
-import bcrypt
 import re
 from datetime import datetime
 import streamlit.components.v1 as components
+import time
 import uuid
-from functools import lru_cache
-
-# Debug statement to confirm app.py is running
-print("Starting Sustainable Fashion Advisor app...")
-
-# ===== CSS STYLING =====
-def get_page_css(theme="light", button_size="medium"):
-    button_sizes = {
-        "small": {"padding": "8px", "font-size": "14px"},
-        "medium": {"padding": "12px", "font-size": "16px"},
-        "large": {"padding": "16px", "font-size": "18px"}
-    }
-    size = button_sizes.get(button_size, button_sizes["medium"])
-    base_css = f"""
-    .stApp {{
-        background-image: url("https://images.unsplash.com/photo-1597150899069-efb9c8c6010c?q=80&w=3438&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D");
-        background-size: cover;
-        background-position: center;
-        background-repeat: no-repeat;
-        background-attachment: fixed;
-        color: #ffffff;
-        transition: all 0.3s ease;
-    }}
-    .stTextInput, .stButton>button, .stSelectbox, .stCheckbox, .stCaption, .stTable {{
-        background-color: rgba(255, 255, 255, 0.9);
-        padding: 12px;
-        border-radius: 8px;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    }}
-    .stSidebar {{
-        background-color: rgba(255, 255, 255, 0.95);
-        border-right: 1px solid #ddd;
-    }}
-    .stSidebar .stButton>button {{
-        background-color: #4CAF50;
-        color: white;
-        border: none;
-        border-radius: 8px;
-        padding: {size['padding']};
-        margin: 5px 0;
-        width: 100%;
-        font-weight: bold;
-        font-size: {size['font-size']};
-        box-shadow: 0 2px 4px rgba(0,0,0,0.2);
-        transition: background-color 0.3s ease, transform 0.2s ease;
-    }}
-    .stSidebar .stButton>button:hover {{
-        background-color: #45a049;
-        transform: translateY(-2px);
-    }}
-    .stChatMessage {{
-        background-color: rgba(255, 255, 255, 0.85);
-        padding: 15px;
-        border-radius: 10px;
-        margin-bottom: 10px;
-    }}
-    .stButton>button {{
-        background-color: #4CAF50;
-        color: white;
-        border: none;
-        border-radius: 8px;
-        padding: {size['padding']};
-        width: 100%;
-        font-weight: bold;
-        font-size: {size['font-size']};
-    }}
-    .stButton>button:hover {{
-        background-color: #45a049;
-    }}
-    .st-emotion-cache-169dgwr, .st-emotion-cache-128upt6 {{
-        background-color: transparent !important;
-    }}
-    .timestamp {{
-        font-size: 0.8em;
-        color: #666;
-        margin-top: 5px;
-    }}
-    .sample-question {{
-        cursor: pointer;
-        color: #4CAF50;
-        text-decoration: underline;
-        margin-right: 10px;
-    }}
-    """
-    dark_theme = """
-    .stApp {
-        background-image: none;
-        background-color: #1e1e1e;
-        color: #e0e0e0;
-    }
-    .stTextInput, .stButton>button, .stSelectbox, .stCheckbox, .stCaption, .stTable {
-        background-color: rgba(40, 40, 40, 0.9);
-        color: #e0e0e0;
-    }
-    .stSidebar {
-        background-color: rgba(30, 30, 30, 0.95);
-        border-right: 1px solid #444;
-    }
-    .stChatMessage {
-        background-color: rgba(40, 40, 40, 0.85);
-        color: #e0e0e0;
-    }
-    """
-    return base_css if theme == "light" else base_css + dark_theme
-
-# ===== DATABASE SETUP =====
-def init_db():
-    with sqlite3.connect("users.db") as conn:
-        c = conn.cursor()
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                username TEXT PRIMARY KEY,
-                password TEXT NOT NULL
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id TEXT PRIMARY KEY,
-                username TEXT,
-                timestamp TEXT,
-                messages TEXT,
-                FOREIGN KEY (username) REFERENCES users (username)
-            )
-        """)
-        c.execute("CREATE INDEX IF NOT EXISTS idx_username ON users (username)")
-        conn.commit()
+from bootstrap import bootstrap
+from styles import page_css
+from db import HISTORY_PAGE_SIZE
+from storage import get_storage
+from auth import (hash_password, check_password, needs_rehash, allow_attempt, ip_limiter, client_ip,
+                  issue_session_token, verify_session_token, SESSION_TTL, HashingUnavailableError)
+from model_router import router
+from response_cache import fingerprint
+from semantic_cache import get_similar_response, semantic_cache
+from prompts import SAMPLE_QUESTIONS
+from context_window import ContextWindow
+from table_parser import COLUMNS, extract_table, recommendation_table
+from chat_records import ChatMessage, Table
+from request_pipeline import pipeline, UserLimitError
+from transcript import Transcript, CATEGORY_FILTERS
+from metrics import span, observe
 
-# Initialize database
-init_db()
+# One-time process setup (database schema, banner); a no-op on reruns
+bootstrap()
+# Accounts, chat history, the response cache and sessions: local SQLite, or
+# a storage service shared by every replica (STORAGE_BACKEND)
+storage = get_storage()
 
 # ===== AUTHENTICATION FUNCTIONS =====
-def hash_password(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-
-def check_password(password, hashed):
-    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+def get_client_ip():
+    # Only known behind a proxy (TRUSTED_PROXIES); otherwise the per-IP
+    # limit is skipped and the per-username one still applies. A proxy may
+    # add its own X-Forwarded-For line, so every line is read in order.
+    headers = st.context.headers
+    return client_ip(",".join(headers.get_all("X-Forwarded-For")), headers.get("X-Real-Ip"))
 
 def validate_username(username):
     return bool(re.match(r'^[a-zA-Z0-9_]{3,20}$', username))
@@ -150,47 +42,42 @@ def validate_username(username):
 def validate_password(password):
     return len(password) >= 8 and re.search(r'[A-Z]', password) and re.search(r'[0-9]', password)
 
+BUSY_MESSAGE = "The server is busy right now. Please try again in a moment."
+
 def register_user(username, password):
     if not validate_username(username):
         return False, "Username must be 3-20 characters, using letters, numbers, or underscores."
     if not validate_password(password):
         return False, "Password must be at least 8 characters, including an uppercase letter and a number."
-    with sqlite3.connect("users.db") as conn:
-        c = conn.cursor()
-        try:
-            c.execute("INSERT INTO users (username, password) VALUES (?, ?)", 
-                     (username, hash_password(password)))
-            conn.commit()
-            return True, "Registered successfully!"
-        except sqlite3.IntegrityError:
-            return False, "Username already exists."
+    ip = get_client_ip()
+    if ip is not None and not ip_limiter.allow(ip):
+        return False, "Too many attempts. Please wait a moment and try again."
+    try:
+        hashed = hash_password(password)
+    except HashingUnavailableError:
+        return False, BUSY_MESSAGE
+    if storage.create_user(username, hashed):
+        return True, "Registered successfully!"
+    return False, "Username already exists."
 
 def login_user(username, password):
-    with sqlite3.connect("users.db") as conn:
-        c = conn.cursor()
-        c.execute("SELECT password FROM users WHERE username = ?", (username,))
-        result = c.fetchone()
-        if result and check_password(password, result[0]):
-            return True
-        return False
-
-# ===== CHAT HISTORY PERSISTENCE =====
-def save_chat_history(username, messages):
-    with sqlite3.connect("users.db") as conn:
-        c = conn.cursor()
-        chat_id = str(uuid.uuid4())
-        timestamp = datetime.now().isoformat()
-        messages_str = str(messages)
-        c.execute("INSERT INTO chat_history (id, username, timestamp, messages) VALUES (?, ?, ?, ?)",
-                 (chat_id, username, timestamp, messages_str))
-        conn.commit()
-
-def load_chat_history(username):
-    with sqlite3.connect("users.db") as conn:
-        c = conn.cursor()
-        c.execute("SELECT id, timestamp, messages FROM chat_history WHERE username = ? ORDER BY timestamp DESC",
-                 (username,))
-        return c.fetchall()
+    if not allow_attempt(username, get_client_ip()):
+        return False, "Too many login attempts. Please wait a moment and try again."
+    hashed = storage.get_password_hash(username)
+    try:
+        valid = bool(hashed) and check_password(password, hashed)
+    except HashingUnavailableError:
+        return False, BUSY_MESSAGE
+    if valid:
+        # Transparently upgrade hashes made with a different work factor;
+        # left for the next login if the pool is busy.
+        if needs_rehash(hashed):
+            try:
+                storage.update_password_hash(username, hash_password(password))
+            except HashingUnavailableError:
+                pass
+        return True, "Logged in successfully!"
+    return False, "Invalid username or password."
 
 # ===== CONFIG =====
 try:
@@ -207,79 +94,190 @@ if "username" not in st.session_state:
 if "page" not in st.session_state:
     st.session_state.page = "login"
 if "messages" not in st.session_state:
-    st.session_state.messages = [{
-        "role": "assistant", 
-        "content": "Welcome to Sustainable Fashion Advisor! Ask about eco-friendly clothing, sustainable brands, or clothing care tips. Example: 'Suggest sustainable outfit ideas for work'. 🌱",
-        "table_data": None,
-        "timestamp": datetime.now().isoformat()
-    }]
-if "last_response_df" not in st.session_state:
-    st.session_state.last_response_df = None
+    st.session_state.messages = [ChatMessage(
+        "assistant",
+        "Welcome to Sustainable Fashion Advisor! Ask about eco-friendly clothing, sustainable brands, or clothing care tips. Example: 'Suggest sustainable outfit ideas for work'. 🌱",
+        timestamp=datetime.now().isoformat()
+    )]
+if "last_response_table" not in st.session_state:
+    st.session_state.last_response_table = None
 if "deep_search" not in st.session_state:
     st.session_state.deep_search = False
 if "previous_messages" not in st.session_state:
     st.session_state.previous_messages = None
+if "conversation_id" not in st.session_state:
+    st.session_state.conversation_id = None
+if "saved_count" not in st.session_state:
+    st.session_state.saved_count = 0
+if "previous_conversation" not in st.session_state:
+    st.session_state.previous_conversation = None
+if "history_page" not in st.session_state:
+    st.session_state.history_page = 0
+if "history_index" not in st.session_state:
+    st.session_state.history_index = None
+if "search_results" not in st.session_state:
+    st.session_state.search_results = None
+if "category_tips" not in st.session_state:
+    st.session_state.category_tips = None
+if "reused_similarity" not in st.session_state:
+    st.session_state.reused_similarity = None
+if "session_id" not in st.session_state:
+    st.session_state.session_id = None
+if "session_saved" not in st.session_state:
+    st.session_state.session_saved = None
 if "theme" not in st.session_state:
     st.session_state.theme = "light"
 if "button_size" not in st.session_state:
     st.session_state.button_size = "medium"
 if "detail_level" not in st.session_state:
     st.session_state.detail_level = "standard"
+if "stream_responses" not in st.session_state:
+    st.session_state.stream_responses = True
+if "pending_reply" not in st.session_state:
+    st.session_state.pending_reply = None
+if "reply_error" not in st.session_state:
+    st.session_state.reply_error = None
+if "transcript" not in st.session_state:
+    st.session_state.transcript = Transcript()
+if "context_window" not in st.session_state:
+    st.session_state.context_window = ContextWindow()
+
+def start_conversation(content):
+    st.session_state.messages = [ChatMessage("assistant", content, timestamp=datetime.now().isoformat())]
+    st.session_state.conversation_id = None
+    persist_chat()
+
+def open_conversation(conversation_id):
+    st.session_state.messages = storage.load_conversation(conversation_id)
+    st.session_state.conversation_id = conversation_id
+    st.session_state.saved_count = len(st.session_state.messages)
+    st.session_state.last_response_table = None
+
+def load_selected_chat():
+    if st.session_state.selected_chat is not None:
+        open_conversation(st.session_state.selected_chat)
+
+def persist_chat():
+    if st.session_state.conversation_id is None:
+        st.session_state.conversation_id = storage.create_conversation(st.session_state.username)
+        st.session_state.saved_count = 0
+    saved_count = st.session_state.saved_count
+    st.session_state.saved_count = storage.save_chat_history(
+        st.session_state.conversation_id, st.session_state.messages, saved_count
+    )
+    if st.session_state.saved_count != saved_count:
+        st.session_state.history_index = None
+        st.session_state.search_results = None
+        st.session_state.category_tips = None
+
+def get_history_index():
+    # Cached across reruns; persist_chat and paging invalidate it.
+    if st.session_state.history_index is None:
+        st.session_state.history_index = storage.load_chat_history(st.session_state.username, st.session_state.history_page)
+    return st.session_state.history_index
+
+def change_history_page(step):
+    st.session_state.history_page = max(0, st.session_state.history_page + step)
+    st.session_state.history_index = None
+
+def get_search_results(query):
+    # Cached per query across reruns; persist_chat invalidates it.
+    cached = st.session_state.search_results
+    if cached is None or cached[0] != query:
+        cached = st.session_state.search_results = (query, storage.search_messages(st.session_state.username, query))
+    return cached[1]
+
+def get_category_tips(category_group):
+    # Cached per category across reruns; persist_chat invalidates it.
+    cached = st.session_state.category_tips
+    if cached is None or cached[0] != category_group:
+        cached = st.session_state.category_tips = (
+            category_group, storage.load_recommendations(st.session_state.username, category_group))
+    return cached[1]
+
+# ===== SESSIONS =====
+# A signed token in the URL (?session=...) lets any replica, or this one
+# after a restart, pick a session back up: the token says who the user is,
+# and the storage backend holds which chat and settings to restore.
+SESSION_SETTINGS = ("theme", "button_size", "detail_level", "deep_search", "stream_responses")
+
+def session_snapshot():
+    previous = st.session_state.previous_conversation
+    return {"conversation_id": st.session_state.conversation_id,
+            "previous_conversation_id": previous[0] if previous else None,
+            **{key: st.session_state[key] for key in SESSION_SETTINGS}}
+
+def sync_session():
+    # One backend write per change, not per rerun.
+    if st.session_state.session_id is None:
+        return
+    state = session_snapshot()
+    if state != st.session_state.session_saved:
+        storage.put_session(st.session_state.session_id, st.session_state.username, state, SESSION_TTL)
+        st.session_state.session_saved = state
+
+def start_session(username, session_id=None):
+    st.session_state.authenticated = True
+    st.session_state.username = username
+    st.session_state.page = "main"
+    if session_id is None:
+        session_id = uuid.uuid4().hex
+        st.query_params["session"] = issue_session_token(session_id, username)
+    st.session_state.session_id = session_id
+
+def restore_session():
+    claims = verify_session_token(st.query_params.get("session"))
+    record = storage.get_session(claims[0]) if claims else None
+    if record is None or record[0] != claims[1]:
+        st.query_params.pop("session", None)
+        return
+    session_id, username = claims
+    state = record[1]
+    start_session(username, session_id)
+    for key in SESSION_SETTINGS:
+        if key in state:
+            st.session_state[key] = state[key]
+    if state.get("previous_conversation_id"):
+        st.session_state.previous_messages = storage.load_conversation(state["previous_conversation_id"])
+        st.session_state.previous_conversation = (state["previous_conversation_id"], len(st.session_state.previous_messages))
+    if state.get("conversation_id"):
+        open_conversation(state["conversation_id"])
+    else:
+        start_conversation(f"Welcome back, {username}! Ask about sustainable fashion or chat about anything else! 🌱")
+    st.session_state.session_saved = session_snapshot()
+
+def end_session():
+    if st.session_state.session_id is not None:
+        storage.delete_session(st.session_state.session_id)
+    st.session_state.session_id = None
+    st.session_state.session_saved = None
+    st.query_params.pop("session", None)
 
-# ===== SYSTEM MESSAGE =====
-def get_system_message(detail_level):
-    base_message = """
-    You are an expert sustainable fashion advisor with deep knowledge of eco-friendly trends, materials, and practices. Provide clear, engaging advice on sustainable fashion. Focus on:
-    - Eco-friendly clothing (e.g., organic cotton, Tencel, recycled fibers)
-    - Sustainable shopping (e.g., ethical brands, Fair Trade, second-hand platforms)
-    - Clothing care to extend garment life (e.g., low-impact washing, repairs)
-    - Brand recommendations or trends (e.g., carbon footprint, water usage)
-    
-    Format:
-    - Use concise, friendly language
-    - Include a markdown table with columns: [Category, Recommendation, Impact]
-    - Exclude rows with empty or whitespace-only columns
-    - Use emojis (🌿, 🛍️, 🧼, 📚) for sections
-    - No images
-    """
-    detail_instructions = {
-        "brief": "Keep responses short (2-3 sentences per section) with minimal detail. Include a table with 1-2 rows.",
-        "standard": "Provide balanced responses (3-5 sentences per section) with key details. Include a table with 2-3 rows.",
-        "detailed": "Give comprehensive responses (5-7 sentences per section) with data and sources. Include a table with 3-4 rows."
-    }
-    return {
-        "role": "system",
-        "content": f"{base_message}\n{detail_instructions[detail_level]}\n\nIf asked about developers, say: 'I was created by Aadi Jain, registration number 12304968.'"
-    }
+def format_history_entry(entry):
+    conversation_id, title, updated_at, message_count = entry
+    return f"{updated_at[:16].replace('T', ' ')} · {title or 'New chat'} ({message_count})"
 
 # ===== AUTHENTICATION PAGES =====
 def show_login_page():
-    st.markdown(get_page_css(st.session_state.theme, st.session_state.button_size), unsafe_allow_html=True)
+    st.markdown(page_css(st.session_state.theme, st.session_state.button_size), unsafe_allow_html=True)
     st.title("Login 🌱")
     username = st.text_input("Username", key="login_username")
     password = st.text_input("Password", type="password", key="login_password")
     if st.button("Login"):
-        if login_user(username, password):
-            st.session_state.authenticated = True
-            st.session_state.username = username
-            st.session_state.page = "main"
-            st.session_state.messages = [{
-                "role": "assistant", 
-                "content": f"Welcome, {username}! Ask about sustainable fashion or chat about anything else! 🌱",
-                "table_data": None,
-                "timestamp": datetime.now().isoformat()
-            }]
-            save_chat_history(username, st.session_state.messages)
-            st.success("Logged in successfully!")
+        success, message = login_user(username, password)
+        if success:
+            start_session(username)
+            start_conversation(f"Welcome, {username}! Ask about sustainable fashion or chat about anything else! 🌱")
+            st.success(message)
             st.rerun()
         else:
-            st.error("Invalid username or password.")
+            st.error(message)
     if st.button("Go to Register"):
         st.session_state.page = "register"
         st.rerun()
 
 def show_register_page():
-    st.markdown(get_page_css(st.session_state.theme, st.session_state.button_size), unsafe_allow_html=True)
+    st.markdown(page_css(st.session_state.theme, st.session_state.button_size), unsafe_allow_html=True)
     st.title("Register 🌱")
     username = st.text_input("Username", key="register_username")
     password = st.text_input("Password", type="password", key="register_password")
@@ -296,29 +294,120 @@ def show_register_page():
         st.rerun()
 
 # ===== MAIN APP =====
-@st.cache_data
-def get_ai_response(api_messages, detail_level):
+def fetch_reply(job, api_messages, stream, detail_level, deep_search):
+    # Runs on the completion worker pool, never on a script thread. Streamed
+    # tokens are appended to job.chunks for the polling session to render.
+    # Time to first token and total reply time count from submission, so
+    # they include any wait in the pipeline queue. The router picks the
+    # model, hedges slow requests and falls back on errors.
+    with span("completion"):
+        replies = router.complete(API_KEY, api_messages, detail_level, stream)
+        if stream:
+            for chunk in replies:
+                if not job.chunks:
+                    observe("ttft_seconds", time.monotonic() - job.submitted_at)
+                job.chunks.append(chunk)
+            raw_reply = job.text()
+        else:
+            raw_reply = "".join(replies)
+            observe("ttft_seconds", time.monotonic() - job.submitted_at)
+        if not raw_reply:
+            raise requests.exceptions.RequestException("Empty response")
+    with span("parse_table"):
+        table_data, reply = extract_table(raw_reply)
+    storage.put_cached_response(job.key, raw_reply, {"rows": table_data, "prose": reply})
+    semantic_cache.remember(job.key, api_messages, detail_level, deep_search)
+    observe("reply_seconds", time.monotonic() - job.submitted_at)
+    return table_data, reply
+
+def append_reply(table_data, reply):
+    table = recommendation_table(table_data) if table_data else None
+    st.session_state.last_response_table = table
+    st.session_state.messages.append(ChatMessage("assistant", reply, table, datetime.now().isoformat()))
+    persist_chat()
+
+def append_error_reply(error, content):
+    st.session_state.reply_error = error
+    st.session_state.last_response_table = None
+    st.session_state.messages.append(ChatMessage("assistant", content, timestamp=datetime.now().isoformat()))
+
+def submit_prompt(prompt):
+    if st.session_state.pending_reply is not None:
+        st.session_state.reply_error = "Please wait for the current reply to finish."
+        return
+    st.session_state.last_response_table = None
+    st.session_state.reused_similarity = None
+    user_message = ChatMessage("user", prompt, timestamp=datetime.now().isoformat())
+    # Recent turns verbatim, older ones as a rolling summary, within the
+    # detail level's token budget
+    api_messages = st.session_state.context_window.build(
+        st.session_state.messages + [user_message], st.session_state.detail_level, st.session_state.deep_search
+    )
+    # Serve from the shared response cache (exact, then a close enough
+    # paraphrase), otherwise hand the request to the worker pool and poll for it
+    cache_key = fingerprint(api_messages, st.session_state.detail_level, st.session_state.deep_search)
+    cached = storage.get_cached_response(cache_key)
+    if cached is None:
+        similar = get_similar_response(api_messages, st.session_state.detail_level, st.session_state.deep_search,
+                                       storage.get_cached_response)
+        if similar is not None:
+            cached, st.session_state.reused_similarity = similar
+    if cached is None:
+        try:
+            job = pipeline.submit(st.session_state.username, cache_key, fetch_reply,
+                                  api_messages, st.session_state.stream_responses,
+                                  st.session_state.detail_level, st.session_state.deep_search)
+        except UserLimitError as e:
+            st.session_state.reply_error = str(e)
+            return
+        st.session_state.messages.append(user_message)
+        st.session_state.pending_reply = {"job": job, "conversation_id": st.session_state.conversation_id}
+        return
+    st.session_state.messages.append(user_message)
+    raw_reply, parsed = cached
+    if parsed:
+        append_reply(parsed["rows"], parsed["prose"])
+    else:
+        append_reply(*extract_table(raw_reply))
+
+def collect_pending_reply():
+    pending = st.session_state.pending_reply
+    if pending is None or not pending["job"].done():
+        return
+    st.session_state.pending_reply = None
+    if pending["conversation_id"] != st.session_state.conversation_id:
+        return
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {API_KEY}",
-                "HTTP-Referer": "http://localhost:8501",
-                "X-Title": "Sustainable Fashion Advisor"
-            },
-            json={
-                "model": "deepseek/deepseek-r1:free",
-                "messages": api_messages,
-            },
-            timeout=20
-        )
-        response.raise_for_status()
-        return response.json()
+        append_reply(*pending["job"].result())
     except requests.exceptions.RequestException:
-        return None
+        append_error_reply("Network error. Please check your connection and try again. 🚫",
+                           "I'm having trouble connecting. Please try again later.")
+    except Exception as e:
+        append_error_reply(f"An error occurred: {str(e)}",
+                           "Sorry, I encountered an error. Please rephrase your request.")
+
+@st.fragment(run_every=0.25)
+def show_pending_reply():
+    pending = st.session_state.pending_reply
+    if pending is None:
+        return
+    job = pending["job"]
+    if job.done():
+        st.rerun()
+    with st.chat_message("assistant"):
+        text = job.text()
+        if text:
+            st.markdown(text + "▌")
+        else:
+            # Static; run_every redraws it until the first token arrives.
+            st.markdown("_Thinking..._ ⏳")
+
+def submit_chat_input():
+    if st.session_state.chat_prompt:
+        submit_prompt(st.session_state.chat_prompt)
 
 def show_main_app():
-    st.markdown(get_page_css(st.session_state.theme, st.session_state.button_size), unsafe_allow_html=True)
+    st.markdown(page_css(st.session_state.theme, st.session_state.button_size), unsafe_allow_html=True)
     st.title(f"Welcome, {st.session_state.username}! 🌱 Sustainable Fashion Advisor")
 
     # Sidebar
@@ -336,16 +425,22 @@ def show_main_app():
         st.subheader("User Info 👤")
         st.markdown(f"*Logged in as:* {st.session_state.username}")
         if st.button("Logout 🚪", help="Log out of your account"):
+            end_session()
             st.session_state.authenticated = False
             st.session_state.username = None
             st.session_state.page = "login"
-            st.session_state.messages = [{
-                "role": "assistant", 
-                "content": "You have logged out. Please log in to continue! 🌿",
-                "table_data": None,
-                "timestamp": datetime.now().isoformat()
-            }]
+            st.session_state.messages = [ChatMessage(
+                "assistant", "You have logged out. Please log in to continue! 🌿", timestamp=datetime.now().isoformat()
+            )]
             st.session_state.previous_messages = None
+            st.session_state.previous_conversation = None
+            st.session_state.pending_reply = None
+            st.session_state.conversation_id = None
+            st.session_state.saved_count = 0
+            st.session_state.history_page = 0
+            st.session_state.history_index = None
+            st.session_state.search_results = None
+            st.session_state.category_tips = None
             st.rerun()
         st.markdown("---")
         st.subheader("Theme 🎨")
@@ -367,52 +462,83 @@ def show_main_app():
             st.rerun()
         st.markdown("---")
         st.subheader("Chat History 📜")
-        chat_histories = load_chat_history(st.session_state.username)
-        if chat_histories:
-            selected_chat = st.selectbox(
+        search_query = st.text_input("Search my chats 🔎", key="chat_search",
+                                     placeholder="e.g. wool care, Tencel brands")
+        if search_query.strip():
+            results = get_search_results(search_query.strip())
+            st.caption(f"{len(results)} matching messages" if results else "No matching messages")
+            for i, (conversation_id, seq, title, role, timestamp, snippet) in enumerate(results):
+                when = (timestamp or "")[:16].replace("T", " ")
+                st.markdown(f"**{title or 'New chat'}** · {when}  \n{snippet}")
+                st.button("Open chat 📂", key=f"search_result_{i}", on_click=open_conversation, args=(conversation_id,))
+        history_rows = get_history_index()
+        has_older = len(history_rows) > HISTORY_PAGE_SIZE
+        history_rows = history_rows[:HISTORY_PAGE_SIZE]
+        if history_rows:
+            history_labels = {h[0]: format_history_entry(h) for h in history_rows}
+            st.selectbox(
                 "Load Previous Chat",
-                options=["None"] + [f"{h[1][:19]}" for h in chat_histories],
-                index=0
+                options=[None] + list(history_labels),
+                format_func=lambda chat_id: "None" if chat_id is None else history_labels[chat_id],
+                index=0,
+                key="selected_chat",
+                on_change=load_selected_chat
             )
-            if selected_chat != "None":
-                for h in chat_histories:
-                    if h[1][:19] == selected_chat:
-                        st.session_state.messages = eval(h[2])
-                        st.rerun()
+        if st.session_state.history_page > 0 or has_older:
+            newer_col, older_col = st.columns(2)
+            with newer_col:
+                st.button("◀ Newer", disabled=st.session_state.history_page == 0,
+                          on_click=change_history_page, args=(-1,))
+            with older_col:
+                st.button("Older ▶", disabled=not has_older,
+                          on_click=change_history_page, args=(1,))
         if st.button("New Chat 🌟", help="Start a new chat session"):
             st.session_state.previous_messages = st.session_state.messages.copy()
-            st.session_state.messages = [{
-                "role": "assistant", 
-                "content": f"New chat started, {st.session_state.username}! Ask about sustainable fashion or anything else! 🌱",
-                "table_data": None,
-                "timestamp": datetime.now().isoformat()
-            }]
-            st.session_state.last_response_df = None
-            save_chat_history(st.session_state.username, st.session_state.messages)
+            st.session_state.previous_conversation = (st.session_state.conversation_id, st.session_state.saved_count)
+            start_conversation(f"New chat started, {st.session_state.username}! Ask about sustainable fashion or anything else! 🌱")
+            st.session_state.last_response_table = None
             st.rerun()
         if st.session_state.previous_messages and st.button("Resume Chat 🔄", help="Resume the previous chat"):
             st.session_state.messages = st.session_state.previous_messages.copy()
+            st.session_state.conversation_id, st.session_state.saved_count = st.session_state.previous_conversation
             st.session_state.previous_messages = None
-            save_chat_history(st.session_state.username, st.session_state.messages)
+            st.session_state.previous_conversation = None
+            persist_chat()
             st.rerun()
         if st.button("Clear Chat History 🗑️", help="Clear the current chat"):
             st.session_state.previous_messages = st.session_state.messages.copy()
-            st.session_state.messages = [{
-                "role": "assistant", 
-                "content": "Chat history cleared! Ask about sustainable fashion or anything else! 🌿",
-                "table_data": None,
-                "timestamp": datetime.now().isoformat()
-            }]
-            st.session_state.last_response_df = None
-            save_chat_history(st.session_state.username, st.session_state.messages)
+            st.session_state.previous_conversation = (st.session_state.conversation_id, st.session_state.saved_count)
+            start_conversation("Chat history cleared! Ask about sustainable fashion or anything else! 🌿")
+            st.session_state.last_response_table = None
             st.rerun()
         st.checkbox("Enable DeepSearch Mode 🔍", key="deep_search", help="Include web-sourced trends (may increase response time)")
+        st.checkbox("Stream Responses ⚡", key="stream_responses", help="Show the reply as it is generated")
         category_filter = st.selectbox(
             "Filter Table by Category 📊",
-            options=["All", "Clothing", "Shopping", "Care", "Resources"],
+            options=list(CATEGORY_FILTERS),
             index=0,
             help="Filter the recommendation table by category"
         )
+        all_chats_filter = category_filter != "All" and st.checkbox(
+            "Search all my chats 🗂️", help=f"Show every {category_filter} tip from your saved chats"
+        )
+        stats = storage.cache_stats()
+        st.caption(f"Response cache: {stats['hits']} hits / {stats['misses']} misses ({stats['entries']} entries)")
+        similar = semantic_cache.snapshot()
+        st.caption(f"Similar-prompt reuse: {similar['hits']}/{similar['lookups']} lookups ({similar['hit_rate']:.0%}) "
+                   f"at similarity ≥ {similar['threshold']:.2f}")
+        prompt = st.session_state.context_window.last_stats
+        if prompt:
+            st.caption(f"Last prompt: ~{prompt['prompt_tokens']}/{prompt['budget']} tokens, "
+                       f"{prompt['verbatim_messages']} recent messages + {prompt['summarized_messages']} summarized")
+        queue = pipeline.stats()
+        st.caption(f"Completion queue: {queue['queue_depth']} waiting, {queue['active']}/{queue['max_concurrency']} active")
+        models = router.snapshot()
+        if models:
+            st.caption("Models: " + "; ".join(
+                f"{model.split('/')[-1]} p95 {m['p95'] or 0:.1f}s, {m['error_rate']:.0%} errors, "
+                f"{m['hedge_wins']}/{m['hedges']} hedges won{'' if m['healthy'] else ' (avoided)'}"
+                for model, m in models.items()))
         st.markdown("---")
         st.subheader("Developer Info 🛠️")
         st.markdown("*Name:* Aadi Jain  \n*Registration No:* 12304968")
@@ -428,25 +554,58 @@ def show_main_app():
     <h1 class='welcome-text'>Sustainable Fashion Advisor</h1>
     """, height=60)
 
-    # Display chat messages
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            if message.get("table_data") is not None and not message["table_data"].empty:
-                df = message["table_data"]
-                if category_filter != "All":
-                    df = df[df["Category"].str.contains(category_filter, case=False, na=False)]
-                if not df.empty:
-                    st.table(df)
-            st.markdown(message["content"])
-            if message.get("timestamp"):
-                st.markdown(f"<div class='timestamp'>{message['timestamp'][:19]}</div>", unsafe_allow_html=True)
+    # Accept user input (submitted from the widget callbacks, before this rerun)
+    collect_pending_reply()
+    st.chat_input("Ask about sustainable fashion or chat... 💬", key="chat_prompt",
+                  on_submit=submit_chat_input, disabled=st.session_state.pending_reply is not None)
+
+    # Display chat messages: only the most recent window is rendered, from
+    # the cached render model
+    transcript = st.session_state.transcript.sync(st.session_state.messages)
+    if all_chats_filter:
+        tips = get_category_tips(category_filter)
+        st.subheader(f"All {category_filter} tips from your chats ({len(tips)})")
+        if tips:
+            tips_table = Table(("Category", "Recommendation", "Impact", "Chat"),
+                               [(t[1], t[2], t[3], t[4] or "New chat") for t in tips])
+            st.dataframe(tips_table.select(), hide_index=True)
+    elif category_filter != "All":
+        st.caption(f"{transcript.category_count(category_filter)} {category_filter} tips in this chat")
+    hidden = transcript.hidden_count()
+    if hidden:
+        st.button(f"Load earlier messages ({hidden} hidden) ⬆️", on_click=transcript.load_earlier)
+    with span("render_transcript"):
+        for message in transcript.visible():
+            with st.chat_message(message.role):
+                table = message.table_view(category_filter)
+                if table is not None:
+                    st.table(table)
+                st.markdown(message.content)
+                if message.timestamp:
+                    st.markdown(f"<div class='timestamp'>{message.timestamp}</div>", unsafe_allow_html=True)
+
+    # Reply in progress, or the outcome of the last one
+    if st.session_state.pending_reply is not None:
+        show_pending_reply()
+    if st.session_state.reply_error:
+        st.error(st.session_state.reply_error)
+        st.session_state.reply_error = None
+    if st.session_state.reused_similarity is not None:
+        st.caption(f"♻️ Answered from a similar earlier question (similarity {st.session_state.reused_similarity:.2f})")
+    if st.session_state.last_response_table:
+        csv = st.session_state.last_response_table.to_csv(COLUMNS)
+        st.download_button(
+            label="Save Recommendations as CSV 📥",
+            data=csv,
+            file_name="sustainable_fashion_recommendations.csv",
+            mime="text/csv"
+        )
 
     # Export Chat History
-    if st.session_state.messages:
-        chat_text = "\n\n".join([f"**{m['role'].capitalize()}** ({m['timestamp'][:19]}):\n{m['content']}" for m in st.session_state.messages if m.get("content")])
+    if transcript.export:
         st.download_button(
             label="Export Chat as Markdown 📜",
-            data=chat_text,
+            data=transcript.export,
             file_name="chat_history.md",
             mime="text/markdown"
         )
@@ -454,142 +613,21 @@ def show_main_app():
     # Sample Questions
     st.markdown("**Try these questions:**")
     cols = st.columns(3)
-    sample_questions = [
-        "What are eco-friendly fabrics?",
-        "Suggest sustainable brands for casual wear",
-        "How to care for organic cotton clothes?"
-    ]
-    for i, q in enumerate(sample_questions):
+    for i, q in enumerate(SAMPLE_QUESTIONS):
         with cols[i]:
-            if st.button(q, key=f"sample_{i}"):
-                st.session_state.pending_question = q
-
-    # Accept user input
-    prompt = st.chat_input("Ask about sustainable fashion or chat... 💬")
-    if prompt or "pending_question" in st.session_state:
-        prompt = prompt or st.session_state.pop("pending_question", None)
-        if prompt:
-            # Add user message to chat history
-            st.session_state.messages.append({
-                "role": "user",
-                "content": prompt,
-                "table_data": None,
-                "timestamp": datetime.now().isoformat()
-            })
-            
-            # Display user message
-            with st.chat_message("user"):
-                st.markdown(prompt)
-                st.markdown(f"<div class='timestamp'>{datetime.now().isoformat()[:19]}</div>", unsafe_allow_html=True)
-            
-            # Placeholder for assistant response
-            response_placeholder = st.empty()
-            
-            # Display assistant response
-            with response_placeholder.container():
-                with st.spinner("Thinking... ⏳"):
-                    try:
-                        # Prepare messages for API
-                        api_messages = [
-                            {k: v for k, v in msg.items() if k in ["role", "content"]} 
-                            for msg in st.session_state.messages
-                        ]
-                        
-                        # Insert system message
-                        if len(api_messages) == 1 or api_messages[0]["role"] != "system":
-                            api_messages.insert(0, get_system_message(st.session_state.detail_level))
-                        
-                        # DeepSearch Mode
-                        if st.session_state.deep_search:
-                            api_messages[-1]["content"] += " (Include latest web-sourced trends)"
-                        
-                        # Get AI response
-                        data = get_ai_response(tuple(api_messages), st.session_state.detail_level)
-                        if not data:
-                            raise requests.exceptions.RequestException("API request failed")
-                        
-                        reply = data["choices"][0]["message"]["content"]
-                        
-                        # Robust table extraction
-                        table_data = []
-                        table_pattern = r'\|([^|\n]*)\|([^|\n]*)\|([^|\n]*)\|'
-                        matches = re.finditer(table_pattern, reply, re.MULTILINE)
-                        for match in matches:
-                            if "Category" not in match.group(0) and "---" not in match.group(0):
-                                category, recommendation, impact = [g.strip() for g in match.groups()]
-                                if all([category, recommendation, impact]):
-                                    table_data.append({
-                                        "Category": category,
-                                        "Recommendation": recommendation,
-                                        "Impact": impact
-                                    })
-                        
-                        # Create DataFrame
-                        df = DataFrame(table_data) if table_data else None
-                        
-                        # Remove table from reply
-                        if table_data:
-                            reply = re.sub(table_pattern, '', reply, flags=re.MULTILINE).strip()
-                            reply = re.sub(r'\n\s*\n', '\n', reply)
-                        
-                        # Clear placeholder and display response
-                        with st.chat_message("assistant"):
-                            if df is not None and not df.empty:
-                                filtered_df = df
-                                if category_filter != "All":
-                                    filtered_df = df[df["Category"].str.contains(category_filter, case=False, na=False)]
-                                if not filtered_df.empty:
-                                    st.table(filtered_df)
-                                st.session_state.last_response_df = df
-                            else:
-                                st.session_state.last_response_df = None
-                            
-                            st.markdown(reply)
-                            st.markdown(f"<div class='timestamp'>{datetime.now().isoformat()[:19]}</div>", unsafe_allow_html=True)
-                            
-                            # Add Save Recommendations button
-                            if st.session_state.last_response_df is not None and not st.session_state.last_response_df.empty:
-                                csv = st.session_state.last_response_df.to_csv(index=False)
-                                st.download_button(
-                                    label="Save Recommendations as CSV 📥",
-                                    data=csv,
-                                    file_name="sustainable_fashion_recommendations.csv",
-                                    mime="text/csv"
-                                )
-                        
-                        # Append assistant message to history
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": reply,
-                            "table_data": df,
-                            "timestamp": datetime.now().isoformat()
-                        })
-                        save_chat_history(st.session_state.username, st.session_state.messages)
-                    
-                    except requests.exceptions.RequestException as e:
-                        with st.chat_message("assistant"):
-                            st.error("Network error. Please check your connection and try again. 🚫")
-                            st.session_state.messages.append({
-                                "role": "assistant",
-                                "content": "I'm having trouble connecting. Please try again later.",
-                                "table_data": None,
-                                "timestamp": datetime.now().isoformat()
-                            })
-                    except Exception as e:
-                        with st.chat_message("assistant"):
-                            st.error(f"An error occurred: {str(e)}")
-                            st.session_state.messages.append({
-                                "role": "assistant",
-                                "content": "Sorry, I encountered an error. Please rephrase your request.",
-                                "table_data": None,
-                                "timestamp": datetime.now().isoformat()
-                            })
+            st.button(q, key=f"sample_{i}", on_click=submit_prompt, args=(q,))
 
 # ===== PAGE ROUTING =====
-if not st.session_state.authenticated:
-    if st.session_state.page == "login":
-        show_login_page()
-    elif st.session_state.page == "register":
-        show_register_page()
-else:
-    show_main_app()
\ No newline at end of file
+with span("script_run"):
+    if not st.session_state.authenticated and "session" in st.query_params:
+        restore_session()
+    if not st.session_state.authenticated:
+        if st.session_state.page == "login":
+            show_login_page()
+        elif st.session_state.page == "register":
+            show_register_page()
+    else:
+        try:
+            show_main_app()
+        finally:
+            sync_session()
\ No newline at end of file
@@ -0,0 +1,256 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ===== INSTRUMENTATION =====
+# Process-wide counters and histograms, rendered in the Prometheus text
+# format. Recording is a dict update under one lock, cheap enough to leave on
+# in production. Exposed over HTTP when METRICS_PORT is set and/or written
+# to METRICS_FILE (for node_exporter's textfile collector) every
+# METRICS_FILE_INTERVAL seconds.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_FILE = os.environ.get("METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.environ.get("METRICS_FILE_INTERVAL", "15"))
+PREFIX = "ecothread_"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+HELP = {
+    "stage_seconds": "Time spent per stage of a turn",
+    "ttft_seconds": "Time from submitting a prompt to the first reply token",
+    "reply_seconds": "Time from submitting a prompt to the complete reply",
+    "response_cache_hits_total": "Prompts answered from the response cache",
+    "response_cache_misses_total": "Prompts that needed a completion call",
+    "response_cache_evictions_total": "Response cache entries evicted or expired",
+    "api_requests_total": "Completion API responses by status",
+    "api_retries_total": "Completion API retries by reason",
+    "api_errors_total": "Completion API failures by kind",
+    "semantic_cache_lookups_total": "Exact-cache misses checked against similar answered prompts",
+    "semantic_cache_hits_total": "Prompts answered with the reply to a similar earlier prompt",
+    "semantic_cache_threshold": "Cosine similarity needed to reuse an answer",
+    "semantic_cache_hit_rate": "Share of similar-prompt lookups that reused an answer",
+    "model_requests_total": "Completion attempts sent per model, hedges included",
+    "model_errors_total": "Failed completion attempts per model",
+    "model_hedges_total": "Hedged backup attempts per model",
+    "model_hedge_wins_total": "Replies won by a hedged backup attempt",
+    "model_hedges_skipped_total": "Hedges not sent, by reason (no other model, attempt pool full)",
+    "model_router_timeouts_total": "Replies where no model answered in time",
+    "model_ttft_seconds": "Time from sending an attempt to its first token per model",
+    "model_ttft_p50_seconds": "Rolling median time to first token per model (times LLM_HEDGE_MULTIPLIER: hedge deadline)",
+    "model_ttft_p95_seconds": "Rolling p95 time to first token per model",
+    "model_error_rate": "Rolling share of failed attempts per model",
+    "model_healthy": "Whether a model is currently routed to first",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_collectors = []
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, n=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        counts = _histograms.get(key)
+        if counts is None:
+            # Per-bucket counts plus sum and count; cumulative at render time.
+            counts = _histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        counts[0][bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        counts[1] += value
+        counts[2] += 1
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=stage)
+
+def register_collector(fn):
+    # fn() -> [(name, labels, value)] gauges read at scrape time, for stats
+    # other modules already keep (cache size, queue depth).
+    _collectors.append(fn)
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def render():
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(c[0]), c[1], c[2]) for key, c in _histograms.items()}
+    lines = []
+    typed = set()
+
+    def header(name, kind):
+        if name not in typed:
+            typed.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {PREFIX}{name} {HELP[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+    for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+            cumulative += n
+            lines.append(f"{PREFIX}{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{PREFIX}{name}_count{_labels(labels)} {count}")
+    for collect in _collectors:
+        try:
+            gauges = collect()
+        except Exception as e:
+            print(f"metrics: collector {collect.__name__} failed: {e}", file=sys.stderr)
+            continue
+        for name, labels, value in gauges:
+            header(name, "gauge")
+            lines.append(f"{PREFIX}{name}{_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
+
+def write_file(path=None):
+    # Written to a temp file and renamed so scrapers never see half a file.
+    path = path or METRICS_FILE
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+# ===== SAMPLING PROFILER =====
+# Opt-in and off by default. While running, a daemon thread samples every
+# thread's stack each `interval` seconds and counts collapsed stacks
+# ("a;b;c N" lines, the input format of flamegraph.pl/speedscope).
+class SamplingProfiler:
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = {}
+        self.samples = 0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=None):
+        with self.lock:
+            if self.running():
+                return False
+            if interval:
+                self.interval = interval
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def reset(self):
+        with self.lock:
+            self.stacks = {}
+            self.samples = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    key = ";".join(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def collapsed(self):
+        with self.lock:
+            return "".join(f"{stack} {n}\n" for stack, n in sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+profiler = SamplingProfiler()
+
+# ===== EXPORTERS =====
+class _Handler(BaseHTTPRequestHandler):
+    # GET /metrics, plus runtime profiler control:
+    # /profile/start[?interval=0.005], /profile/stop, /profile (collapsed stacks)
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/metrics":
+            self._send(render(), "text/plain; version=0.0.4")
+        elif path == "/profile/start":
+            interval = dict(p.partition("=")[::2] for p in query.split("&") if p).get("interval")
+            started = profiler.start(float(interval) if interval else None)
+            self._send("started\n" if started else "already running\n")
+        elif path == "/profile/stop":
+            profiler.stop()
+            self._send(f"stopped after {profiler.samples} samples\n")
+        elif path == "/profile/reset":
+            profiler.reset()
+            self._send("reset\n")
+        elif path == "/profile":
+            self._send(profiler.collapsed())
+        else:
+            self.send_error(404)
+
+    def _send(self, body, content_type="text/plain"):
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+def start_exporter(port=METRICS_PORT, host=METRICS_HOST, path=METRICS_FILE):
+    global _server, _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return _server
+        _exporter_started = True
+        if port:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+        if path:
+            def write_loop():
+                while True:
+                    try:
+                        write_file(path)
+                    except OSError as e:
+                        print(f"metrics: could not write {path}: {e}", file=sys.stderr)
+                    time.sleep(METRICS_FILE_INTERVAL)
+            threading.Thread(target=write_loop, name="metrics-file", daemon=True).start()
+        if os.environ.get("PROFILE_ON_START") == "1":
+            profiler.start()
+        return _server
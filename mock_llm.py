@@ -0,0 +1,188 @@
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ===== MOCK COMPLETION BACKEND =====
+# A local stand-in for the OpenRouter chat-completions endpoint, for load
+# tests and offline runs. Latency (per model if wanted), occasional stalls,
+# streaming pace and the share of failed (500) and rate-limited (429)
+# responses are configurable, and a seeded RNG keeps runs reproducible. Point the app at it with
+#   OPENROUTER_API_URL=http://127.0.0.1:<port>/api/v1/chat/completions
+REPLY_TEMPLATE = """Here are some sustainable options for "{prompt}" 🌿
+
+| Category | Recommendation | Impact |
+|---|---|---|
+| Clothing 🌿 | Choose organic cotton or Tencel basics | Uses far less water than conventional cotton |
+| Shopping 🛍️ | Buy second-hand or from B Corp brands | Keeps garments in use and supports fair labour |
+| Care 🧼 | Wash cold and line-dry | Saves energy and makes clothes last longer |
+
+Small, consistent choices add up. Let me know if you want brand suggestions! 🌱"""
+
+class MockLLMConfig:
+    def __init__(self, latency=0.2, jitter=0.1, token_delay=0.005, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, seed=0, model_latency=None, stall_rate=0.0, stall_latency=5.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        # Optional per-model overrides of `latency`, e.g. {"fast/model": 0.05}
+        self.model_latency = model_latency or {}
+        # A `stall_rate` share of requests waits `stall_latency` extra: the
+        # slow tail that hedged requests are meant to cut.
+        self.stall_rate = stall_rate
+        self.stall_latency = stall_latency
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "streamed": 0}
+
+    def draw(self, model):
+        # One locked draw per request keeps the outcome sequence reproducible.
+        with self.lock:
+            self.counts["requests"] += 1
+            roll = self.rng.random()
+            delay = max(0.0, self.model_latency.get(model, self.latency) + self.rng.uniform(-self.jitter, self.jitter))
+            if self.rng.random() < self.stall_rate:
+                delay += self.stall_latency
+        if roll < self.rate_limit_rate:
+            return "rate_limited", 0.0
+        if roll < self.rate_limit_rate + self.error_rate:
+            return "errors", delay
+        return "ok", delay
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+def _tokens(text):
+    # Roughly word-sized pieces, keeping whitespace and newlines so the
+    # streamed text reassembles exactly.
+    pieces, current = [], ""
+    for ch in text:
+        current += ch
+        if ch in " \n":
+            pieces.append(current)
+            current = ""
+    if current:
+        pieces.append(current)
+    return pieces
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        config = self.server.config
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = body.get("model", "")
+        outcome, delay = config.draw(model)
+        if outcome == "rate_limited":
+            config.count("rate_limited")
+            return self._send_json(429, {"error": {"message": "Rate limit exceeded"}},
+                                   {"Retry-After": str(config.retry_after)})
+        time.sleep(delay)
+        if outcome == "errors":
+            config.count("errors")
+            return self._send_json(500, {"error": {"message": "Upstream error"}})
+        prompt = next((m["content"] for m in reversed(body.get("messages", [])) if m.get("role") == "user"), "")
+        reply = REPLY_TEMPLATE.format(prompt=prompt[:80])
+        config.count("ok")
+        if body.get("stream"):
+            config.count("streamed")
+            return self._stream(reply, model, config.token_delay)
+        self._send_json(200, {"model": model, "choices": [{"message": {"role": "assistant", "content": reply}}]})
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, reply, model, token_delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(text):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        chunk(": OPENROUTER PROCESSING\n\n")
+        for piece in _tokens(reply):
+            event = {"model": model, "choices": [{"delta": {"content": piece}}]}
+            chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n")
+            if token_delay:
+                time.sleep(token_delay)
+        chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients drop keep-alive connections after reading "[DONE]"; that
+        # is expected and not worth a traceback.
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+class MockLLMServer:
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or MockLLMConfig()
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.config = self.config
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/api/v1/chat/completions"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-llm", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Run the mock completion backend on its own")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first byte")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model-latency", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="Per-model time to first byte, e.g. fast/model=0.05 (repeatable)")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of requests that stall")
+    parser.add_argument("--stall-latency", type=float, default=5.0, help="Extra seconds a stalled request waits")
+    args = parser.parse_args()
+    model_latency = {model: float(seconds) for model, _, seconds in (m.rpartition("=") for m in args.model_latency)}
+    config = MockLLMConfig(args.latency, args.jitter, args.token_delay, args.error_rate, args.rate_limit_rate,
+                           args.retry_after, args.seed, model_latency, args.stall_rate, args.stall_latency)
+    server = MockLLMServer(config, port=args.port).start()
+    print(f"mock completion backend on {server.url}")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import itertools
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from llm_client import (DEFAULT_MODEL, MAX_RETRIES, CancelEvent, CircuitBreaker, CircuitOpenError, get_completion,
+                        stream_completion)
+from metrics import inc, observe, register_collector
+from prompts import DETAIL_LEVELS
+from request_pipeline import MAX_CONCURRENCY
+
+# ===== MODEL ROUTER =====
+# Each detail level has an ordered list of models (LLM_MODELS_BRIEF etc.,
+# comma-separated, falling back to LLM_MODELS and then DEFAULT_MODEL). A reply
+# starts on the first healthy model; if it has not produced its first token
+# within LLM_HEDGE_MULTIPLIER times that model's rolling median, a hedged
+# backup request goes to the fastest other healthy model and whichever answers
+# first wins while the other is cancelled. The median holds while stalls are
+# under half the window, where a p95 would become the stall itself. With no
+# other model there is no hedge unless LLM_HEDGE_DUPLICATE=1, since a
+# duplicate doubles traffic to a model that may be rate-limiting us. A failed
+# attempt falls through to the next model straight away instead of retrying
+# in place; the last model left keeps the client's retries and Retry-After
+# waits.
+# Attempts run on a bounded pool (LLM_ROUTER_WORKERS, two per completion
+# worker by default) and a hedge is skipped when it is full. Cancelling an
+# attempt closes its connection, even while it is still waiting for headers.
+# Rolling latency and error stats per model drive the order and deadlines.
+ROUTES = {level: [m.strip() for m in os.environ.get(f"LLM_MODELS_{level.upper()}",
+                                                     os.environ.get("LLM_MODELS", DEFAULT_MODEL)).split(",") if m.strip()]
+          for level in DETAIL_LEVELS}
+HEDGING = os.environ.get("LLM_HEDGING", "1") == "1"
+HEDGE_MULTIPLIER = float(os.environ.get("LLM_HEDGE_MULTIPLIER", "3"))
+HEDGE_DUPLICATE = os.environ.get("LLM_HEDGE_DUPLICATE", "0") == "1"
+HEDGE_DEFAULT_DELAY = float(os.environ.get("LLM_HEDGE_DEFAULT_DELAY", "4"))
+HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.environ.get("LLM_HEDGE_MAX_DELAY", "10"))
+ROUTER_TIMEOUT = float(os.environ.get("LLM_ROUTER_TIMEOUT", "20"))
+STATS_WINDOW = int(os.environ.get("LLM_STATS_WINDOW", "100"))
+ROUTER_WORKERS = int(os.environ.get("LLM_ROUTER_WORKERS", str(2 * MAX_CONCURRENCY)))
+MIN_SAMPLES = 20
+UNHEALTHY_ERROR_RATE = 0.5
+RATE_LIMIT_MAX_WAIT = 60
+
+class ModelStats:
+    # Rolling first-token latencies of successful attempts and outcomes of
+    # finished ones; cancelled hedges count toward neither.
+    def __init__(self, window=STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.limited_until = 0.0
+        self.counts = {"requests": 0, "errors": 0, "cancelled": 0, "hedges": 0, "hedge_wins": 0}
+        self.breaker = CircuitBreaker()
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return None
+        # Nearest rank: always an observed latency, never an interpolation
+        # towards a stalled one.
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(len(ordered) * pct / 100) - 1)]
+
+    def error_rate(self):
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def healthy(self, now):
+        if now < self.limited_until or self.breaker.opened_at is not None:
+            return False
+        return len(self.outcomes) < 5 or self.error_rate() < UNHEALTHY_ERROR_RATE
+
+class ModelRouter:
+    def __init__(self, routes=None, hedging=HEDGING, workers=ROUTER_WORKERS, duplicate=HEDGE_DUPLICATE):
+        self.routes = routes or ROUTES
+        self.hedging = hedging
+        self.duplicate = duplicate
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-attempt")
+        self.attempts = 0
+
+    def _stats(self, model):
+        stats = self.stats.get(model)
+        if stats is None:
+            stats = self.stats[model] = ModelStats()
+        return stats
+
+    def candidates(self, detail_level):
+        # Configured order, healthy models first.
+        now = time.monotonic()
+        with self.lock:
+            models = self.routes.get(detail_level) or [DEFAULT_MODEL]
+            healthy = [m for m in models if self._stats(m).healthy(now)]
+        return healthy + [m for m in models if m not in healthy]
+
+    def hedge_delay(self, model):
+        with self.lock:
+            stats = self._stats(model)
+            median = stats.percentile(50) if len(stats.latencies) >= MIN_SAMPLES else None
+        deadline = median * HEDGE_MULTIPLIER if median is not None else HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, deadline))
+
+    def backup(self, untried, primary):
+        # The untried healthy model with the lowest median first-token time
+        # (one without samples yet ranks as HEDGE_DEFAULT_DELAY); with none
+        # left, the primary's model again if duplicates are on, else None.
+        now = time.monotonic()
+        with self.lock:
+            others = [m for m in untried if m != primary and self._stats(m).healthy(now)]
+            if not others:
+                return primary if self.duplicate else None
+            return min(others, key=lambda m: self._stats(m).percentile(50) or HEDGE_DEFAULT_DELAY)
+
+    def _record(self, model, latency=None, ok=True, cancelled=False, retry_after=None):
+        with self.lock:
+            stats = self._stats(model)
+            if cancelled:
+                stats.counts["cancelled"] += 1
+                return
+            stats.outcomes.append(ok)
+            if ok:
+                stats.latencies.append(latency)
+            else:
+                stats.counts["errors"] += 1
+            if retry_after:
+                stats.limited_until = time.monotonic() + min(RATE_LIMIT_MAX_WAIT, retry_after)
+        if ok:
+            observe("model_ttft_seconds", latency, model=model)
+        else:
+            inc("model_errors_total", model=model)
+
+    def _attempt(self, api_key, api_messages, model, stream, attempt, events, cancel, retries):
+        try:
+            self._run_attempt(api_key, api_messages, model, stream, attempt, events, cancel, retries)
+        finally:
+            with self.lock:
+                self.attempts -= 1
+
+    def _run_attempt(self, api_key, api_messages, model, stream, attempt, events, cancel, retries):
+        with self.lock:
+            stats = self._stats(model)
+            stats.counts["requests"] += 1
+        inc("model_requests_total", model=model)
+        started = time.monotonic()
+        options = {"model": model, "max_retries": retries, "circuit": stats.breaker, "cancel": cancel}
+        try:
+            if cancel.is_set():
+                # Cancelled while queued for a worker.
+                self._record(model, cancelled=True)
+                return
+            if stream:
+                chunks = stream_completion(api_key, api_messages, **options)
+                try:
+                    first = True
+                    for chunk in chunks:
+                        if cancel.is_set():
+                            self._record(model, cancelled=True)
+                            return
+                        if first:
+                            first = False
+                            self._record(model, time.monotonic() - started)
+                        events.put((attempt, "chunk", chunk))
+                finally:
+                    chunks.close()
+                if first:
+                    raise requests.exceptions.RequestException("Empty streamed response")
+            else:
+                data = get_completion(api_key, api_messages, **options)
+                if cancel.is_set():
+                    self._record(model, cancelled=True)
+                    return
+                self._record(model, time.monotonic() - started)
+                events.put((attempt, "chunk", data["choices"][0]["message"]["content"]))
+            events.put((attempt, "done", None))
+        except Exception as e:
+            if cancel.is_set():
+                self._record(model, cancelled=True)
+                return
+            retry_after = None
+            response = getattr(e, "response", None)
+            if response is not None and response.status_code == 429:
+                try:
+                    retry_after = float(response.headers.get("Retry-After") or 5)
+                except ValueError:
+                    retry_after = 5
+            if not isinstance(e, CircuitOpenError):
+                self._record(model, ok=False, retry_after=retry_after)
+            events.put((attempt, "error", e))
+
+    def complete(self, api_key, api_messages, detail_level, stream=True):
+        # Yields reply text as it arrives (one piece when not streaming).
+        candidates = self.candidates(detail_level)
+        untried = list(candidates)
+        events = queue.Queue()
+        running = {}
+        ids = itertools.count()
+
+        def launch(model, hedge=False):
+            with self.lock:
+                if hedge and self.attempts >= self.workers:
+                    return None
+                self.attempts += 1
+            if model in untried:
+                untried.remove(model)
+            attempt = next(ids)
+            cancel = CancelEvent()
+            running[attempt] = (model, cancel)
+            retries = 0 if untried else MAX_RETRIES
+            self.executor.submit(self._attempt, api_key, api_messages, model, stream, attempt, events, cancel, retries)
+            return attempt
+
+        def hedge_deadline(attempt):
+            return time.monotonic() + self.hedge_delay(running[attempt][0]) if self.hedging else None
+
+        started = time.monotonic()
+        primary = launch(candidates[0])
+        hedge_at = hedge_deadline(primary)
+        winner = None
+        try:
+            while True:
+                if winner is None:
+                    now = time.monotonic()
+                    remaining = ROUTER_TIMEOUT - (now - started)
+                    if remaining <= 0:
+                        inc("model_router_timeouts_total")
+                        raise requests.exceptions.Timeout(f"No model answered within {ROUTER_TIMEOUT:.0f}s")
+                    if hedge_at is not None and now >= hedge_at:
+                        hedge_at = None
+                        backup = self.backup(untried, running[primary][0])
+                        if backup is None:
+                            inc("model_hedges_skipped_total", reason="no_backup")
+                            continue
+                        if launch(backup, hedge=True) is None:
+                            inc("model_hedges_skipped_total", reason="workers_busy")
+                            continue
+                        with self.lock:
+                            self._stats(backup).counts["hedges"] += 1
+                        inc("model_hedges_total", model=backup)
+                        continue
+                    try:
+                        attempt, kind, payload = events.get(
+                            timeout=remaining if hedge_at is None else min(remaining, hedge_at - now))
+                    except queue.Empty:
+                        continue
+                else:
+                    attempt, kind, payload = events.get()
+                if attempt not in running:
+                    continue
+                model = running[attempt][0]
+                if kind == "chunk":
+                    if winner is None:
+                        winner = attempt
+                        for other, (_, cancel) in running.items():
+                            if other != attempt:
+                                cancel.set()
+                        if attempt != primary:
+                            with self.lock:
+                                self._stats(model).counts["hedge_wins"] += 1
+                            inc("model_hedge_wins_total", model=model)
+                    if attempt == winner:
+                        yield payload
+                elif kind == "done":
+                    if attempt == winner:
+                        return
+                elif kind == "error":
+                    if attempt == winner:
+                        raise payload
+                    del running[attempt]
+                    if winner is None and not running:
+                        # Nothing left in flight: fall through to the next
+                        # model in order.
+                        if not untried:
+                            raise payload
+                        primary = launch(untried[0])
+                        hedge_at = hedge_deadline(primary)
+        finally:
+            for _, cancel in running.values():
+                cancel.set()
+
+    def snapshot(self):
+        # -> {model: {p50, p95, error_rate, healthy, requests, ...}}
+        now = time.monotonic()
+        with self.lock:
+            return {model: {
+                "p50": stats.percentile(50),
+                "p95": stats.percentile(95),
+                "error_rate": stats.error_rate(),
+                "healthy": stats.healthy(now),
+                **stats.counts,
+            } for model, stats in self.stats.items()}
+
+router = ModelRouter()
+
+def router_gauges():
+    gauges = []
+    for model, stats in router.snapshot().items():
+        for name in ("p50", "p95"):
+            if stats[name] is not None:
+                gauges.append((f"model_ttft_{name}_seconds", {"model": model}, stats[name]))
+        gauges.append(("model_error_rate", {"model": model}, stats["error_rate"]))
+        gauges.append(("model_healthy", {"model": model}, int(stats["healthy"])))
+    return gauges
+
+register_collector(router_gauges)
@@ -0,0 +1,55 @@
+# Prompt construction shared by the Streamlit app and the offline tools.
+SAMPLE_QUESTIONS = [
+    "What are eco-friendly fabrics?",
+    "Suggest sustainable brands for casual wear",
+    "How to care for organic cotton clothes?"
+]
+DETAIL_LEVELS = ["brief", "standard", "detailed"]
+DEEP_SEARCH_SUFFIX = " (Include latest web-sourced trends)"
+
+# ===== SYSTEM MESSAGE =====
+def render_system_message(detail_level):
+    base_message = """
+    You are an expert sustainable fashion advisor with deep knowledge of eco-friendly trends, materials, and practices. Provide clear, engaging advice on sustainable fashion. Focus on:
+    - Eco-friendly clothing (e.g., organic cotton, Tencel, recycled fibers)
+    - Sustainable shopping (e.g., ethical brands, Fair Trade, second-hand platforms)
+    - Clothing care to extend garment life (e.g., low-impact washing, repairs)
+    - Brand recommendations or trends (e.g., carbon footprint, water usage)
+    
+    Format:
+    - Use concise, friendly language
+    - Include a markdown table with columns: [Category, Recommendation, Impact]
+    - Exclude rows with empty or whitespace-only columns
+    - Use emojis (🌿, 🛍️, 🧼, 📚) for sections
+    - No images
+    """
+    detail_instructions = {
+        "brief": "Keep responses short (2-3 sentences per section) with minimal detail. Include a table with 1-2 rows.",
+        "standard": "Provide balanced responses (3-5 sentences per section) with key details. Include a table with 2-3 rows.",
+        "detailed": "Give comprehensive responses (5-7 sentences per section) with data and sources. Include a table with 3-4 rows."
+    }
+    return {
+        "role": "system",
+        "content": f"{base_message}\n{detail_instructions[detail_level]}\n\nIf asked about developers, say: 'I was created by Aadi Jain, registration number 12304968.'"
+    }
+
+# Built once per detail level at import; callers get their own copy.
+SYSTEM_MESSAGES = {level: render_system_message(level) for level in DETAIL_LEVELS}
+
+def get_system_message(detail_level):
+    return dict(SYSTEM_MESSAGES[detail_level])
+
+def build_api_messages(messages, detail_level, deep_search=False):
+    api_messages = [
+        {"role": msg.role, "content": msg.content}
+        for msg in messages
+    ]
+    
+    # Insert system message
+    if len(api_messages) == 1 or api_messages[0]["role"] != "system":
+        api_messages.insert(0, get_system_message(detail_level))
+    
+    # DeepSearch Mode
+    if deep_search:
+        api_messages[-1]["content"] += DEEP_SEARCH_SUFFIX
+    return api_messages
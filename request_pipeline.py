@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import register_collector
+
+# ===== COMPLETION WORKER POOL =====
+# Completion calls run on one process-wide pool instead of on Streamlit script
+# threads; sessions keep a ReplyJob handle and poll it between reruns.
+MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+PER_USER_LIMIT = int(os.environ.get("LLM_PER_USER_LIMIT", "1"))
+
+class UserLimitError(Exception):
+    pass
+
+class ReplyJob:
+    def __init__(self, key, user):
+        self.key = key
+        self.user = user
+        self.chunks = []
+        self.future = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+
+    def text(self):
+        return "".join(self.chunks)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+class RequestPipeline:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, per_user_limit=PER_USER_LIMIT):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="completion")
+        self.max_concurrency = max_concurrency
+        self.per_user_limit = per_user_limit
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.user_in_flight = {}
+        self.queued = 0
+        self.active = 0
+        self.counters = {"submitted": 0, "coalesced": 0, "rejected": 0, "failed": 0}
+
+    def submit(self, user, key, fn, *args):
+        # Identical prompts already in flight share one job (and one backend
+        # call); otherwise the user's own in-flight limit applies.
+        with self.lock:
+            job = self.in_flight.get(key)
+            if job is not None:
+                self.counters["coalesced"] += 1
+                return job
+            if self.user_in_flight.get(user, 0) >= self.per_user_limit:
+                self.counters["rejected"] += 1
+                raise UserLimitError("You already have a request in progress. Please wait for it to finish.")
+            job = ReplyJob(key, user)
+            self.in_flight[key] = job
+            self.user_in_flight[user] = self.user_in_flight.get(user, 0) + 1
+            self.queued += 1
+            self.counters["submitted"] += 1
+            job.future = self.executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+        job.started_at = time.monotonic()
+        try:
+            return fn(job, *args)
+        except Exception:
+            with self.lock:
+                self.counters["failed"] += 1
+            raise
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.in_flight.pop(job.key, None)
+                self.user_in_flight[job.user] -= 1
+                if not self.user_in_flight[job.user]:
+                    del self.user_in_flight[job.user]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.queued,
+                "active": self.active,
+                "max_concurrency": self.max_concurrency,
+                **self.counters
+            }
+
+pipeline = RequestPipeline()
+
+def pipeline_gauges():
+    stats = pipeline.stats()
+    return [("completion_queue_depth", {}, stats["queue_depth"]),
+            ("completion_active", {}, stats["active"])] + \
+           [("completion_jobs", {"outcome": name}, stats[name]) for name in ("submitted", "coalesced", "rejected", "failed")]
+
+register_collector(pipeline_gauges)
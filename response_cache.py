@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from metrics import inc
+
+# ===== PERSISTENT RESPONSE CACHE =====
+# Replies are keyed on a normalized prompt fingerprint rather than the raw
+# message list, so greetings that embed the username (and anything else said
+# before the first user turn) don't split the cache per user. Entries live in
+# SQLite, survive restarts and are shared by every server process.
+CACHE_DB = os.environ.get("RESPONSE_CACHE_DB", "response_cache.db")
+CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+CACHE_USER_TURNS = int(os.environ.get("RESPONSE_CACHE_USER_TURNS", "3"))
+
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_stats_lock = threading.Lock()
+_initialized = set()
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+    inc(f"response_cache_{name}_total", n)
+
+def _connect(path=None):
+    path = path or CACHE_DB
+    conn = sqlite3.connect(path, timeout=10)
+    if path not in _initialized:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                reply TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                parsed TEXT
+            )
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(response_cache)")]
+        if "parsed" not in columns:
+            conn.execute("ALTER TABLE response_cache ADD COLUMN parsed TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache (last_used)")
+        conn.commit()
+        _initialized.add(path)
+    return conn
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def key_window(api_messages, user_turns=CACHE_USER_TURNS):
+    # The turns from the N-th most recent user turn on; anything before the
+    # first user turn is a greeting and never part of the key.
+    turns = [m for m in api_messages if m["role"] != "system"]
+    user_positions = [i for i, m in enumerate(turns) if m["role"] == "user"]
+    return turns[user_positions[-min(user_turns, len(user_positions))]:] if user_positions else []
+
+def fingerprint(api_messages, detail_level, deep_search=False, user_turns=CACHE_USER_TURNS):
+    system = next((m["content"] for m in api_messages if m["role"] == "system"), "")
+    window = key_window(api_messages, user_turns)
+    key_material = json.dumps({
+        "system": normalize_text(system),
+        "detail_level": detail_level,
+        "deep_search": bool(deep_search),
+        "turns": [[m["role"], normalize_text(m["content"])] for m in window]
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+# Entries hold the raw reply plus, optionally, its already-parsed form
+# ({"rows": [...], "prose": "..."}) so cache hits skip table extraction too.
+# count=False leaves the hit/miss counters alone, for lookups made on behalf
+# of another layer (similar-prompt reuse keeps its own).
+def get_cached_response(key, path=None, count=True):
+    now = time.time()
+    with _connect(path) as conn:
+        row = conn.execute("SELECT reply, parsed, created_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            if count:
+                _count("misses")
+            return None
+        if now - row[2] > CACHE_TTL:
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            if count:
+                _count("misses")
+            _count("evictions")
+            return None
+        conn.execute("UPDATE response_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+    if count:
+        _count("hits")
+    return row[0], json.loads(row[1]) if row[1] else None
+
+def get_cache_age(key, path=None):
+    with _connect(path) as conn:
+        row = conn.execute("SELECT created_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+    return None if row is None else time.time() - row[0]
+
+def put_cached_response(key, reply, parsed=None, path=None):
+    if not reply:
+        return
+    now = time.time()
+    parsed_json = json.dumps(parsed, ensure_ascii=False) if parsed is not None else None
+    with _connect(path) as conn:
+        conn.execute("""
+            INSERT INTO response_cache (key, reply, parsed, created_at, last_used) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET reply = excluded.reply, parsed = excluded.parsed,
+                created_at = excluded.created_at, last_used = excluded.last_used
+        """, (key, reply, parsed_json, now, now))
+        # Size-bounded LRU: drop the least recently used entries over the cap.
+        overflow = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0] - CACHE_MAX_ENTRIES
+        if overflow > 0:
+            conn.execute("""
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY last_used LIMIT ?
+                )
+            """, (overflow,))
+            _count("evictions", overflow)
+
+def purge_expired(path=None):
+    with _connect(path) as conn:
+        removed = conn.execute("DELETE FROM response_cache WHERE created_at < ?", (time.time() - CACHE_TTL,)).rowcount
+    _count("evictions", removed)
+    return removed
+
+def cache_stats(path=None):
+    with _connect(path) as conn:
+        entries = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["entries"] = entries
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
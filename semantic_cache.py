@@ -0,0 +1,243 @@
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from metrics import inc, register_collector
+from response_cache import CACHE_DB, CACHE_MAX_ENTRIES, get_cached_response, key_window, normalize_text
+
+# ===== SIMILAR-PROMPT REUSE =====
+# Paraphrases ("eco fabrics?" / "What are eco-friendly fabrics?") miss the
+# exact fingerprint. Each answered prompt is embedded as a hashed bag of
+# words and character n-grams (CPU only, no model download) and kept in a
+# nearest-neighbour index per detail level and DeepSearch setting. A new
+# prompt reuses an answer when its cosine similarity reaches
+# SEMANTIC_THRESHOLD and every content word it has also appears in the
+# answered prompt, so "formal wear" never gets the "casual wear" answer.
+# The prompts themselves are stored next to the response cache so every
+# server process sees the same index.
+SEMANTIC_ENABLED = os.environ.get("SEMANTIC_CACHE", "1") == "1"
+SEMANTIC_THRESHOLD = float(os.environ.get("SEMANTIC_THRESHOLD", "0.6"))
+SEMANTIC_DIMS = int(os.environ.get("SEMANTIC_DIMS", "1024"))
+
+SEMANTIC_CANDIDATES = 5
+
+STOPWORDS = frozenset("""
+    a about actually advice an and any are as at be can could do does for from get give how i idea ideas im is
+    it me my of on or please really recommend should some suggest suggestion suggestions tell that the tip tips
+    to way ways what whats which with would you your
+""".split())
+_WORDS = re.compile(r"[a-z0-9]+")
+
+def prompt_text(api_messages):
+    # The user turns of the same window the exact fingerprint covers.
+    return "\n".join(m["content"] for m in key_window(api_messages) if m["role"] == "user")
+
+def content_words(text):
+    words = [w for w in _WORDS.findall(normalize_text(text).replace("'", "")) if len(w) > 1 and w not in STOPWORDS]
+    # Crude plural folding so "fabric" and "fabrics" share their word feature.
+    return [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w for w in words]
+
+def _same_word(a, b):
+    # Equal, or the same stem by a shared prefix ("wash"/"washing",
+    # "clothes"/"clothing") without letting "cotton" match "cottage".
+    n = min(5, len(a), len(b))
+    return a[:n] == b[:n]
+
+def covers(answered_words, words):
+    return all(any(_same_word(w, a) for a in answered_words) for w in words)
+
+def _features(words):
+    features = [f"w:{w}" for w in words]
+    features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    for w in words:
+        padded = f" {w} "
+        features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return features
+
+def embed(words, dims=SEMANTIC_DIMS):
+    # Signed feature hashing into `dims` buckets, L2-normalized. crc32 rather
+    # than hash() so vectors agree across processes.
+    import numpy as np
+    vector = np.zeros(dims, dtype=np.float32)
+    for feature in _features(words):
+        h = zlib.crc32(feature.encode("utf-8"))
+        weight = 2.0 if feature[0] == "w" else 1.0
+        vector[h % dims] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def bucket_name(detail_level, deep_search):
+    return f"{detail_level}{'+deep' if deep_search else ''}"
+
+class VectorIndex:
+    # Unit vectors in a preallocated float32 matrix (doubling on growth);
+    # a lookup is one matrix-vector product over the bucket.
+    def __init__(self, dims=SEMANTIC_DIMS):
+        import numpy as np
+        self.dims = dims
+        self.matrix = np.zeros((64, dims), dtype=np.float32)
+        self.keys = []
+        self.words = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, words, vector):
+        import numpy as np
+        if len(self.keys) == len(self.matrix):
+            grown = np.zeros((2 * len(self.matrix), self.dims), dtype=np.float32)
+            grown[:len(self.keys)] = self.matrix
+            self.matrix = grown
+        self.matrix[len(self.keys)] = vector
+        self.keys.append(key)
+        self.words.append(words)
+
+    def remove(self, key):
+        if key in self.keys:
+            i = self.keys.index(key)
+            last = len(self.keys) - 1
+            self.matrix[i] = self.matrix[last]
+            self.keys[i] = self.keys[last]
+            self.words[i] = self.words[last]
+            self.keys.pop()
+            self.words.pop()
+
+    def nearest(self, vector, k=SEMANTIC_CANDIDATES):
+        # -> [(key, words, similarity)] for the k most similar, best first.
+        import numpy as np
+        if not self.keys:
+            return []
+        scores = self.matrix[:len(self.keys)] @ vector
+        if len(scores) > k:
+            top = np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(scores[top])[::-1]]
+        else:
+            top = np.argsort(scores)[::-1]
+        return [(self.keys[i], self.words[i], float(scores[i])) for i in top]
+
+class SemanticCache:
+    def __init__(self, path=None, threshold=SEMANTIC_THRESHOLD, dims=SEMANTIC_DIMS, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path or CACHE_DB
+        self.threshold = threshold
+        self.dims = dims
+        self.max_entries = max_entries
+        self.indexes = {}
+        self.last_rowid = 0
+        self.lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "stale": 0}
+        self.initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self.initialized:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS semantic_prompts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL UNIQUE,
+                    bucket TEXT NOT NULL,
+                    text TEXT NOT NULL
+                )
+            """)
+            conn.commit()
+            self.initialized = True
+        return conn
+
+    def _refresh(self, conn):
+        # Pick up prompts other processes added since the last look; ids
+        # only grow, so this is one indexed range scan.
+        rows = conn.execute("SELECT id, key, bucket, text FROM semantic_prompts WHERE id > ? ORDER BY id",
+                            (self.last_rowid,)).fetchall()
+        for rowid, key, bucket, text in rows:
+            index = self.indexes.get(bucket)
+            if index is None:
+                index = self.indexes[bucket] = VectorIndex(self.dims)
+            words = content_words(text)
+            index.remove(key)
+            index.add(key, words, embed(words, self.dims))
+            self.last_rowid = rowid
+
+    def remember(self, key, api_messages, detail_level, deep_search=False):
+        text = prompt_text(api_messages)
+        if not text.strip():
+            return
+        with self.lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO semantic_prompts (key, bucket, text) VALUES (?, ?, ?)",
+                         (key, bucket_name(detail_level, deep_search), text))
+            # Bounded like the response cache: past the cap the oldest tenth
+            # is dropped and the in-memory indexes are rebuilt from the rest.
+            if conn.execute("SELECT COUNT(*) FROM semantic_prompts").fetchone()[0] > self.max_entries:
+                conn.execute("DELETE FROM semantic_prompts WHERE id IN "
+                             "(SELECT id FROM semantic_prompts ORDER BY id LIMIT ?)", (self.max_entries // 10 + 1,))
+                self.indexes = {}
+                self.last_rowid = 0
+            self._refresh(conn)
+
+    def lookup(self, api_messages, detail_level, deep_search=False):
+        # -> (cache key, similarity) of the closest answered prompt that
+        # clears the threshold and covers the prompt's words, else None.
+        words = content_words(prompt_text(api_messages))
+        if not words:
+            return None
+        vector = embed(words, self.dims)
+        with self.lock:
+            with self._connect() as conn:
+                self._refresh(conn)
+            index = self.indexes.get(bucket_name(detail_level, deep_search))
+            candidates = index.nearest(vector) if index is not None else []
+            self.stats["lookups"] += 1
+        inc("semantic_cache_lookups_total")
+        for key, answered_words, similarity in candidates:
+            if similarity < self.threshold:
+                break
+            if covers(answered_words, words):
+                return key, similarity
+        return None
+
+    def record_hit(self):
+        with self.lock:
+            self.stats["hits"] += 1
+        inc("semantic_cache_hits_total")
+
+    def forget(self, key):
+        # The matched answer has expired or been evicted from the response cache.
+        with self.lock, self._connect() as conn:
+            conn.execute("DELETE FROM semantic_prompts WHERE key = ?", (key,))
+            for index in self.indexes.values():
+                index.remove(key)
+            self.stats["stale"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = sum(len(index) for index in self.indexes.values())
+        stats["threshold"] = self.threshold
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        return stats
+
+semantic_cache = SemanticCache()
+
+def get_similar_response(api_messages, detail_level, deep_search=False, get_response=None):
+    # Fallback after an exact-cache miss: -> (cached entry, similarity) or None.
+    # get_response(key, count) reads the response cache (the storage backend's
+    # when it is shared); defaults to the local one.
+    if not SEMANTIC_ENABLED:
+        return None
+    match = semantic_cache.lookup(api_messages, detail_level, deep_search)
+    if match is None:
+        return None
+    key, similarity = match
+    cached = (get_response or get_cached_response)(key, count=False)
+    if cached is None:
+        semantic_cache.forget(key)
+        return None
+    semantic_cache.record_hit()
+    return cached, similarity
+
+def semantic_gauges():
+    stats = semantic_cache.snapshot()
+    return [("semantic_cache_threshold", {}, stats["threshold"]),
+            ("semantic_cache_entries", {}, stats["entries"]),
+            ("semantic_cache_hit_rate", {}, stats["hit_rate"])]
+
+register_collector(semantic_gauges)
@@ -0,0 +1,378 @@
+import hmac
+import ipaddress
+import json
+import os
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import db
+import response_cache
+from chat_codec import decode_messages, encode_messages
+from metrics import span
+
+# ===== STORAGE BACKENDS =====
+# Accounts, chat history, the response cache and login sessions sit behind
+# one interface, so any number of app replicas can share them:
+#   STORAGE_BACKEND=sqlite  this process's users.db and response_cache.db
+#   STORAGE_BACKEND=http    a storage service every replica talks to, e.g.
+#                           STORAGE_TOKEN=<secret> python storage.py --host 0.0.0.0 --port 8600
+#                           with STORAGE_URL=http://<host>:8600 and the same
+#                           STORAGE_TOKEN on the replicas
+# The similar-prompt index stays per replica; it only points at entries in
+# the shared response cache.
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite")
+STORAGE_URL = os.environ.get("STORAGE_URL", "http://127.0.0.1:8600")
+STORAGE_TOKEN = os.environ.get("STORAGE_TOKEN", "")
+STORAGE_TIMEOUT = float(os.environ.get("STORAGE_TIMEOUT", "10"))
+STORAGE_POOL_SIZE = int(os.environ.get("STORAGE_POOL_SIZE", "16"))
+STATS_TTL = 5.0
+
+class StorageError(requests.exceptions.RequestException):
+    pass
+
+class StorageBackend(ABC):
+    # Same names and return shapes as the db / response_cache functions.
+    def init(self):
+        pass
+
+    def save_chat_history(self, conversation_id, messages, saved_count=0):
+        return self.append_messages(conversation_id, messages[saved_count:], saved_count)
+
+    @abstractmethod
+    def create_user(self, username, password_hash):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_password_hash(self, username):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_password_hash(self, username, password_hash):
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_conversation(self, username):
+        raise NotImplementedError
+
+    @abstractmethod
+    def append_messages(self, conversation_id, new_messages, saved_count):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_chat_history(self, username, page=0, page_size=db.HISTORY_PAGE_SIZE):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_conversation(self, conversation_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_recommendations(self, username, category_group, limit=200):
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_messages(self, username, text, limit=db.SEARCH_LIMIT):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_cached_response(self, key, count=True):
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_cached_response(self, key, reply, parsed=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_cache_age(self, key):
+        raise NotImplementedError
+
+    @abstractmethod
+    def cache_stats(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_session(self, session_id, username, state, ttl):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_session(self, session_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_session(self, session_id):
+        raise NotImplementedError
+
+class SQLiteBackend(StorageBackend):
+    # Local files; fine for one replica, and what the storage service uses.
+    def init(self):
+        db.init_db()
+        # Expired answers are otherwise only dropped when they are looked up.
+        response_cache.purge_expired()
+
+    def create_user(self, username, password_hash):
+        return db.create_user(username, password_hash)
+
+    def get_password_hash(self, username):
+        return db.get_password_hash(username)
+
+    def update_password_hash(self, username, password_hash):
+        db.update_password_hash(username, password_hash)
+
+    def create_conversation(self, username):
+        return db.create_conversation(username)
+
+    def append_messages(self, conversation_id, new_messages, saved_count):
+        return db.append_messages(conversation_id, new_messages, saved_count)
+
+    def load_chat_history(self, username, page=0, page_size=db.HISTORY_PAGE_SIZE):
+        return db.load_chat_history(username, page, page_size)
+
+    def load_conversation(self, conversation_id):
+        return db.load_conversation(conversation_id)
+
+    def load_recommendations(self, username, category_group, limit=200):
+        return db.load_recommendations(username, category_group, limit)
+
+    def search_messages(self, username, text, limit=db.SEARCH_LIMIT):
+        return db.search_messages(username, text, limit)
+
+    def get_cached_response(self, key, count=True):
+        return response_cache.get_cached_response(key, count=count)
+
+    def put_cached_response(self, key, reply, parsed=None):
+        response_cache.put_cached_response(key, reply, parsed)
+
+    def get_cache_age(self, key):
+        return response_cache.get_cache_age(key)
+
+    def cache_stats(self):
+        return response_cache.cache_stats()
+
+    def put_session(self, session_id, username, state, ttl):
+        db.put_session(session_id, username, state, ttl)
+
+    def get_session(self, session_id):
+        return db.get_session(session_id)
+
+    def delete_session(self, session_id):
+        db.delete_session(session_id)
+
+def _text(value):
+    # bcrypt hashes are ASCII bytes; JSON carries them as text.
+    return value.decode("ascii") if isinstance(value, bytes) else value
+
+class HTTPBackend(StorageBackend):
+    # Client for StorageServer: one JSON POST per call over a keep-alive
+    # pool. Only failed connects are retried, since those never reached the
+    # server; anything else surfaces as StorageError.
+    def __init__(self, url=STORAGE_URL, token=STORAGE_TOKEN, timeout=STORAGE_TIMEOUT, pool_size=STORAGE_POOL_SIZE):
+        self.url = url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self.timeout = timeout
+        self.session = requests.Session()
+        retries = Retry(total=2, connect=2, read=0, status=0, other=0, backoff_factor=0.1, allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = (0.0, None)
+
+    def _call(self, method, *args):
+        with span("storage_call"):
+            try:
+                response = self.session.post(f"{self.url}/rpc/{method}", json=list(args),
+                                             headers=self.headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                raise StorageError(f"Storage service unreachable: {e}") from e
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("error")
+            except ValueError:
+                detail = response.text[:200]
+            raise StorageError(f"Storage call {method} failed ({response.status_code}): {detail}")
+        return response.json()["result"]
+
+    def create_user(self, username, password_hash):
+        return self._call("create_user", username, _text(password_hash))
+
+    def get_password_hash(self, username):
+        return self._call("get_password_hash", username)
+
+    def update_password_hash(self, username, password_hash):
+        self._call("update_password_hash", username, _text(password_hash))
+
+    def create_conversation(self, username):
+        return self._call("create_conversation", username)
+
+    def append_messages(self, conversation_id, new_messages, saved_count):
+        if not new_messages:
+            return saved_count
+        return self._call("append_messages", conversation_id, encode_messages(new_messages), saved_count)
+
+    def load_chat_history(self, username, page=0, page_size=db.HISTORY_PAGE_SIZE):
+        return [tuple(row) for row in self._call("load_chat_history", username, page, page_size)]
+
+    def load_conversation(self, conversation_id):
+        return decode_messages(self._call("load_conversation", conversation_id))
+
+    def load_recommendations(self, username, category_group, limit=200):
+        return [tuple(row) for row in self._call("load_recommendations", username, category_group, limit)]
+
+    def search_messages(self, username, text, limit=db.SEARCH_LIMIT):
+        return [tuple(row) for row in self._call("search_messages", username, text, limit)]
+
+    def get_cached_response(self, key, count=True):
+        cached = self._call("get_cached_response", key, count)
+        return tuple(cached) if cached is not None else None
+
+    def put_cached_response(self, key, reply, parsed=None):
+        self._call("put_cached_response", key, reply, parsed)
+
+    def get_cache_age(self, key):
+        return self._call("get_cache_age", key)
+
+    def cache_stats(self):
+        # Shown on every rerun, so held briefly instead of a call per rerun.
+        expires, stats = self.stats
+        if stats is None or time.monotonic() > expires:
+            stats = self._call("cache_stats")
+            self.stats = (time.monotonic() + STATS_TTL, stats)
+        return stats
+
+    def put_session(self, session_id, username, state, ttl):
+        self._call("put_session", session_id, username, state, ttl)
+
+    def get_session(self, session_id):
+        record = self._call("get_session", session_id)
+        return tuple(record) if record is not None else None
+
+    def delete_session(self, session_id):
+        self._call("delete_session", session_id)
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = HTTPBackend() if STORAGE_BACKEND == "http" else SQLiteBackend()
+    return _storage
+
+# ===== STORAGE SERVICE =====
+# Serves a backend (SQLite by default) to HTTPBackend clients: POST
+# /rpc/<method> with the positional arguments as a JSON array. Also the
+# local stand-in for tests and load tests.
+RPC_METHODS = frozenset((
+    "create_user", "get_password_hash", "update_password_hash", "create_conversation", "append_messages",
+    "load_chat_history", "load_conversation", "load_recommendations", "search_messages",
+    "get_cached_response", "put_cached_response", "get_cache_age", "cache_stats", "put_session", "get_session", "delete_session",
+))
+
+def _dispatch(backend, method, args):
+    if method == "append_messages":
+        conversation_id, blob, saved_count = args
+        return backend.append_messages(conversation_id, decode_messages(blob), saved_count)
+    if method == "load_conversation":
+        return encode_messages(backend.load_conversation(*args))
+    return _text(getattr(backend, method)(*args))
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, each reply
+    # on a keep-alive connection waits out the client's delayed ACK (~40 ms).
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if server.token and not hmac.compare_digest(self.headers.get("Authorization", "").encode("utf-8"),
+                                                    f"Bearer {server.token}".encode("utf-8")):
+            return self._send_json(401, {"error": "Unauthorized"})
+        prefix, _, method = self.path.rpartition("/")
+        if prefix != "/rpc" or method not in RPC_METHODS:
+            return self._send_json(404, {"error": f"Unknown method {method}"})
+        try:
+            result = _dispatch(server.backend, method, json.loads(body or b"[]"))
+        except Exception as e:
+            return self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+        self._send_json(200, {"result": result})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class StorageServer:
+    def __init__(self, backend=None, host="127.0.0.1", port=0, token=STORAGE_TOKEN):
+        # The service hands out password hashes, chats and sessions, so it is
+        # only served without a token on a loopback address.
+        if not token and not _is_loopback(host):
+            raise ValueError(f"Refusing to serve storage on {host or 'all interfaces'} without a token; "
+                             "set STORAGE_TOKEN or --token")
+        self.backend = backend or SQLiteBackend()
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.backend = self.backend
+        self.httpd.token = token
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.backend.init()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="storage-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve users.db and the response cache to app replicas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--token", default=STORAGE_TOKEN, help="Bearer token clients must send (STORAGE_TOKEN)")
+    args = parser.parse_args()
+    try:
+        server = StorageServer(host=args.host, port=args.port, token=args.token).start()
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"storage service on {server.url} (users.db: {db.DB_PATH}, cache: {response_cache.CACHE_DB})")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
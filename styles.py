@@ -0,0 +1,110 @@
+# Page CSS for the Streamlit app. Every theme/button-size combination is
+# rendered once at import, so reruns only look the string up.
+THEMES = ("light", "dark")
+BUTTON_SIZES = ("small", "medium", "large")
+
+# ===== CSS STYLING =====
+def get_page_css(theme="light", button_size="medium"):
+    button_sizes = {
+        "small": {"padding": "8px", "font-size": "14px"},
+        "medium": {"padding": "12px", "font-size": "16px"},
+        "large": {"padding": "16px", "font-size": "18px"}
+    }
+    size = button_sizes.get(button_size, button_sizes["medium"])
+    base_css = f"""
+    .stApp {{
+        background-image: url("https://images.unsplash.com/photo-1597150899069-efb9c8c6010c?q=80&w=3438&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D");
+        background-size: cover;
+        background-position: center;
+        background-repeat: no-repeat;
+        background-attachment: fixed;
+        color: #ffffff;
+        transition: all 0.3s ease;
+    }}
+    .stTextInput, .stButton>button, .stSelectbox, .stCheckbox, .stCaption, .stTable {{
+        background-color: rgba(255, 255, 255, 0.9);
+        padding: 12px;
+        border-radius: 8px;
+        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    }}
+    .stSidebar {{
+        background-color: rgba(255, 255, 255, 0.95);
+        border-right: 1px solid #ddd;
+    }}
+    .stSidebar .stButton>button {{
+        background-color: #4CAF50;
+        color: white;
+        border: none;
+        border-radius: 8px;
+        padding: {size['padding']};
+        margin: 5px 0;
+        width: 100%;
+        font-weight: bold;
+        font-size: {size['font-size']};
+        box-shadow: 0 2px 4px rgba(0,0,0,0.2);
+        transition: background-color 0.3s ease, transform 0.2s ease;
+    }}
+    .stSidebar .stButton>button:hover {{
+        background-color: #45a049;
+        transform: translateY(-2px);
+    }}
+    .stChatMessage {{
+        background-color: rgba(255, 255, 255, 0.85);
+        padding: 15px;
+        border-radius: 10px;
+        margin-bottom: 10px;
+    }}
+    .stButton>button {{
+        background-color: #4CAF50;
+        color: white;
+        border: none;
+        border-radius: 8px;
+        padding: {size['padding']};
+        width: 100%;
+        font-weight: bold;
+        font-size: {size['font-size']};
+    }}
+    .stButton>button:hover {{
+        background-color: #45a049;
+    }}
+    .st-emotion-cache-169dgwr, .st-emotion-cache-128upt6 {{
+        background-color: transparent !important;
+    }}
+    .timestamp {{
+        font-size: 0.8em;
+        color: #666;
+        margin-top: 5px;
+    }}
+    .sample-question {{
+        cursor: pointer;
+        color: #4CAF50;
+        text-decoration: underline;
+        margin-right: 10px;
+    }}
+    """
+    dark_theme = """
+    .stApp {
+        background-image: none;
+        background-color: #1e1e1e;
+        color: #e0e0e0;
+    }
+    .stTextInput, .stButton>button, .stSelectbox, .stCheckbox, .stCaption, .stTable {
+        background-color: rgba(40, 40, 40, 0.9);
+        color: #e0e0e0;
+    }
+    .stSidebar {
+        background-color: rgba(30, 30, 30, 0.95);
+        border-right: 1px solid #444;
+    }
+    .stChatMessage {
+        background-color: rgba(40, 40, 40, 0.85);
+        color: #e0e0e0;
+    }
+    """
+    return base_css if theme == "light" else base_css + dark_theme
+
+PAGE_CSS = {(theme, size): get_page_css(theme, size) for theme in THEMES for size in BUTTON_SIZES}
+
+def page_css(theme="light", button_size="medium"):
+    css = PAGE_CSS.get((theme, button_size))
+    return css if css is not None else get_page_css(theme, button_size)
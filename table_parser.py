@@ -0,0 +1,166 @@
+import re
+from chat_records import Table
+
+# ===== TABLE EXTRACTION =====
+# One compiled pass over the reply: a GFM table is a pipe row followed by a
+# delimiter row (| --- | :---: |) and runs until the first line without a
+# pipe. Columns are mapped to Category/Recommendation/Impact by
+# header name, so column order and extra columns don't matter; everything
+# that is not part of an extracted table is kept as prose.
+COLUMNS = ("Category", "Recommendation", "Impact")
+HEADER_ALIASES = {
+    "Category": ("category", "categories", "type", "area", "section", "topic", "aspect"),
+    "Recommendation": ("recommendation", "recommendations", "tip", "tips", "suggestion", "suggestions",
+                       "advice", "action", "actions", "what to do", "option", "options", "practice"),
+    "Impact": ("impact", "impacts", "benefit", "benefits", "effect", "why", "why it matters",
+               "environmental impact", "sustainability impact", "result"),
+}
+_ALIAS_LOOKUP = {alias: column for column, aliases in HEADER_ALIASES.items() for alias in aliases}
+
+# One match per table block: header row, delimiter row, then every following
+# non-blank line that contains a pipe.
+_TABLE_BLOCK = re.compile(
+    r"^([^\n]*\|[^\n]*)\n"
+    r"([ \t]*\|?[ \t]*:?-+:?[ \t]*(?:\|[ \t]*:?-+:?[ \t]*)*\|?[ \t]*\r?)$"
+    r"((?:\n[^\n]*\|[^\n]*)*)",
+    re.MULTILINE
+)
+_FENCE = re.compile(r"^[ \t]*(?:```|~~~)", re.MULTILINE)
+_CELL_SPLIT = re.compile(r"(?<!\\)\|")
+_HEADER_NOISE = re.compile(r"[^a-z ]+")
+_BLANK_RUN = re.compile(r"\n(?:[ \t]*\r?\n){2,}")
+
+# Models reuse a handful of header rows, so their column mappings are memoized.
+_header_cache = {}
+
+def _cells(line):
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    if "\\" not in line:
+        return [cell.strip() for cell in line.split("|")]
+    return [cell.strip().replace("\\|", "|") for cell in _CELL_SPLIT.split(line)]
+
+def _map_header(cells):
+    key = tuple(cells)
+    if key not in _header_cache:
+        if len(_header_cache) > 256:
+            _header_cache.clear()
+        _header_cache[key] = _match_header(cells)
+    return _header_cache[key]
+
+def _match_header(cells):
+    mapping = {}
+    for i, cell in enumerate(cells):
+        name = " ".join(_HEADER_NOISE.sub(" ", cell.lower()).split())
+        column = _ALIAS_LOOKUP.get(name)
+        if column and column not in mapping:
+            mapping[column] = i
+    if "Recommendation" in mapping:
+        return mapping
+    # Unrecognized headers: fall back to position for the classic
+    # three-column layout and leave any other table in the prose.
+    if len(cells) == 3:
+        return dict(zip(COLUMNS, range(3)))
+    return None
+
+def _fenced_spans(reply):
+    starts = [m.start() for m in _FENCE.finditer(reply)]
+    if len(starts) % 2:
+        starts.append(len(reply))
+    return list(zip(starts[::2], starts[1::2]))
+
+# ===== CATEGORY NORMALIZATION =====
+# Model-written categories ("Eco Fabrics 🌿", "Laundry", "Where to buy") are
+# mapped once, at parse time, onto the fixed filter groups.
+CATEGORY_GROUPS = ("Clothing", "Shopping", "Care", "Resources", "Other")
+_GROUP_HINTS = (
+    ("Clothing", "🌿👕👗", ("clothing", "clothes", "fabric", "fabrics", "material", "materials", "fiber", "fibers",
+                          "fibre", "fibres", "outfit", "outfits", "wardrobe", "garment", "garments", "apparel",
+                          "textile", "textiles", "style", "wear")),
+    ("Shopping", "🛍🛒", ("shopping", "shop", "brand", "brands", "buy", "buying", "purchase", "purchases", "store",
+                         "stores", "retail", "thrift", "thrifting", "secondhand", "resale", "rental", "rent")),
+    ("Care", "🧼🧺", ("care", "wash", "washing", "laundry", "repair", "repairs", "mend", "mending", "drying",
+                     "maintenance", "storage", "upcycle", "upcycling")),
+    ("Resources", "📚🔗", ("resource", "resources", "app", "apps", "website", "websites", "book", "books", "guide",
+                          "guides", "certification", "certifications", "learn", "learning", "reading", "tool",
+                          "tools", "organization", "organizations", "community")),
+)
+_WORD = re.compile(r"[a-z]+")
+_group_cache = {}
+
+def normalize_category(category):
+    category = category or ""
+    group = _group_cache.get(category)
+    if group is None:
+        group = _match_group(category)
+        if len(_group_cache) > 1024:
+            _group_cache.clear()
+        _group_cache[category] = group
+    return group
+
+def _match_group(category):
+    lowered = category.lower()
+    # The old substring filter's matches win, then emoji, then keywords.
+    for group, _, _ in _GROUP_HINTS:
+        if group.lower() in lowered:
+            return group
+    for group, emoji, _ in _GROUP_HINTS:
+        if any(e in category for e in emoji):
+            return group
+    words = set(_WORD.findall(lowered.replace("-", "")))
+    for group, _, keywords in _GROUP_HINTS:
+        if words.intersection(keywords):
+            return group
+    return "Other"
+
+def category_groups(table):
+    # Group per row of a chat_records.Table; tables stored before
+    # normalization have no Group column and are normalized on load.
+    if "Group" in table.columns:
+        return [group if group in CATEGORY_GROUPS else "Other" for group in table.column("Group")]
+    if "Category" not in table.columns:
+        return ["Other"] * len(table)
+    return [normalize_category(str(category)) for category in table.column("Category")]
+
+def recommendation_table(rows):
+    # Parsed rows (fresh or from the response cache) as a compact Table with
+    # its Group column filled in.
+    table = Table.from_records(rows)
+    if "Group" not in table.columns:
+        table = Table(table.columns + ("Group",), [row + (group,) for row, group in zip(table.rows, category_groups(table))])
+    return table
+
+def extract_table(reply):
+    # Returns the recommendation rows found in every table of a reply and the
+    # reply with those tables removed.
+    rows = []
+    if "|" not in reply or "-" not in reply:
+        return rows, reply
+    fences = _fenced_spans(reply) if "```" in reply or "~~~" in reply else []
+    prose = []
+    last = 0
+    for block in _TABLE_BLOCK.finditer(reply):
+        if any(start <= block.start() < end for start, end in fences):
+            continue
+        header = _cells(block.group(1))
+        if len(header) != len(_cells(block.group(2))):
+            continue
+        mapping = _map_header(header)
+        if mapping is None:
+            continue
+        indexes = [(column, mapping.get(column, len(header))) for column in COLUMNS]
+        for line in block.group(3).split("\n")[1:]:
+            cells = _cells(line) + [""] * len(header)
+            row = {column: cells[index] for column, index in indexes}
+            if row["Recommendation"]:
+                row["Group"] = normalize_category(row["Category"])
+                rows.append(row)
+        prose.append(reply[last:block.start()])
+        last = block.end()
+    if not rows:
+        return rows, reply
+    prose.append(reply[last:])
+    return rows, _BLANK_RUN.sub("\n\n", "".join(prose)).strip()
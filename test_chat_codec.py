@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from chat_codec import CODEC_VERSION, decode_legacy_snapshot, decode_messages, decode_table, encode_messages, encode_table
+from chat_records import ChatMessage, Table
+
+# python -m pytest -q
+RECORDS = [
+    {"Category": "Clothing 🌿", "Recommendation": "Choose organic cotton", "Impact": "Less water"},
+    {"Category": "Care 🧼", "Recommendation": "Wash cold", "Impact": None},
+]
+
+# ===== VERSIONED CODEC =====
+def test_messages_round_trip():
+    messages = [
+        ChatMessage("assistant", "Welcome! 🌱", timestamp="2024-01-01T10:00:00"),
+        ChatMessage("user", "What are eco-friendly fabrics?", timestamp="2024-01-01T10:00:05"),
+        ChatMessage("assistant", "Here you go", Table.from_records(RECORDS), "2024-01-01T10:00:09"),
+    ]
+    decoded = decode_messages(encode_messages(messages))
+    assert [(m.role, m.content, m.timestamp) for m in decoded] == [(m.role, m.content, m.timestamp) for m in messages]
+    assert decoded[0].table is None and decoded[1].table is None
+    assert decoded[2].table.columns == ("Category", "Recommendation", "Impact")
+    assert decoded[2].table.records() == RECORDS
+
+def test_table_is_stored_column_wise():
+    encoded = json.loads(encode_table(RECORDS))
+    assert encoded == {"v": CODEC_VERSION, "columns": ["Category", "Recommendation", "Impact"],
+                       "data": [["Clothing 🌿", "Care 🧼"], ["Choose organic cotton", "Wash cold"], ["Less water", None]]}
+    assert decode_table(encode_table(RECORDS)).records() == RECORDS
+
+def test_empty_tables_are_none():
+    assert encode_table(None) is None
+    assert encode_table([]) is None
+    assert decode_table(None) is None
+    assert decode_table("") is None
+    assert decode_table("[]") is None
+
+def test_decode_table_reads_pre_versioned_records():
+    assert decode_table(json.dumps(RECORDS)).records() == RECORDS
+
+def test_newer_table_version_is_rejected():
+    with pytest.raises(ValueError, match="table codec version"):
+        decode_table(json.dumps({"v": CODEC_VERSION + 1, "columns": [], "data": []}))
+
+@pytest.mark.parametrize("version", [None, CODEC_VERSION + 1])
+def test_other_message_versions_are_rejected(version):
+    with pytest.raises(ValueError, match="message codec version"):
+        decode_messages(json.dumps({"v": version, "messages": []}))
+
+# ===== LEGACY SNAPSHOTS =====
+def test_legacy_snapshot_with_records():
+    snapshot = str([
+        {"role": "user", "content": "Any tips?", "table_data": None, "timestamp": "2024-01-01T10:00:05"},
+        {"role": "assistant", "content": "Sure", "table_data": RECORDS, "timestamp": "2024-01-01T10:00:09"},
+    ])
+    decoded = decode_legacy_snapshot(snapshot)
+    assert [(m.role, m.content, m.timestamp) for m in decoded] == [
+        ("user", "Any tips?", "2024-01-01T10:00:05"), ("assistant", "Sure", "2024-01-01T10:00:09")]
+    assert decoded[0].table is None
+    assert decoded[1].table.records() == RECORDS
+
+def test_legacy_snapshot_with_dataframe_repr():
+    pandas = pytest.importorskip("pandas")
+    frame = pandas.DataFrame(RECORDS)
+    # Quotes, braces and a fake key in the text must not end a message early.
+    content = "It's {'timestamp': 'x'} time"
+    snapshot = str([
+        {"role": "user", "content": content, "table_data": None, "timestamp": "2024-01-01T10:00:05"},
+        {"role": "assistant", "content": "Sure", "table_data": frame, "timestamp": "2024-01-01T10:00:09"},
+        {"role": "user", "content": "Thanks", "table_data": None, "timestamp": None},
+    ])
+    decoded = decode_legacy_snapshot(snapshot)
+    assert [(m.role, m.timestamp) for m in decoded] == [
+        ("user", "2024-01-01T10:00:05"), ("assistant", "2024-01-01T10:00:09"), ("user", None)]
+    assert decoded[0].content == content
+    assert decoded[1].table is None
+    assert decoded[1].content == f"Sure\n\n```\n{frame!r}\n```"
+    assert decoded[2].content == "Thanks"
+
+@pytest.mark.parametrize("text", ["", "not a list", "{'role': 'user'}", "[{'role': 'user', 'content': "])
+def test_unreadable_legacy_snapshot(text):
+    assert decode_legacy_snapshot(text) is None
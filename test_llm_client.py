@@ -0,0 +1,116 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import llm_client
+from llm_client import CancelEvent, CircuitBreaker, CircuitOpenError, post_with_retries
+from mock_llm import MockLLMConfig, MockLLMServer
+
+# python -m pytest -q
+@pytest.fixture
+def server(monkeypatch):
+    server = MockLLMServer(MockLLMConfig(latency=0.0, jitter=0.0, token_delay=0.0)).start()
+    monkeypatch.setattr(llm_client, "API_URL", server.url)
+    yield server
+    server.stop()
+
+def post(circuit, cancel=None):
+    headers, payload = llm_client.build_request("key", [{"role": "user", "content": "hi"}], model="m")
+    return post_with_retries(headers, payload, timeout=10, circuit=circuit, cancel=cancel)
+
+# ===== CIRCUIT BREAKER =====
+def half_open_circuit():
+    circuit = CircuitBreaker(threshold=1, cooldown=0.0)
+    circuit.record_failure()
+    return circuit
+
+@pytest.mark.parametrize("outage, cancel_after", [
+    ({}, None),                                           # cancelled before it is sent
+    ({"latency": 5.0}, 0.2),                              # cancelled waiting for headers
+    ({"rate_limit_rate": 1.0, "retry_after": 5}, 0.2),    # cancelled in the backoff wait
+])
+def test_cancelled_trial_frees_the_half_open_slot(server, outage, cancel_after):
+    for name, value in outage.items():
+        setattr(server.config, name, value)
+    circuit = half_open_circuit()
+    cancel = CancelEvent()
+    if cancel_after is None:
+        cancel.set()
+    else:
+        threading.Timer(cancel_after, cancel.set).start()
+    with pytest.raises(requests.exceptions.RequestException) as raised:
+        post(circuit, cancel)
+    assert not isinstance(raised.value, CircuitOpenError)
+    assert not circuit.trial_in_flight
+    # The backend recovers: the next trial goes through and closes the circuit.
+    server.config.latency, server.config.rate_limit_rate = 0.0, 0.0
+    post(circuit).close()
+    assert circuit.opened_at is None
+
+def test_trial_in_flight_fails_fast(server):
+    circuit = half_open_circuit()
+    circuit.before_request()
+    with pytest.raises(CircuitOpenError):
+        post(circuit)
+
+# ===== STREAMING =====
+def test_sse_events_join_data_lines_and_stop_at_done():
+    lines = [": OPENROUTER PROCESSING", "", "data: one", "", "data: {\"a\":", "data:  1}", "id: 7", "",
+             ":keep-alive", "data:[DONE]", "", "data: after done", ""]
+    assert list(llm_client.iter_sse_data(lines)) == ["one", "{\"a\":\n 1}"]
+
+def test_sse_last_event_without_blank_line_or_done():
+    assert list(llm_client.iter_sse_data(["data: one", "", None, "data: two"])) == ["one", "two"]
+    assert list(llm_client.iter_sse_data(["data: [DONE]"])) == []
+
+def test_stream_reassembles_the_reply(server):
+    from mock_llm import REPLY_TEMPLATE
+    messages = [{"role": "user", "content": "linen"}]
+    assert "".join(llm_client.stream_completion("key", messages, model="m")) == REPLY_TEMPLATE.format(prompt="linen")
+    assert server.config.counts["streamed"] == 1
+
+class _ScriptedSSE(BaseHTTPRequestHandler):
+    # Sends the server's `body` as-is and closes the connection.
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.write(self.server.body.encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def scripted(monkeypatch):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _ScriptedSSE)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(llm_client, "API_URL", "http://127.0.0.1:%d/" % httpd.server_address[1])
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def delta(text):
+    return "data: " + json.dumps({"choices": [{"delta": {"content": text}}]}) + "\n\n"
+
+def stream(scripted, body):
+    scripted.body = body
+    return llm_client.stream_completion("key", [{"role": "user", "content": "hi"}], model="m", max_retries=0,
+                                        circuit=CircuitBreaker())
+
+def test_stream_skips_comments_and_joins_multiline_data(scripted):
+    body = ": OPENROUTER PROCESSING\n\n" + delta("Hello") + ": keep-alive\n\n"
+    body += 'data: {"choices": [{"delta":\ndata: {"content": " world"}}]}\n\n' + "data: [DONE]\n\n" + delta("ignored")
+    assert list(stream(scripted, body)) == ["Hello", " world"]
+
+def test_stream_without_done_keeps_every_chunk(scripted):
+    assert list(stream(scripted, delta("Hello") + delta(" world").rstrip("\n"))) == ["Hello", " world"]
+
+def test_stream_error_event_raises_after_earlier_chunks(scripted):
+    chunks = stream(scripted, delta("Hello") + 'data: {"error": {"message": "Upstream overloaded"}}\n\n' + delta("late"))
+    assert next(chunks) == "Hello"
+    with pytest.raises(requests.exceptions.RequestException, match="Upstream overloaded"):
+        next(chunks)
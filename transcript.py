@@ -0,0 +1,80 @@
+import os
+from table_parser import COLUMNS, category_groups
+
+# ===== TRANSCRIPT RENDER CACHE =====
+# Everything a rerun needs to draw a message is computed once when the
+# message is first seen: an index from category group to table rows, its
+# timestamp label and its chunk of the Markdown export. Messages are
+# append-only, so new ones extend the cache; a replaced transcript (loading,
+# resuming or clearing a chat) rebuilds it.
+CATEGORY_FILTERS = ("All", "Clothing", "Shopping", "Care", "Resources")
+TRANSCRIPT_WINDOW = int(os.environ.get("TRANSCRIPT_WINDOW", "20"))
+
+class RenderedMessage:
+    def __init__(self, message):
+        self.role = message.role
+        self.content = message.content
+        self.timestamp = message.timestamp[:19] if message.timestamp else None
+        self.table = message.table
+        self.rows_by_group = {}
+        if self.table is not None:
+            for row, group in enumerate(category_groups(self.table)):
+                self.rows_by_group.setdefault(group, []).append(row)
+        self.views = {}
+
+    def table_view(self, category_filter):
+        # Filtered tables are memoized per category as plain column dicts;
+        # None means nothing to show.
+        if self.table is None:
+            return None
+        if category_filter not in self.views:
+            columns = [c for c in COLUMNS if c in self.table.columns] or None
+            if category_filter == "All":
+                view = self.table.select(columns=columns)
+            elif category_filter in self.rows_by_group:
+                view = self.table.select(self.rows_by_group[category_filter], columns)
+            else:
+                view = None
+            self.views[category_filter] = view
+        return self.views[category_filter]
+
+    def export_text(self):
+        return f"**{self.role.capitalize()}** ({self.timestamp}):\n{self.content}"
+
+class Transcript:
+    def __init__(self, window=TRANSCRIPT_WINDOW):
+        self.window_size = window
+        self.messages = None
+        self.rendered = []
+        self.export = ""
+        self.window = window
+        # Category group -> [(message number, row numbers)] for this conversation.
+        self.category_index = {}
+
+    def sync(self, messages):
+        if messages is not self.messages or len(messages) < len(self.rendered):
+            self.messages = messages
+            self.rendered = []
+            self.export = ""
+            self.window = self.window_size
+            self.category_index = {}
+        for message in messages[len(self.rendered):]:
+            rendered = RenderedMessage(message)
+            for group, rows in rendered.rows_by_group.items():
+                self.category_index.setdefault(group, []).append((len(self.rendered), rows))
+            self.rendered.append(rendered)
+            if rendered.content:
+                self.export += ("\n\n" if self.export else "") + rendered.export_text()
+        return self
+
+    def category_count(self, group):
+        return sum(len(rows) for _, rows in self.category_index.get(group, ()))
+
+    def visible(self):
+        return self.rendered[-self.window:]
+
+    def hidden_count(self):
+        return max(0, len(self.rendered) - self.window)
+
+    def load_earlier(self):
+        self.window += self.window_size
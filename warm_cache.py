@@ -0,0 +1,103 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from chat_records import ChatMessage
+from llm_client import get_completion
+from prompts import SAMPLE_QUESTIONS, DETAIL_LEVELS, build_api_messages
+from response_cache import fingerprint
+from semantic_cache import semantic_cache
+from storage import get_storage
+from table_parser import extract_table
+
+# Precomputes cached answers for the sample-question buttons and popular
+# prompts at every detail level, e.g.
+#   python warm_cache.py --prompts-file popular_prompts.txt --workers 4
+#   python warm_cache.py --every 21600   # refresh every 6 hours
+# Entries go through get_storage(), so with STORAGE_BACKEND=http they land
+# in the shared cache every replica reads.
+
+def load_api_key():
+    if os.environ.get("API_KEY"):
+        return os.environ["API_KEY"]
+    import toml
+    try:
+        return toml.load(os.path.join(".streamlit", "secrets.toml"))["API_KEY"]
+    except (FileNotFoundError, KeyError):
+        raise SystemExit("Set API_KEY or add it to .streamlit/secrets.toml")
+
+def load_prompts(prompts_file):
+    prompts = list(SAMPLE_QUESTIONS)
+    if prompts_file:
+        with open(prompts_file, encoding="utf-8") as f:
+            prompts += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return list(dict.fromkeys(prompts))
+
+def build_jobs(prompts, detail_levels, deep_search):
+    jobs = []
+    for prompt in prompts:
+        for detail_level in detail_levels:
+            for deep in ([False, True] if deep_search else [False]):
+                # Same shape as the first question of a fresh chat; the
+                # greeting never contributes to the cache key.
+                messages = [ChatMessage("user", prompt)]
+                api_messages = build_api_messages(messages, detail_level, deep)
+                jobs.append((prompt, detail_level, deep, api_messages, fingerprint(api_messages, detail_level, deep)))
+    return jobs
+
+def warm_one(api_key, job):
+    prompt, detail_level, deep, api_messages, key = job
+    raw_reply = get_completion(api_key, api_messages)["choices"][0]["message"]["content"]
+    table_data, reply = extract_table(raw_reply)
+    get_storage().put_cached_response(key, raw_reply, {"rows": table_data, "prose": reply})
+    semantic_cache.remember(key, api_messages, detail_level, deep)
+    return len(table_data)
+
+def warm(api_key, jobs, workers, max_age):
+    pending = []
+    for job in jobs:
+        age = get_storage().get_cache_age(job[4])
+        if age is None or age > max_age:
+            pending.append(job)
+    print(f"{len(jobs) - len(pending)} fresh, {len(pending)} to compute with {workers} workers")
+    ok = failed = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(warm_one, api_key, job): job for job in pending}
+        for future in as_completed(futures):
+            prompt, detail_level, deep, _, _ = futures[future]
+            label = f"[{detail_level}{' +deep' if deep else ''}] {prompt}"
+            try:
+                rows = future.result()
+                ok += 1
+                print(f"ok     {label} ({rows} table rows)")
+            except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+                failed += 1
+                print(f"failed {label}: {e}")
+    print(f"done in {time.perf_counter() - started:.1f}s: {ok} cached, {failed} failed, {get_storage().cache_stats()['entries']} entries total")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm the response cache for sample and popular prompts")
+    parser.add_argument("--prompts-file", help="Extra prompts, one per line (# for comments)")
+    parser.add_argument("--detail-levels", nargs="+", choices=DETAIL_LEVELS, default=DETAIL_LEVELS)
+    parser.add_argument("--deep-search", action="store_true", help="Also warm the DeepSearch variants")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum concurrent completion requests")
+    parser.add_argument("--max-age", type=float, default=24 * 3600,
+                        help="Recompute entries older than this many seconds (0 forces a full refresh)")
+    parser.add_argument("--every", type=float, help="Keep running and refresh every N seconds")
+    args = parser.parse_args()
+
+    api_key = load_api_key()
+    jobs = build_jobs(load_prompts(args.prompts_file), args.detail_levels, args.deep_search)
+    while True:
+        failed = warm(api_key, jobs, args.workers, args.max_age)
+        if not args.every:
+            raise SystemExit(1 if failed else 0)
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()